@@ -0,0 +1,51 @@
+# Offline storage benchmark against the in-memory Firestore stand-in.
+# Usage: python bench_storage.py [n_runs] [latency_ms]   (results also go to bench_output.txt)
+import os
+import sys
+import time
+import random
+from datetime import date, timedelta
+
+os.environ.setdefault("RUNLOG_FAKE_FIRESTORE", "bench")
+import fake_firestore
+import tracker
+
+def synthetic_runs(n, seed=7):
+    rnd = random.Random(seed)
+    start = date.today() - timedelta(days=n)
+    for i in range(n):
+        dist = round(rnd.uniform(4, 22), 2)
+        yield str(1_700_000_000 + i), {"date": (start + timedelta(days=i)).strftime('%Y-%m-%d'), "type": "Run", "distance": dist,
+                                      "duration": round(dist * rnd.uniform(4.8, 6.5), 1), "avgHr": rnd.randint(135, 170), "notes": "bench"}
+
+def timed(label, fn, rows):
+    t = time.perf_counter(); fn(); elapsed = time.perf_counter() - t
+    rows.append(f"{label:<28} {elapsed * 1000:>10.1f} ms")
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    db = fake_firestore.client_from_env()
+    docs = list(synthetic_runs(n))
+    rows = [f"runs={n} latency={latency}ms"]
+
+    db.latency_ms = latency
+    def single_writes():
+        for doc_id, doc in docs[:100]: db.collection("runs").document(doc_id).set(doc)
+    def batched_writes():
+        for i in range(0, n, fake_firestore.MAX_BATCH_OPS):
+            batch = db.batch()
+            for doc_id, doc in docs[i:i + fake_firestore.MAX_BATCH_OPS]: batch.set(db.collection("runs").document(doc_id), doc)
+            batch.commit()
+    timed("100 single set()", single_writes, rows)
+    timed(f"{n} batched set()", batched_writes, rows)
+    timed("load_data()", tracker.load_data, rows)
+    timed("range query (last 28d)", lambda: list(db.collection("runs").where("date", ">=", (date.today() - timedelta(days=28)).strftime('%Y-%m-%d')).stream()), rows)
+    rows.append(f"stats {db.stats}")
+
+    out = "\n".join(rows)
+    print(out)
+    with open("bench_output.txt", "w") as f: f.write(out + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# In-memory stand-in for the subset of the Firestore client used by tracker.py.
+# Enable it with RUNLOG_FAKE_FIRESTORE=1; see client_from_env() for the tuning knobs.
+import copy
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+try:
+    from google.api_core.exceptions import ServiceUnavailable as _Unavailable, InvalidArgument as _InvalidArgument, NotFound as _NotFound
+except ImportError:
+    _Unavailable = _InvalidArgument = _NotFound = None
+
+MAX_DOC_BYTES = 1_048_576
+MAX_BATCH_OPS = 500
+
+class FakeFirestoreError(Exception):
+    pass
+
+def _unavailable(msg):
+    return _Unavailable(msg) if _Unavailable else FakeFirestoreError(msg)
+
+def _invalid(msg):
+    return _InvalidArgument(msg) if _InvalidArgument else ValueError(msg)
+
+def _not_found(msg):
+    return _NotFound(msg) if _NotFound else FakeFirestoreError(msg)
+
+# --- Field helpers ---
+def _get_field(data, path):
+    cur = data
+    for part in path.split('.'):
+        if not isinstance(cur, dict) or part not in cur: return None, False
+        cur = cur[part]
+    return cur, True
+
+def _is_sentinel(value, name):
+    return type(value).__name__ == name
+
+def _check_value(value, in_array=False):
+    if isinstance(value, (list, tuple)):
+        if in_array: raise _invalid("Cannot nest arrays directly inside arrays")
+        for v in value: _check_value(v, True)
+    elif isinstance(value, dict):
+        for v in value.values(): _check_value(v)
+
+def _apply_value(current, value):
+    if _is_sentinel(value, 'ArrayUnion'):
+        base = list(current) if isinstance(current, list) else []
+        return base + [v for v in value.values if v not in base]
+    if _is_sentinel(value, 'ArrayRemove'):
+        return [v for v in (current if isinstance(current, list) else []) if v not in value.values]
+    if _is_sentinel(value, 'Increment'):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if _is_sentinel(value, 'Sentinel') and 'timestamp' in getattr(value, 'description', ''):
+        return datetime.now(timezone.utc)
+    return copy.deepcopy(value)
+
+def _merge(target, updates):
+    for k, v in updates.items():
+        if _is_sentinel(v, 'Sentinel') and 'delete' in getattr(v, 'description', ''): target.pop(k, None)
+        elif isinstance(v, dict) and isinstance(target.get(k), dict): _merge(target[k], v)
+        else: target[k] = _apply_value(target.get(k), v)
+
+def _resolve(data):
+    out = {}
+    _merge(out, data)
+    return out
+
+def _matches(data, field, op, value):
+    current, found = _get_field(data, field)
+    if op == '!=' or op == 'not-in':
+        if not found: return False
+        return current != value if op == '!=' else current not in value
+    if not found: return False
+    try:
+        if op == '==': return current == value
+        if op == '<': return current < value
+        if op == '<=': return current <= value
+        if op == '>': return current > value
+        if op == '>=': return current >= value
+        if op == 'in': return current in value
+        if op == 'array_contains': return isinstance(current, list) and value in current
+        if op == 'array_contains_any': return isinstance(current, list) and any(v in current for v in value)
+    except TypeError: return False
+    raise _invalid(f"Unsupported operator {op}")
+
+# --- Snapshots ---
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference, self._data = reference, data
+        self.id = reference.id
+        self.exists = data is not None
+        self.read_time = datetime.now(timezone.utc)
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return copy.deepcopy(_get_field(self._data or {}, field_path)[0])
+
+class Watch:
+    def __init__(self, client, key):
+        self._client, self._key = client, key
+
+    def unsubscribe(self):
+        self._client._listeners.pop(self._key, None)
+
+# --- References ---
+class Query:
+    def __init__(self, client, path, filters=(), orders=(), limit=None):
+        self._client, self._path = client, path
+        self._filters, self._orders, self._limit = list(filters), list(orders), limit
+
+    def _copy(self, **kw):
+        q = Query(self._client, self._path, self._filters, self._orders, self._limit)
+        for k, v in kw.items(): setattr(q, k, v)
+        return q
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None: field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(_filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(_orders=self._orders + [(field_path, str(direction).upper().startswith("DESC"))])
+
+    def limit(self, count):
+        return self._copy(_limit=count)
+
+    def _run(self):
+        docs = self._client._list(self._path)
+        docs = [(doc_id, data) for doc_id, data in docs if all(_matches(data, f, op, v) for f, op, v in self._filters)]
+        for field, desc in reversed(self._orders):
+            docs.sort(key=lambda item: (_get_field(item[1], field)[0] is None, _get_field(item[1], field)[0]), reverse=desc)
+        if self._limit is not None: docs = docs[:self._limit]
+        return [DocumentSnapshot(DocumentReference(self._client, f"{self._path}/{doc_id}"), data) for doc_id, data in docs]
+
+    def stream(self, transaction=None):
+        self._client._rpc("query", reads=1)
+        snaps = self._run()
+        self._client._count("doc_reads", max(len(snaps), 1))
+        return iter(snaps)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id).set(document_data)
+        return datetime.now(timezone.utc), ref
+
+    def list_documents(self):
+        return [DocumentReference(self._client, f"{self._path}/{doc_id}") for doc_id, _ in self._client._list(self._path)]
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client, self.path = client, path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._rpc("get", reads=1)
+        return DocumentSnapshot(self, self._client._read(self.path))
+
+    def set(self, document_data, merge=False):
+        self._client._rpc("set", writes=1)
+        self._client._commit([("set", self.path, document_data, merge)])
+        return self
+
+    def update(self, field_updates):
+        self._client._rpc("update", writes=1)
+        self._client._commit([("update", self.path, field_updates, True)])
+        return self
+
+    def delete(self):
+        self._client._rpc("delete", writes=1)
+        self._client._commit([("delete", self.path, None, False)])
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client, self._ops = client, []
+
+    def _add(self, op):
+        if len(self._ops) >= MAX_BATCH_OPS: raise _invalid(f"Batch exceeds {MAX_BATCH_OPS} operations")
+        self._ops.append(op)
+        return self
+
+    def set(self, reference, document_data, merge=False): return self._add(("set", reference.path, document_data, merge))
+    def update(self, reference, field_updates): return self._add(("update", reference.path, field_updates, True))
+    def delete(self, reference): return self._add(("delete", reference.path, None, False))
+
+    def commit(self):
+        self._client._rpc("commit", writes=len(self._ops))
+        self._client._commit(self._ops)
+        ops, self._ops = self._ops, []
+        return [datetime.now(timezone.utc) for _ in ops]
+
+# --- Client ---
+class FakeFirestoreClient:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, ops_per_sec=None, error_rate=0.0, seed=None):
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.ops_per_sec, self.error_rate = ops_per_sec, error_rate
+        self._rand = random.Random(seed)
+        self._docs = {}
+        self._lock = threading.RLock()
+        self._listeners = {}
+        self._fail_queue = []
+        self._bucket, self._bucket_ts = float(ops_per_sec or 0), time.monotonic()
+        self.stats = {}
+
+    # Fault and performance injection
+    def fail_next(self, count=1, exc=None, op=None):
+        self._fail_queue.extend([(op, exc)] * count)
+
+    def reset_stats(self):
+        with self._lock: self.stats = {}
+
+    def _count(self, key, n=1):
+        with self._lock: self.stats[key] = self.stats.get(key, 0) + n
+
+    def _throttle(self, units):
+        if not self.ops_per_sec: return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._bucket = min(float(self.ops_per_sec), self._bucket + (now - self._bucket_ts) * self.ops_per_sec)
+                self._bucket_ts = now
+                if self._bucket >= units or self._bucket >= self.ops_per_sec:
+                    self._bucket -= units
+                    return
+                wait = (units - self._bucket) / self.ops_per_sec
+            self._count("throttled_s", wait)
+            time.sleep(wait)
+
+    def _rpc(self, op, reads=0, writes=0):
+        self._count(f"rpc_{op}")
+        if writes: self._count("doc_writes", writes)
+        if reads: self._count("doc_reads_rpc", reads)
+        self._throttle(max(reads + writes, 1))
+        delay = max(0.0, self.latency_ms + self._rand.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+        if delay:
+            self._count("latency_s", delay)
+            time.sleep(delay)
+        with self._lock:
+            idx = next((i for i, (fop, _) in enumerate(self._fail_queue) if fop in (None, op)), None)
+            queued = self._fail_queue.pop(idx) if idx is not None else None
+        if queued is not None:
+            self._count("injected_errors")
+            raise queued[1] or _unavailable(f"Injected failure on {op}")
+        if self.error_rate and self._rand.random() < self.error_rate:
+            self._count("injected_errors")
+            raise _unavailable(f"Injected failure on {op}")
+
+    # Storage
+    def _read(self, path):
+        with self._lock:
+            data = self._docs.get(path)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _list(self, collection_path):
+        prefix = collection_path + '/'
+        with self._lock:
+            return [(p[len(prefix):], copy.deepcopy(d)) for p, d in self._docs.items() if p.startswith(prefix) and '/' not in p[len(prefix):]]
+
+    def _commit(self, ops):
+        with self._lock:
+            staged = {}
+            for kind, path, payload, merge in ops:
+                current = staged[path] if path in staged else self._docs.get(path)
+                if kind == "delete": staged[path] = None; continue
+                if kind == "update" and current is None: raise _not_found(f"No document to update: {path}")
+                _check_value(payload)
+                doc = copy.deepcopy(current) if (merge and current is not None) else {}
+                _merge(doc, payload) if merge else doc.update(_resolve(payload))
+                if len(json.dumps(doc, default=str)) > MAX_DOC_BYTES: raise _invalid(f"Document exceeds 1 MiB: {path}")
+                staged[path] = doc
+            for path, doc in staged.items():
+                if doc is None: self._docs.pop(path, None)
+                else: self._docs[path] = doc
+            listeners = list(self._listeners.values())
+        changed = set(staged)
+        for target, callback in listeners:
+            watched = target.path if isinstance(target, DocumentReference) else target._path
+            if any(p == watched or p.rsplit('/', 1)[0] == watched for p in changed): self._notify(target, callback)
+
+    def _listen(self, target, callback):
+        key = uuid.uuid4().hex
+        with self._lock: self._listeners[key] = (target, callback)
+        self._notify(target, callback)
+        return Watch(self, key)
+
+    def _notify(self, target, callback):
+        now = datetime.now(timezone.utc)
+        if isinstance(target, DocumentReference): snaps = [DocumentSnapshot(target, self._read(target.path))]
+        else: snaps = target._run()
+        callback(snaps, [], now)
+
+    # Public client API
+    def collection(self, collection_path):
+        return CollectionReference(self, collection_path.strip('/'))
+
+    def document(self, document_path):
+        return DocumentReference(self, document_path.strip('/'))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def collections(self):
+        with self._lock: roots = sorted({p.split('/', 1)[0] for p in self._docs})
+        return [CollectionReference(self, r) for r in roots]
+
+    def seed_local_data(self, data):
+        # Seeds from the offline run_tracker_data.json layout.
+        with self._lock:
+            for coll in ("runs", "health_logs"):
+                for doc in data.get(coll, []): self._docs[f"{coll}/{doc['id']}"] = copy.deepcopy({k: v for k, v in doc.items() if k != 'id'})
+            if data.get("user_profile"): self._docs["settings/profile"] = copy.deepcopy(data["user_profile"])
+            plan = {k: data[k] for k in ("cycles", "weekly_plan") if k in data}
+            if plan: self._docs["settings/plan"] = copy.deepcopy(plan)
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def client_from_env(env=None):
+    env = os.environ if env is None else env
+    with _shared_lock:
+        name = env.get("RUNLOG_FAKE_FIRESTORE", "default")
+        if name not in _shared:
+            ops = env.get("RUNLOG_FAKE_OPS_PER_SEC")
+            client = FakeFirestoreClient(latency_ms=float(env.get("RUNLOG_FAKE_LATENCY_MS", 0)), jitter_ms=float(env.get("RUNLOG_FAKE_JITTER_MS", 0)),
+                                         ops_per_sec=float(ops) if ops else None, error_rate=float(env.get("RUNLOG_FAKE_ERROR_RATE", 0)))
+            seed_file = env.get("RUNLOG_FAKE_SEED_FILE")
+            if seed_file and os.path.exists(seed_file):
+                with open(seed_file, 'r') as f: client.seed_local_data(json.load(f))
+            _shared[name] = client
+        return _shared[name]
@@ -0,0 +1,197 @@
+# Concurrent-session load test: drives tracker.py through streamlit.testing AppTest sessions
+# against the in-memory Firestore stand-in seeded with a synthetic dataset.
+# AppTest.run() patches process globals (Runtime._instance, config options), so reruns from different
+# sessions are serialised behind one lock and only the time inside it is recorded. Sessions still share
+# the store, the cached resources and the report executor, whose jobs keep running concurrently.
+# Usage: python loadtest.py --sessions 8 --iterations 3 --runs 1500 --latency-ms 5
+import argparse
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TRACKER = os.path.join(ROOT, "tracker.py")
+NAV = ["Training Status", "Cardio Training", "Strength Training", "Activity Calendar", "Records", "Intensity", "Gear", "Forecast", "Compliance", "Export"]
+
+# Each rerun executes tracker.py inside a wrapper that records the script thread's CPU time and,
+# when asked, the deep size of the session state.
+WRAPPER = f"""
+import sys, time
+sys.path.insert(0, {ROOT!r})
+import streamlit as st
+import loadtest
+_cpu = time.thread_time()
+try:
+    exec(loadtest.tracker_code(), {{"__name__": "__main__", "__file__": {TRACKER!r}}})
+finally:
+    st.session_state["_lt_cpu"] = time.thread_time() - _cpu
+    if st.session_state.get("_lt_measure"):
+        st.session_state["_lt_mem"] = loadtest.deep_size({{k: st.session_state[k] for k in st.session_state if not str(k).startswith("_lt_")}})
+"""
+
+_code, _code_lock = None, threading.Lock()
+_run_lock = threading.Lock()
+
+def tracker_code():
+    global _code
+    with _code_lock:
+        if _code is None:
+            with open(TRACKER, 'r') as f: _code = compile(f.read(), TRACKER, 'exec')
+    return _code
+
+def deep_size(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen: return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray): return obj.nbytes
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'columns'): return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict): size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)): size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type): size += deep_size(vars(obj), seen)
+    return size
+
+def synthetic_dataset(n_runs, seed=11):
+    rnd = random.Random(seed)
+    today = date.today()
+    runs, logs = [], []
+    for i in range(n_runs):
+        d = today - timedelta(days=int(i * 0.8))
+        act = rnd.choices(["Run", "Walk", "Ultimate"], [0.7, 0.2, 0.1])[0]
+        dist = round(rnd.uniform(3, 21) if act == "Run" else rnd.uniform(2, 8), 2)
+        dur = round(dist * rnd.uniform(4.8, 6.8) if act == "Run" else dist * 11, 1)
+        zones = np.round(np.array(rnd.choice([[0.1, 0.6, 0.2, 0.08, 0.02], [0.05, 0.3, 0.3, 0.25, 0.1]])) * dur, 1).tolist()
+        runs.append({"id": str(1_600_000_000 + i), "date": d.strftime('%Y-%m-%d'), "type": act, "distance": dist, "duration": dur,
+                     "avgHr": rnd.randint(125, 172), "rpe": rnd.randint(3, 9), "feel": rnd.choice(["Good", "Normal", "Tired"]),
+                     "cadence": rnd.randint(160, 182), "power": 0, "elevation": rnd.randint(0, 200), "shoe_id": "default",
+                     "z1": zones[0], "z2": zones[1], "z3": zones[2], "z4": zones[3], "z5": zones[4],
+                     "notes": rnd.choice(["easy", "tempo", "long run", "intervals 6x800", "recovery", ""])})
+    for i in range(max(n_runs // 2, 60)):
+        d = today - timedelta(days=i)
+        logs.append({"id": d.strftime('%Y%m%d'), "date": d.strftime('%Y-%m-%d'), "rhr": rnd.randint(46, 58), "hrv": rnd.randint(40, 85),
+                     "sleepHours": round(rnd.uniform(5.5, 8.5), 1)})
+    return {"runs": runs, "health_logs": logs, "user_profile": {"hrMax": 190, "hrRest": 50, "gender": "Male"}}
+
+class Session:
+    def __init__(self, idx, timeout, rng):
+        from streamlit.testing.v1 import AppTest
+        self.idx, self.rng = idx, rng
+        self.at = AppTest.from_string(WRAPPER, default_timeout=timeout)
+        self.samples, self.cpu, self.errors = [], 0.0, []
+
+    def _run(self, action, fn):
+        # Returns the app time of this interaction; waiting for the lock is not counted.
+        with _run_lock:
+            t = time.perf_counter()
+            try:
+                fn()
+                if self.at.exception: self.errors.append(f"{action}: {self.at.exception[0].value}")
+            except Exception as e:
+                self.errors.append(f"{action}: {e}")
+            elapsed = time.perf_counter() - t
+            try: self.cpu += float(self.at.session_state["_lt_cpu"])
+            except Exception: pass
+        self.samples.append((action, elapsed))
+        return elapsed
+
+    def _button(self, label):
+        return next(b for b in self.at.button if b.label == label)
+
+    def navigate(self, tab):
+        self._run(f"nav:{tab}", lambda: self.at.sidebar.radio[0].set_value(tab).run())
+
+    def log_activity(self):
+        def fill_and_save():
+            self.at.number_input(key="dist_new").set_value(round(self.rng.uniform(4, 15), 2))
+            self.at.text_input(key="dur_new").set_value(f"00:{self.rng.randint(25, 59):02d}:00")
+            self.at.number_input(key="hr_new").set_value(self.rng.randint(130, 170))
+            self.at.text_area(key="notes_new").set_value(f"load test session {self.idx}")
+            self._button("Save Activity").click().run()
+        self._run("log_activity", fill_and_save)
+
+    def page_dashboard(self, pages=3):
+        for _ in range(pages): self._run("page_back", lambda: self._button("◀").click().run())
+        self._run("search", lambda: self.at.text_input(key="history_search").set_value(self.rng.choice(["tempo", "easy", "long"])).run())
+        self._run("search_clear", lambda: self.at.text_input(key="history_search").set_value("").run())
+
+    def generate_report(self, poll_timeout=60.0):
+        self._run("report_submit", lambda: self._button("📄 Generate Text Report").click().run())
+        t, deadline = time.perf_counter(), time.monotonic() + poll_timeout
+        while time.monotonic() < deadline:
+            job = self.at.session_state["report_job"] if "report_job" in self.at.session_state else None
+            if job is None or job.finished(): break
+            time.sleep(0.1)
+        queued = time.perf_counter() - t
+        self.samples.append(("report_total", queued + self._run("report_render", self.at.run)))
+
+    def scenario(self, iterations):
+        self._run("initial_load", self.at.run)
+        for _ in range(iterations):
+            for tab in self.rng.sample(NAV, len(NAV)): self.navigate(tab)
+            self.navigate("Cardio Training"); self.log_activity(); self.page_dashboard()
+            self.navigate("Export"); self.generate_report()
+        self.at.session_state["_lt_measure"] = True
+        self._run("measure", self.at.run)
+
+    def memory(self):
+        try: return int(self.at.session_state["_lt_mem"])
+        except Exception: return 0
+
+def percentiles(values, qs=(50, 90, 95, 99)):
+    arr = np.asarray(values) * 1000
+    return {f"p{q}": float(np.percentile(arr, q)) for q in qs} | {"max": float(arr.max()), "n": len(arr)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for tracker.py")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=1000, help="synthetic activities to seed")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ["RUNLOG_FAKE_FIRESTORE"] = "loadtest"
+    sys.path.insert(0, ROOT)
+    import fake_firestore
+    db = fake_firestore.client_from_env()
+    db.seed_local_data(synthetic_dataset(args.runs))
+    db.latency_ms, db.error_rate = args.latency_ms, args.error_rate
+    tracker_code()
+
+    tracemalloc.start()
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    sessions = [Session(i, args.timeout, random.Random(args.seed + i)) for i in range(args.sessions)]
+    threads = [threading.Thread(target=s.scenario, args=(args.iterations,), name=f"session-{s.idx}") for s in sessions]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+    _, peak = tracemalloc.get_traced_memory()
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    by_action = {}
+    for s in sessions:
+        for action, secs in s.samples: by_action.setdefault(action.split(':')[0], []).append(secs)
+    print(f"sessions={args.sessions} iterations={args.iterations} runs={args.runs} latency={args.latency_ms}ms wall={wall:.1f}s process_cpu={cpu:.1f}s")
+    print(f"{'interaction':<16}{'n':>6}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for action, values in sorted(by_action.items()):
+        p = percentiles(values)
+        print(f"{action:<16}{p['n']:>6}{p['p50']:>10.1f}{p['p90']:>10.1f}{p['p95']:>10.1f}{p['p99']:>10.1f}{p['max']:>10.1f}")
+    print(f"\n{'session':<10}{'script_cpu_s':>14}{'state_mb':>10}{'errors':>8}")
+    for s in sessions: print(f"{s.idx:<10}{s.cpu:>14.2f}{s.memory() / 1e6:>10.2f}{len(s.errors):>8}")
+    print(f"\ntracemalloc peak={peak / 1e6:.1f} MB  max RSS growth={(rss1 - rss0) / 1024:.1f} MB  firestore={db.stats}")
+    errors = [e for s in sessions for e in s.errors]
+    for e in errors[:10]: print("error:", e)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import io
+import os
+import sys
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("streamlit")
+os.environ.setdefault("RUNLOG_FAKE_FIRESTORE", "tests")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tracker
+
+
+def night_csv():
+    # One sample a minute from 23:00 to 07:00, heart rate only: no rmssd or sleep column.
+    start = datetime(2026, 3, 10, 23, 0)
+    rows = ["timestamp,hr"] + [f"{(start + timedelta(minutes=i)).isoformat()},{52 + i % 7}" for i in range(8 * 60)]
+    return io.StringIO("\n".join(rows))
+
+
+def test_import_without_rmssd_leaves_hrv_unset(monkeypatch):
+    saved = []
+    monkeypatch.setattr(tracker, "store_overnight", lambda series, nights: None)
+    monkeypatch.setattr(tracker, "save_health_logs", saved.extend)
+    monkeypatch.setattr(tracker.st, "session_state", SimpleNamespace(data={"health_logs": []}))
+
+    assert tracker.import_overnight(night_csv()) == 1
+    log = saved[0]
+    assert log["date"] == "2026-03-11"
+    assert "hrv" not in log
+    assert log["rhr"] >= 52
+    assert log["sleepHours"] > 7
+
+
+def test_daily_target_treats_missing_rhr_as_no_data():
+    engine = tracker.PhysiologyEngine({"hrRest": 50, "hrMax": 190})
+    assert engine.get_daily_target(None)["readiness"] == "Unknown"
+    assert engine.get_dynamic_daily_target(55, None, 54, 45)["hrv_stat"] == "No data"
@@ -0,0 +1,30 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("streamlit")
+os.environ.setdefault("RUNLOG_FAKE_FIRESTORE", "tests")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tracker
+
+
+def run(day, act, z2):
+    return {"date": day, "type": act, "z1": 0, "z2": z2, "z3": 0, "z4": 0, "z5": 0}
+
+
+def test_range_after_growth_keeps_other_types_aligned():
+    index = tracker.ZoneIndex([run("2026-03-10", "Run", 30), run("2026-03-11", "Walk", 20)])
+    # Prime both prefix sums before the array grows in either direction.
+    assert index.range(date(2026, 3, 1), date(2026, 3, 31), ["Run"])[1] == 30
+    assert index.range(date(2026, 3, 1), date(2026, 3, 31), ["Walk"])[1] == 20
+
+    index.add(run("2026-03-25", "Run", 40))
+    assert index.range(date(2026, 3, 1), date(2026, 3, 31), ["Walk"])[1] == 20
+    index.add(run("2026-02-20", "Run", 15))
+    assert index.range(date(2026, 3, 11), date(2026, 3, 11), ["Walk"])[1] == 20
+    assert index.range(date(2026, 2, 1), date(2026, 3, 31), ["Walk"])[1] == 20
+    assert index.range(date(2026, 2, 1), date(2026, 3, 31), ["Run"])[1] == 85
+    assert index.range(date(2026, 2, 1), date(2026, 3, 31))[1] == 105
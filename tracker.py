@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import json
 import os
 from datetime import datetime, timedelta, date, timezone
@@ -10,11 +11,30 @@ import copy
 import re
 import math
 import calendar
+import zlib
+import base64
+import heapq
+import bisect
+import io
+import tempfile
+import hashlib
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import statsmodels.api as sm
 import streamlit.components.v1 as components
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 # --- Firebase Init ---
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import NotFound
 
 if not firebase_admin._apps:
     try:
@@ -24,10 +44,15 @@ if not firebase_admin._apps:
     except Exception as e:
         pass
 
-try:
-    db = firestore.client()
-except:
-    db = None
+if os.environ.get("RUNLOG_FAKE_FIRESTORE"):
+    # Local in-memory stand-in for load tests and offline benchmarks
+    import fake_firestore
+    db = fake_firestore.client_from_env()
+else:
+    try:
+        db = firestore.client()
+    except:
+        db = None
 
 # --- Configuration & Styling ---
 st.set_page_config(
@@ -73,10 +98,12 @@ def setup_page():
 
 # --- Data Persistence Helper ---
 DATA_FILE = "run_tracker_data.json"
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 DEFAULT_DATA = {
     "runs": [], "health_logs": [],
     "user_profile": { "age": 30, "height": 175, "weight": 70, "gender": "Male", "hrMax": 190, "hrRest": 60, "vo2Max": 45, "monthAvgRHR": 60, "monthAvgHRV": 40, "zones": {"z1_u": 130, "z2_l": 131, "z2_u": 145, "z3_l": 146, "z3_u": 160, "z4_l": 161, "z4_u": 175, "z5_l": 176}},
-    "cycles": {"macro": "", "meso": "", "micro": ""}, "weekly_plan": {day: {"am": "", "pm": ""} for day in ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']}
+    "cycles": {"macro": "", "meso": "", "micro": ""}, "weekly_plan": {day: {"am": "", "pm": ""} for day in WEEKDAYS},
+    "performance_model": {}, "lifts": [], "gear": [], "plan_history": []
 }
 
 def load_data():
@@ -98,6 +125,15 @@ def load_data():
         health_ref = db.collection("health_logs").stream()
         for doc in health_ref:
             h = doc.to_dict(); h['id'] = doc.id; data["health_logs"].append(h)
+
+        for doc in db.collection("lifts").stream():
+            l = doc.to_dict(); l['id'] = doc.id; data["lifts"].append(l)
+
+        for doc in db.collection("gear").stream():
+            g = doc.to_dict(); g['id'] = doc.id; data["gear"].append(g)
+
+        for doc in db.collection("plan_history").stream():
+            p = doc.to_dict(); p['id'] = doc.id; data["plan_history"].append(p)
         
         settings_ref = db.collection("settings")
         prof_doc = settings_ref.document("profile").get()
@@ -109,18 +145,1792 @@ def load_data():
             if 'cycles' in plan_data: data['cycles'] = plan_data['cycles']
             if 'weekly_plan' in plan_data: data['weekly_plan'] = plan_data['weekly_plan']
 
+        model_doc = settings_ref.document("model").get()
+        if model_doc.exists: data['performance_model'] = model_doc.to_dict()
+
         data["runs"].sort(key=lambda x: x.get('date', ''), reverse=True)
         data["health_logs"].sort(key=lambda x: x.get('date', ''), reverse=True)
+        data["lifts"].sort(key=lambda x: x.get('date', ''), reverse=True)
+        data["plan_history"].sort(key=lambda x: x.get('date', ''), reverse=True)
         
     except Exception as e:
         st.error(f"Error loading data: {e}")
     return data
 
+def atomic_write(path, payload):
+    # Write-then-rename: a crash mid-write leaves the previous file intact.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload); f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
 def save_data(data):
-    with open(DATA_FILE, 'w') as f: json.dump(data, f, indent=4)
+    atomic_write(DATA_FILE, json.dumps(data, indent=4).encode())
 
 def persist():
+    st.session_state.data_version = st.session_state.get('data_version', 0) + 1
     if not db: save_data(st.session_state.data)
+    maybe_snapshot()
+
+def data_snapshot(data=None):
+    # Shallow copies: writes replace list entries rather than mutating them, so a worker thread sees a stable view.
+    data = data if data is not None else st.session_state.data
+    return {k: (list(v) if isinstance(v, list) else copy.deepcopy(v)) for k, v in data.items()}
+
+# --- Snapshots ---
+# Content-addressed, zlib-compressed objects (one per record; one per small section such as the
+# profile or plan) plus manifests mapping keys to object hashes. Deltas list only the records the
+# write hubs marked dirty; every SNAPSHOT_CHECKPOINT_EVERY snapshots a full manifest bounds how
+# many deltas a restore has to replay.
+SNAPSHOT_DIR = "run_tracker_snapshots"
+SNAPSHOT_LIST_KEYS = ("runs", "health_logs", "lifts", "plan_history")
+SNAPSHOT_CHECKPOINT_EVERY = 20
+SNAPSHOT_INTERVAL_S = 300
+SNAPSHOT_MAX_DIRTY = 50
+
+@st.cache_resource
+def _snapshot_lock():
+    return threading.Lock()
+
+def mark_dirty(collection, old, new):
+    # Journaled to disk at write time, so changes from every session (including ones that end
+    # before the next snapshot) reach the next delta.
+    entries = []
+    if old and (not new or str(old['id']) != str(new['id'])): entries.append([f"{collection}/{old['id']}", None])
+    if new: entries.append([f"{collection}/{new['id']}", put_object(new)])
+    with _snapshot_lock():
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(os.path.join(SNAPSHOT_DIR, "pending.jsonl"), 'a') as f: f.write("".join(json.dumps(e) + "\n" for e in entries))
+
+def pending_changes(with_offset=False):
+    # Also returns the byte offset read up to, so only consumed entries are cleared afterwards.
+    path, changes, offset = os.path.join(SNAPSHOT_DIR, "pending.jsonl"), {}, 0
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"): break  # torn final line, still being appended
+                offset += len(line)
+                try: key, digest = json.loads(line)
+                except ValueError: continue
+                changes[key] = digest
+    return (changes, offset) if with_offset else changes
+
+def clear_pending(offset=None):
+    path = os.path.join(SNAPSHOT_DIR, "pending.jsonl")
+    if not os.path.exists(path): return
+    rest = b""
+    if offset is not None:
+        with open(path, 'rb') as f: f.seek(offset); rest = f.read()
+    if rest: atomic_write(path, rest)
+    else: os.remove(path)
+
+def put_object(value):
+    raw = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str).encode()
+    digest = hashlib.sha256(raw).hexdigest()
+    path = os.path.join(SNAPSHOT_DIR, "objects", digest[:2], digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, zlib.compress(raw, 6))
+    return digest
+
+def get_object(digest):
+    with open(os.path.join(SNAPSHOT_DIR, "objects", digest[:2], digest), 'rb') as f: return json.loads(zlib.decompress(f.read()))
+
+def write_manifest(manifest):
+    os.makedirs(os.path.join(SNAPSHOT_DIR, "manifests"), exist_ok=True)
+    atomic_write(os.path.join(SNAPSHOT_DIR, "manifests", f"{manifest['id']}.json.z"), zlib.compress(json.dumps(manifest).encode(), 6))
+    atomic_write(os.path.join(SNAPSHOT_DIR, "HEAD"), manifest['id'].encode())
+
+def read_manifest(snapshot_id):
+    with open(os.path.join(SNAPSHOT_DIR, "manifests", f"{snapshot_id}.json.z"), 'rb') as f: return json.loads(zlib.decompress(f.read()))
+
+def snapshot_head():
+    path = os.path.join(SNAPSHOT_DIR, "HEAD")
+    if not os.path.exists(path): return None
+    with open(path, 'r') as f: return f.read().strip() or None
+
+def list_snapshots(limit=30):
+    folder = os.path.join(SNAPSHOT_DIR, "manifests")
+    if not os.path.isdir(folder): return []
+    ids = sorted((f[:-len(".json.z")] for f in os.listdir(folder) if f.endswith(".json.z")), reverse=True)[:limit]
+    return [read_manifest(i) for i in ids]
+
+def snapshot_state(snapshot_id):
+    chain, manifest = [], read_manifest(snapshot_id)
+    while manifest['kind'] != 'full':
+        chain.append(manifest); manifest = read_manifest(manifest['parent'])
+    state = dict(manifest['records'])
+    for delta in reversed(chain):
+        for key, digest in delta['records'].items():
+            if digest is None: state.pop(key, None)
+            else: state[key] = digest
+    return state
+
+def small_sections(data):
+    return {k: v for k, v in data.items() if k not in SNAPSHOT_LIST_KEYS}
+
+def create_snapshot(data, label="", full=False):
+    with _snapshot_lock():
+        dirty, offset = pending_changes(with_offset=True)
+        head = snapshot_head()
+        parent = read_manifest(head) if head else None
+        small = {k: put_object(v) for k, v in small_sections(data).items()}
+        full = full or parent is None or parent.get('depth', 0) + 1 >= SNAPSHOT_CHECKPOINT_EVERY
+        if not full: records = dict(small, **dirty)
+        else:
+            # Checkpoints roll the parent's state forward with the journal rather than trusting this
+            # session's copy of the data, which can miss other sessions' writes.
+            if parent: records = snapshot_state(head)
+            else: records = {f"{coll}/{r['id']}": put_object(r) for coll in SNAPSHOT_LIST_KEYS for r in data.get(coll, [])}
+            records.update(small)
+            for key, digest in dirty.items():
+                if digest is None: records.pop(key, None)
+                else: records[key] = digest
+        manifest = {"id": new_id(), "parent": head, "created": get_malaysia_time().strftime('%Y-%m-%d %H:%M:%S'), "label": label,
+                    "kind": "full" if full else "delta", "depth": 0 if full else parent.get('depth', 0) + 1,
+                    "changes": len(dirty) if not full else sum(1 for k in records if k.partition('/')[0] in SNAPSHOT_LIST_KEYS), "records": records}
+        write_manifest(manifest)
+        clear_pending(offset)
+    return manifest
+
+def maybe_snapshot(force=False, label=""):
+    if not force:
+        dirty, head = pending_changes(), os.path.join(SNAPSHOT_DIR, "HEAD")
+        if not dirty: return None
+        last = os.path.getmtime(head) if os.path.exists(head) else 0
+        if len(dirty) < SNAPSHOT_MAX_DIRTY and time.time() - last < SNAPSHOT_INTERVAL_S and last: return None
+    return create_snapshot(st.session_state.data, label=label)
+
+def restore_snapshot(snapshot_id, state=None):
+    data = copy.deepcopy(DEFAULT_DATA)
+    for coll in SNAPSHOT_LIST_KEYS: data[coll] = []
+    for key, digest in (state or snapshot_state(snapshot_id)).items():
+        coll, _, _ = key.partition('/')
+        if coll in SNAPSHOT_LIST_KEYS and '/' in key: data[coll].append(get_object(digest))
+        else: data[key] = get_object(digest)
+    for coll in SNAPSHOT_LIST_KEYS: data[coll].sort(key=lambda x: x.get('date', ''), reverse=True)
+    return data
+
+# --- Background Jobs ---
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="runlog")
+
+class BackgroundJob:
+    def __init__(self, label, keys, **meta):
+        self.label, self.keys, self.meta = label, list(keys), meta
+        self.fractions = {k: 0.0 for k in self.keys}
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        def run():
+            result = fn(*args, progress=lambda frac: self.report(key, frac), **kwargs)
+            self.report(key, 1.0)
+            return result
+        self.futures[key] = get_executor().submit(run)
+
+    def report(self, key, frac):
+        with self.lock: self.fractions[key] = max(self.fractions[key], frac)
+
+    def progress(self):
+        with self.lock: return sum(self.fractions.values()) / max(len(self.fractions), 1)
+
+    def finished(self):
+        return all(f.done() for f in self.futures.values())
+
+    def results(self):
+        return {k: f.result() for k, f in self.futures.items() if f.exception() is None}
+
+    def errors(self):
+        return {k: f.exception() for k, f in self.futures.items() if f.exception() is not None}
+
+# --- Activity Streams ---
+# Per-second HR / pace / cadence live outside the run docs so list views never read them.
+STREAMS_DIR = "run_tracker_streams"
+STREAM_DTYPES = {"hr": "u1", "pace": "<u2", "cadence": "u1"}
+
+def pack_stream(values, dtype):
+    arr = np.nan_to_num(np.asarray(values, dtype=float), nan=0.0, posinf=0.0, neginf=0.0)
+    info = np.iinfo(np.dtype(dtype))
+    arr = np.clip(np.rint(arr), info.min, info.max).astype(dtype)
+    return base64.b64encode(zlib.compress(arr.tobytes(), 9)).decode('ascii')
+
+def unpack_stream(blob, dtype):
+    return np.frombuffer(zlib.decompress(base64.b64decode(blob)), dtype=dtype)
+
+def parse_stream_file(uploaded):
+    df = pd.read_csv(uploaded)
+    cols = {str(c).strip().lower(): c for c in df.columns}
+    def col(*aliases):
+        name = next((cols[a] for a in aliases if a in cols), None)
+        return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float) if name is not None else None
+    raw = {"hr": col("hr", "heart_rate", "heartrate", "bpm"), "cadence": col("cadence", "cad", "spm")}
+    pace = col("pace")
+    if pace is not None: raw["pace"] = pace * 60  # min/km -> sec/km
+    else:
+        speed = col("speed", "speed_ms")
+        if speed is not None: raw["pace"] = np.divide(1000.0, speed, out=np.zeros_like(speed), where=speed > 0)
+    raw = {k: v for k, v in raw.items() if v is not None}
+    if not raw: return {}
+    t = col("time", "seconds", "elapsed")
+    if t is not None and np.isfinite(t).all() and len(t) > 1:
+        grid = np.arange(t[0], t[-1] + 1)  # resample to 1 Hz
+        raw = {k: np.interp(grid, t, np.nan_to_num(v)) for k, v in raw.items()}
+    return raw
+
+def store_streams(run_id, streams):
+    doc = {"len": int(max(len(v) for v in streams.values()))}
+    doc.update({k: pack_stream(v, STREAM_DTYPES[k]) for k, v in streams.items() if k in STREAM_DTYPES})
+    if db: db.collection("activity_streams").document(str(run_id)).set(doc)
+    else:
+        os.makedirs(STREAMS_DIR, exist_ok=True)
+        with open(os.path.join(STREAMS_DIR, f"{run_id}.json"), 'w') as f: json.dump(doc, f)
+
+def load_streams(run_id):
+    doc = None
+    if db:
+        snap = db.collection("activity_streams").document(str(run_id)).get()
+        if snap.exists: doc = snap.to_dict()
+    else:
+        path = os.path.join(STREAMS_DIR, f"{run_id}.json")
+        if os.path.exists(path):
+            with open(path, 'r') as f: doc = json.load(f)
+    if not doc: return {}
+    return {k: unpack_stream(doc[k], dt).astype(float) for k, dt in STREAM_DTYPES.items() if k in doc}
+
+def delete_streams(run_id):
+    if db: db.collection("activity_streams").document(str(run_id)).delete()
+    else:
+        path = os.path.join(STREAMS_DIR, f"{run_id}.json")
+        if os.path.exists(path): os.remove(path)
+
+def apply_stream_metrics(run, streams, engine):
+    hr = streams.get('hr')
+    if hr is not None and (hr > 0).any():
+        tiz = engine.time_in_zones(hr)
+        for i in range(5): run[f'z{i+1}'] = round(float(tiz[i]), 2)
+        run['streamLoad'], run['streamFocus'] = engine.calculate_stream_trimp(hr)
+        if not run.get('avgHr'): run['avgHr'] = int(round(hr[hr > 0].mean()))
+    cad = streams.get('cadence')
+    if cad is not None and not run.get('cadence') and (cad > 0).any(): run['cadence'] = int(round(cad[cad > 0].mean()))
+    if not run.get('duration'): run['duration'] = max(len(v) for v in streams.values()) / 60.0
+    run['splits'] = detect_splits(streams)
+    run['bestEfforts'] = detect_best_efforts(streams)
+    run['hasStreams'] = True
+    return run
+
+def _segment_means(values, starts, valid=None):
+    valid = np.ones_like(values, dtype=bool) if valid is None else valid
+    sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    counts = np.add.reduceat(valid.astype(float), starts)
+    return np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+def _run_lengths(state):
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(state.astype(np.int8))) + 1))
+    lengths = np.diff(np.append(starts, len(state)))
+    return starts, lengths
+
+def detect_splits(streams, smooth_s=15, min_segment_s=20):
+    pace = streams.get('pace'); hr = streams.get('hr')
+    n = max(len(v) for v in streams.values()) if streams else 0
+    if n < 60: return {}
+    hr = np.zeros(n) if hr is None else np.nan_to_num(hr[:n])
+    speed = np.zeros(n)
+    if pace is not None:
+        pace = np.nan_to_num(pace[:n])
+        speed[:len(pace)] = np.divide(1000.0, pace, out=np.zeros_like(pace), where=pace > 0)
+    splits = {}
+
+    # Laps: per-km splits from cumulative distance
+    dist = np.cumsum(speed)
+    if dist[-1] >= 1000:
+        marks = np.arange(1000, dist[-1], 1000)
+        starts = np.concatenate(([0], np.searchsorted(dist, marks) + 1))
+        starts = starts[starts < n]
+        lap_secs = np.diff(np.append(starts, n))
+        lap_dist = np.diff(np.append(dist[starts - 1].clip(0) * (starts > 0), dist[-1]))
+        lap_hr = _segment_means(hr, starts, hr > 0)
+        splits['laps'] = [{'d': int(t), 'm': int(round(m)), 'hr': int(round(h))} for t, m, h in zip(lap_secs, lap_dist, lap_hr)]
+
+    # Work/rest intervals: two-level change-point segmentation on the smoothed signal
+    signal = speed if (speed > 0).any() else hr
+    if not (signal > 0).any(): return splits
+    kernel = np.ones(smooth_s) / smooth_s
+    smooth = np.convolve(signal, kernel, mode='same')
+    lo, hi = np.percentile(smooth[smooth > 0], [20, 80])
+    if hi <= 0 or (hi - lo) / hi < 0.15: return splits
+    state = smooth > (lo + hi) / 2
+    for _ in range(10):
+        starts, lengths = _run_lengths(state)
+        short = lengths < min_segment_s
+        if not short.any() or len(starts) == 1: break
+        labels = np.repeat(np.arange(len(starts)), lengths)
+        state = np.where(short[labels], ~state, state)
+    starts, lengths = _run_lengths(state)
+    kinds = state[starts]
+    if kinds.sum() < 2: return splits
+    seg_dist = np.add.reduceat(speed, starts)
+    seg_hr = _segment_means(hr, starts, hr > 0)
+    splits['intervals'] = [{'k': 'W' if k else 'R', 's': int(s0), 'd': int(l), 'm': int(round(m)), 'hr': int(round(h))}
+                           for k, s0, l, m, h in zip(kinds, starts, lengths, seg_dist, seg_hr)]
+    return splits
+
+RECORD_DISTANCES = {"1k": 1.0, "5k": 5.0, "10k": 10.0, "Half": 21.0975, "Marathon": 42.195}
+RECORD_DISTANCE_SLACK = 1.05  # without streams, a run counts only for the distance it was (up to 5% over)
+
+def detect_best_efforts(streams):
+    pace = streams.get('pace')
+    if pace is None: return {}
+    pace = np.nan_to_num(pace)
+    dist = np.cumsum(np.divide(1000.0, pace, out=np.zeros_like(pace), where=pace > 0))
+    start_dist = np.concatenate(([0.0], dist[:-1]))
+    efforts = {}
+    for label, km in RECORD_DISTANCES.items():
+        if dist[-1] < km * 1000: continue
+        ends = np.searchsorted(dist, start_dist + km * 1000)
+        ok = ends < len(dist)
+        efforts[label] = int((ends[ok] - np.arange(len(dist))[ok] + 1).min())
+    return efforts
+
+def summarize_splits(splits):
+    intervals = splits.get('intervals', [])
+    work = [iv for iv in intervals if iv['k'] == 'W']
+    if not work: return ""
+    recoveries = [iv for iv in intervals[1:-1] if iv['k'] == 'R']
+    avg_work = sum(iv['d'] for iv in work) / len(work) / 60
+    work_dist = sum(iv['m'] for iv in work)
+    pace = format_pace((sum(iv['d'] for iv in work) / 60) / (work_dist / 1000)) if work_dist > 0 else "-"
+    txt = f"{len(work)} × {format_duration(avg_work)} @ {pace}/km"
+    if recoveries: txt += f" (rest {format_duration(sum(iv['d'] for iv in recoveries) / len(recoveries) / 60)})"
+    return txt
+
+# --- Overnight Series ---
+# Wearable overnight exports (HR / RMSSD samples, optional sleep stage) are packed per night with
+# pack_stream and reduced to one nightly RHR / HRV / sleep value that goes into health_logs.
+# Only the on-demand night chart ever unpacks the raw samples.
+OVERNIGHT_DIR = "run_tracker_overnight"
+OVERNIGHT_DTYPES = {"dt": "<u4", "hr": "u1", "rmssd": "<u2", "asleep": "u1"}
+NIGHT_SHIFT_S = 6 * 3600  # nights run 18:00-18:00 and are credited to the wake date
+SLEEP_WINDOW_H = (20, 11)  # without sleep stages, only samples between 20:00 and 11:00 count as sleep
+RHR_WINDOW_S = 300
+MIN_NIGHT_SLEEP_H = 1.0
+
+def parse_overnight_file(uploaded):
+    df = pd.read_csv(uploaded)
+    cols = {str(c).strip().lower(): c for c in df.columns}
+    def name(*aliases): return next((cols[a] for a in aliases if a in cols), None)
+    ts_col = name("timestamp", "time", "datetime", "date")
+    if ts_col is None: raise ValueError("no timestamp column")
+    raw = df[ts_col]
+    if pd.api.types.is_numeric_dtype(raw): ts = pd.to_datetime(raw, unit='ms' if raw.max() > 1e11 else 's') + pd.Timedelta(hours=8)
+    else:
+        try: ts = pd.to_datetime(raw, errors='coerce')
+        except (ValueError, TypeError): ts = pd.to_datetime(raw, errors='coerce', utc=True)
+        if ts.dt.tz is not None: ts = ts.dt.tz_convert('UTC').dt.tz_localize(None) + pd.Timedelta(hours=8)
+    keep = ts.notna().to_numpy()
+    t = ts.to_numpy()[keep].astype('datetime64[s]').astype(np.int64)
+    def num(*aliases):
+        c = name(*aliases)
+        return pd.to_numeric(df[c], errors='coerce').fillna(0).to_numpy(dtype=float)[keep] if c is not None else np.zeros(len(t))
+    series = {"t": t, "hr": num("hr", "heart_rate", "heartrate", "bpm"), "rmssd": num("rmssd", "hrv")}
+    stage_col = name("asleep", "sleep", "stage", "sleep_stage")
+    if stage_col is not None:
+        stage = df[stage_col][keep]
+        if pd.api.types.is_numeric_dtype(stage): series["asleep"] = stage.fillna(0).to_numpy() > 0
+        else: series["asleep"] = ~stage.astype(str).str.strip().str.lower().isin(["awake", "wake", "w", "", "nan", "none"]).to_numpy()
+    order = np.argsort(series["t"], kind='stable')
+    return {k: v[order] for k, v in series.items()}
+
+def nightly_summaries(series):
+    t, hr, rmssd = series["t"], series["hr"], series["rmssd"]
+    n = len(t)
+    if n == 0: return []
+    interval = max(float(np.median(np.diff(t))) if n > 1 else 60.0, 1.0)
+    night = (t + NIGHT_SHIFT_S) // 86400
+    starts = np.flatnonzero(np.r_[True, night[1:] != night[:-1]])
+    ends = np.r_[starts[1:], n]
+    if "asleep" in series: sleeping = series["asleep"].astype(bool)
+    else:
+        hour = (t % 86400) // 3600
+        sleeping = ((hour >= SLEEP_WINDOW_H[0]) | (hour < SLEEP_WINDOW_H[1])) & (hr > 0)
+    sleep_h = np.add.reduceat(sleeping.astype(float), starts) * interval / 3600
+    hrv_ok = sleeping & (rmssd > 0)
+    hrv_n = np.add.reduceat(hrv_ok.astype(float), starts)
+    hrv = np.divide(np.add.reduceat(np.where(hrv_ok, rmssd, 0.0), starts), hrv_n, out=np.full(len(starts), np.nan), where=hrv_n > 0)
+    # RHR: lowest rolling RHR_WINDOW_S mean over contiguous, valid samples within one night.
+    k = max(1, int(round(RHR_WINDOW_S / interval)))
+    means = np.full(n, np.inf)
+    if n >= k:
+        ok = sleeping & (hr > 0)
+        cs_hr, cs_ok = np.r_[0.0, np.cumsum(np.where(ok, hr, 0.0))], np.r_[0, np.cumsum(ok)]
+        i = np.arange(n - k + 1)
+        full = (cs_ok[i + k] - cs_ok[i] == k) & (night[i] == night[i + k - 1]) & (t[i + k - 1] - t[i] <= (k - 1) * interval * 1.5)
+        means[i] = np.where(full, (cs_hr[i + k] - cs_hr[i]) / k, np.inf)
+    rhr = np.minimum.reduceat(means, starts)
+    epoch = date(1970, 1, 1)
+    nights = []
+    for j, (lo, hi) in enumerate(zip(starts, ends)):
+        if sleep_h[j] < MIN_NIGHT_SLEEP_H: continue
+        nights.append({"date": str(epoch + timedelta(days=int(night[lo]))), "lo": int(lo), "hi": int(hi), "sleepHours": round(float(sleep_h[j]), 2),
+                       "rhr": int(round(rhr[j])) if np.isfinite(rhr[j]) else None, "hrv": int(round(hrv[j])) if np.isfinite(hrv[j]) else None})
+    return nights
+
+def overnight_doc(series, lo, hi):
+    t = series["t"][lo:hi]
+    doc = {"start": int(t[0]), "len": int(hi - lo), "dt": pack_stream(np.diff(t, prepend=t[0]), OVERNIGHT_DTYPES["dt"])}
+    doc.update({k: pack_stream(series[k][lo:hi], OVERNIGHT_DTYPES[k]) for k in ("hr", "rmssd", "asleep") if k in series})
+    return doc
+
+def store_overnight(series, nights):
+    docs = [(n["date"], overnight_doc(series, n["lo"], n["hi"])) for n in nights]
+    if db:
+        for i in range(0, len(docs), 500):
+            batch = db.batch()
+            for wake_date, doc in docs[i:i + 500]: batch.set(db.collection("overnight_series").document(wake_date), doc)
+            batch.commit()
+    else:
+        os.makedirs(OVERNIGHT_DIR, exist_ok=True)
+        for wake_date, doc in docs:
+            with open(os.path.join(OVERNIGHT_DIR, f"{wake_date}.json"), 'w') as f: json.dump(doc, f)
+
+def load_overnight(wake_date):
+    doc = None
+    if db:
+        snap = db.collection("overnight_series").document(str(wake_date)).get()
+        if snap.exists: doc = snap.to_dict()
+    else:
+        path = os.path.join(OVERNIGHT_DIR, f"{wake_date}.json")
+        if os.path.exists(path):
+            with open(path, 'r') as f: doc = json.load(f)
+    if not doc: return {}
+    out = {k: unpack_stream(doc[k], dt).astype(float) for k, dt in OVERNIGHT_DTYPES.items() if k in doc}
+    out["t"] = doc["start"] + np.cumsum(out.pop("dt")).astype(np.int64)
+    return out
+
+def import_overnight(uploaded):
+    series = parse_overnight_file(uploaded)
+    nights = nightly_summaries(series)
+    if not nights: return 0
+    store_overnight(series, nights)
+    by_date = {h['date']: h for h in st.session_state.data['health_logs']}
+    logs = []
+    for n in nights:
+        h = dict(by_date.get(n["date"]) or {"id": new_id(), "date": n["date"], "vo2Max": 0})
+        # Metrics the night lacks (no rmssd column, no clean RHR window) stay unset: missing means no data.
+        h.update({k: n[k] for k in ("rhr", "hrv", "sleepHours") if n[k] is not None}, source="overnight")
+        logs.append(h)
+    save_health_logs(logs)
+    return len(logs)
+
+# --- Records Index ---
+def week_start(d):
+    return d - timedelta(days=d.weekday())
+
+HEAP_STALE_SLACK = 32
+
+def prune_heap(heap, is_live):
+    # In place, so callers holding the list see the result; duplicates of a live entry collapse to one.
+    heap[:] = set(e for e in heap if is_live(e))
+    heapq.heapify(heap)
+
+class BestEffortsIndex:
+    # Lazy-deletion heaps: stale entries are skipped when they surface, so every write is O(log N).
+    # A heap is pruned once stale entries outnumber live ones, so edits can't grow it without bound.
+    def __init__(self, engine, runs=()):
+        self.engine = engine
+        self.heaps, self.current, self.runs, self.live = {}, {}, {}, {}
+        self.week_totals, self.week_heaps, self.weeks = {}, {}, {}
+        for r in runs: self.add(r)
+
+    def _entries(self, run):
+        types = ['All', run.get('type', 'Run')]
+        dist = float(run.get('distance', 0) or 0); dur = float(run.get('duration', 0) or 0)
+        load, _ = self.engine.calculate_activity_load(run)
+        entries = {}
+        for t in types:
+            if dist > 0: entries[('distance', t, None)] = -dist
+            if dur > 0: entries[('duration', t, None)] = -dur
+            if load > 0: entries[('load', t, None)] = -load
+            if run.get('type') == 'Ultimate' or dist <= 0 or dur <= 0: continue
+            efforts = run.get('bestEfforts') if isinstance(run.get('bestEfforts'), dict) else {}
+            for label, km in RECORD_DISTANCES.items():
+                if label in efforts: entries[('pace', t, label)] = efforts[label] / km
+                elif km <= dist <= km * RECORD_DISTANCE_SLACK: entries[('pace', t, label)] = dur * 60 / dist
+        return entries
+
+    def _bump_week(self, run, sign):
+        dist = float(run.get('distance', 0) or 0)
+        if dist <= 0: return
+        wk = week_start(datetime.strptime(run['date'], '%Y-%m-%d').date())
+        for t in ('All', run.get('type', 'Run')):
+            if (t, wk) not in self.week_totals: self.weeks[t] = self.weeks.get(t, 0) + 1
+            total = self.week_totals.get((t, wk), 0.0) + sign * dist
+            self.week_totals[(t, wk)] = total
+            heap = self.week_heaps.setdefault(t, [])
+            heapq.heappush(heap, (-total, wk))
+            if len(heap) > 2 * self.weeks[t] + HEAP_STALE_SLACK: prune_heap(heap, lambda e, t=t: self.week_totals.get((t, e[1])) == -e[0])
+
+    def add(self, run):
+        rid = str(run['id'])
+        if rid in self.current: self.remove(self.runs[rid])
+        entries = self._entries(run)
+        self.current[rid] = entries; self.runs[rid] = run
+        for key, value in entries.items():
+            heap = self.heaps.setdefault(key, [])
+            heapq.heappush(heap, (value, rid))
+            self.live[key] = self.live.get(key, 0) + 1
+            if len(heap) > 2 * self.live[key] + HEAP_STALE_SLACK: prune_heap(heap, lambda e, key=key: self.current.get(e[1], {}).get(key) == e[0])
+        self._bump_week(run, 1)
+
+    def remove(self, run):
+        rid = str(run['id'])
+        if rid not in self.current: return
+        self._bump_week(self.runs[rid], -1)
+        for key in self.current[rid]: self.live[key] -= 1
+        del self.current[rid]; del self.runs[rid]
+
+    def best(self, metric, act_type='All', bucket=None):
+        heap = self.heaps.get((metric, act_type, bucket), [])
+        while heap and self.current.get(heap[0][1], {}).get((metric, act_type, bucket)) != heap[0][0]: heapq.heappop(heap)
+        if not heap: return None
+        value, rid = heap[0]
+        return (-value if metric != 'pace' else value), self.runs[rid]
+
+    def best_week(self, act_type='All'):
+        heap = self.week_heaps.get(act_type, [])
+        while heap and self.week_totals.get((act_type, heap[0][1])) != -heap[0][0]: heapq.heappop(heap)
+        if not heap or heap[0][0] >= 0: return None
+        return -heap[0][0], heap[0][1]
+
+def get_records_index():
+    if 'records_index' not in st.session_state:
+        st.session_state.records_index = BestEffortsIndex(get_engine(), st.session_state.data['runs'])
+    return st.session_state.records_index
+
+# --- Search Index ---
+SEARCH_INDEX_FILE = "run_tracker_search.json"
+SEARCH_COMPACT_MIN = 1000
+
+@st.cache_resource
+def _search_log_lock():
+    return threading.Lock()
+
+def replay_search_log(postings, path):
+    # Applies one offline log file to a {token: set(ids)} map; returns the number of ops read.
+    count = 0
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                try: op, rid, tokens = json.loads(line)
+                except ValueError: break  # torn final line
+                for t in tokens:
+                    if op == 'add': postings.setdefault(t, set()).add(rid)
+                    elif t in postings: postings[t].discard(rid)
+                count += 1
+    return count
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+def search_tokens(run):
+    text = " ".join(str(run.get(k, '') or '') for k in ('notes', 'feel', 'type'))
+    tokens = set(TOKEN_RE.findall(text.lower()))
+    try:
+        d = datetime.strptime(run['date'], '%Y-%m-%d').date()
+        tokens |= {run['date'], d.strftime('%Y-%m'), str(d.year), d.strftime('%B').lower(), d.strftime('%b').lower(), d.strftime('%A').lower(), d.strftime('%a').lower()}
+    except (KeyError, ValueError): pass
+    return tokens
+
+class SearchIndex:
+    def __init__(self, postings=None):
+        self.postings = {t: set(ids) for t, ids in (postings or {}).items()}
+        self.vocab = sorted(self.postings)
+        self.ops, self.log_len = [], 0
+
+    def apply(self, op, rid, tokens):
+        for t in tokens:
+            if op == 'add':
+                if t not in self.postings: self.postings[t] = set(); bisect.insort(self.vocab, t)
+                self.postings[t].add(rid)
+            elif t in self.postings:
+                ids = self.postings[t]; ids.discard(rid)
+                if not ids:
+                    del self.postings[t]
+                    self.vocab.pop(bisect.bisect_left(self.vocab, t))
+
+    def add(self, run):
+        op = ('add', str(run['id']), sorted(search_tokens(run)))
+        self.apply(*op); self.ops.append(op)
+
+    def remove(self, run):
+        op = ('remove', str(run['id']), sorted(search_tokens(run)))
+        self.apply(*op); self.ops.append(op)
+
+    def doc_ids(self):
+        return set().union(*self.postings.values()) if self.postings else set()
+
+    def _prefix_ids(self, prefix):
+        ids = set(); i = bisect.bisect_left(self.vocab, prefix)
+        while i < len(self.vocab) and self.vocab[i].startswith(prefix):
+            ids |= self.postings[self.vocab[i]]; i += 1
+        return ids
+
+    def search(self, query):
+        terms = TOKEN_RE.findall(str(query).lower())
+        if not terms: return None
+        result = None
+        for term in sorted(terms, key=len, reverse=True):
+            ids = self._prefix_ids(term)
+            result = ids if result is None else result & ids
+            if not result: break
+        return result
+
+    def flush(self):
+        # Only this session's changes go out: per-id ArrayUnion/ArrayRemove in Firestore, so
+        # concurrent sessions don't overwrite each other's postings; offline, an appended log
+        # that is folded into the base file from disk once it grows past SEARCH_COMPACT_MIN.
+        if not self.ops: return
+        if db:
+            union, removed = {}, {}
+            for op, rid, tokens in self.ops:
+                for t in tokens:
+                    (union if op == 'add' else removed).setdefault(t, set()).add(rid)
+                    (removed if op == 'add' else union).get(t, set()).discard(rid)
+            writes = [(t, firestore.ArrayUnion(sorted(ids))) for t, ids in union.items() if ids]
+            writes += [(t, firestore.ArrayRemove(sorted(ids))) for t, ids in removed.items() if ids]
+            for i in range(0, len(writes), 500):
+                batch = db.batch()
+                for t, change in writes[i:i + 500]: batch.set(db.collection("search_index").document(t), {"ids": change}, merge=True)
+                batch.commit()
+        else:
+            with _search_log_lock():
+                with open(SEARCH_INDEX_FILE + '.log', 'a') as f: f.write("".join(json.dumps(op) + "\n" for op in self.ops))
+            self.log_len += len(self.ops)
+            if self.log_len > SEARCH_COMPACT_MIN: self.compact()
+        self.ops = []
+
+    def compact(self):
+        # Offline only. Merges base file + log as they are on disk, not this session's copy, so
+        # lines other sessions appended survive. The log is renamed first: appends that race the
+        # fold land in a fresh log, and a crash leaves a .compacting file that load replays.
+        log, folding = SEARCH_INDEX_FILE + '.log', SEARCH_INDEX_FILE + '.compacting'
+        with _search_log_lock():
+            if os.path.exists(log) and not os.path.exists(folding): os.replace(log, folding)
+            postings = {}
+            if os.path.exists(SEARCH_INDEX_FILE):
+                with open(SEARCH_INDEX_FILE, 'r') as f: postings = {t: set(ids) for t, ids in json.load(f).items()}
+            replay_search_log(postings, folding)
+            postings = {t: ids for t, ids in postings.items() if ids}
+            atomic_write(SEARCH_INDEX_FILE, json.dumps({t: sorted(ids) for t, ids in postings.items()}).encode())
+            if os.path.exists(folding): os.remove(folding)
+        self.postings, self.vocab, self.log_len = postings, sorted(postings), 0
+
+    def rewrite(self, stale=()):
+        # Full write after a rebuild from the runs; stale tokens are deleted.
+        if db:
+            docs = [(t, sorted(ids)) for t, ids in self.postings.items()] + [(t, None) for t in set(stale) - set(self.postings)]
+            for i in range(0, len(docs), 500):
+                batch = db.batch()
+                for t, ids in docs[i:i + 500]:
+                    ref = db.collection("search_index").document(t)
+                    if ids is None: batch.delete(ref)
+                    else: batch.set(ref, {"ids": ids})
+                batch.commit()
+        else:
+            with _search_log_lock():
+                atomic_write(SEARCH_INDEX_FILE, json.dumps({t: sorted(ids) for t, ids in self.postings.items()}).encode())
+                for suffix in ('.compacting', '.log'):
+                    if os.path.exists(SEARCH_INDEX_FILE + suffix): os.remove(SEARCH_INDEX_FILE + suffix)
+        self.ops, self.log_len = [], 0
+
+def load_search_index(runs, rebuild=False):
+    postings = {}
+    try:
+        if db: postings = {doc.id: doc.to_dict().get('ids', []) for doc in db.collection("search_index").stream()}
+        elif os.path.exists(SEARCH_INDEX_FILE):
+            with open(SEARCH_INDEX_FILE, 'r') as f: postings = json.load(f)
+    except Exception: postings = {}
+    postings = {t: set(ids) for t, ids in postings.items()}
+    log_len = 0 if db else sum(replay_search_log(postings, SEARCH_INDEX_FILE + suffix) for suffix in ('.compacting', '.log'))
+    index = SearchIndex({t: ids for t, ids in postings.items() if ids})
+    index.log_len = log_len
+    if rebuild or index.doc_ids() != {str(r['id']) for r in runs}:
+        stale = set(index.postings)
+        index = SearchIndex()
+        for r in runs: index.add(r)
+        index.rewrite(stale)
+    return index
+
+def get_search_index():
+    if 'search_index' not in st.session_state:
+        st.session_state.search_index = load_search_index(st.session_state.data['runs'])
+    return st.session_state.search_index
+
+# --- Columnar Tables ---
+# Typed, date-sorted frames over runs and health logs for the pandas-heavy views. Writes are
+# buffered and folded in on the next read. The frame is cached as an Arrow IPC file plus an
+# append-only write log, validated against a fingerprint of the records. pyarrow is in
+# requirements.txt, but the cache stays optional: without it the frame is rebuilt from the records.
+ACTIVITY_TABLE_FILE = "run_tracker_activities.arrow"
+HEALTH_TABLE_FILE = "run_tracker_health.arrow"
+RUN_TABLE_SCHEMA = {"id": "string", "date": "datetime64[ns]", "type": "category", "distance": "float64", "duration": "float64", "avgHr": "float64",
+                    "rpe": "float64", "cadence": "float64", "power": "float64", "elevation": "float64", "z1": "float64", "z2": "float64",
+                    "z3": "float64", "z4": "float64", "z5": "float64", "streamLoad": "float64", "feel": "category", "shoe_id": "string",
+                    "notes": "string", "hasStreams": "bool"}
+HEALTH_TABLE_SCHEMA = {"id": "string", "date": "datetime64[ns]", "rhr": "float64", "hrv": "float64", "sleepHours": "float64", "vo2Max": "float64"}
+
+def row_digest(row, schema):
+    return zlib.crc32(json.dumps([row.get(c) for c in schema], default=str).encode())
+
+def table_fingerprint(rows, schema):
+    digest, count = 0, 0
+    for r in rows: digest ^= row_digest(r, schema); count += 1
+    return f"{count}:{digest}"
+
+TABLE_COMPACT_MIN = 500
+
+class ColumnarTable:
+    def __init__(self, schema, rows, path=None, frame=None, digest=None):
+        self.schema, self.path = schema, path
+        self.records = {str(r['id']): r for r in rows}
+        if digest is None:
+            digest = 0
+            for r in self.records.values(): digest ^= row_digest(r, schema)
+        self.digest = digest
+        self._frame = frame if frame is not None else self._build(list(self.records.values()))
+        self._added, self._removed = {}, set()
+        self._log, self.log_len, self.generation = [], 0, None
+        self.compact_due = frame is None
+
+    def _build(self, rows):
+        frame = pd.DataFrame([[r.get(c) for c in self.schema] for r in rows], columns=list(self.schema))
+        for col, dtype in self.schema.items():
+            if col == 'id': frame[col] = frame[col].map(str).astype('string')
+            elif dtype == 'datetime64[ns]': frame[col] = pd.to_datetime(frame[col], format='%Y-%m-%d', errors='coerce')
+            elif dtype == 'float64': frame[col] = pd.to_numeric(frame[col], errors='coerce').astype('float64')
+            elif dtype == 'bool': frame[col] = frame[col].eq(True)
+            else: frame[col] = frame[col].astype(dtype)
+        return frame.sort_values('date', kind='stable').reset_index(drop=True)
+
+    def _apply(self, op, row):
+        rid = str(row['id'])
+        if op == 'add': self._added[rid] = row
+        else: self._added.pop(rid, None); self._removed.add(rid)
+
+    def _journal(self, op, row):
+        self._log.append({"op": op, "row": {c: row.get(c) for c in self.schema}, "fp": f"{len(self.records)}:{self.digest}"})
+
+    def add(self, row):
+        self.records[str(row['id'])] = row; self._apply('add', row)
+        self.digest ^= row_digest(row, self.schema); self._journal('add', row)
+
+    def remove(self, row):
+        if self.records.pop(str(row['id']), None) is None: return
+        self._apply('remove', row)
+        self.digest ^= row_digest(row, self.schema); self._journal('remove', row)
+
+    def record(self, rid):
+        return self.records.get(str(rid))
+
+    def frame(self):
+        if self._added or self._removed:
+            frame = self._frame
+            if self._removed: frame = frame[~frame['id'].isin(list(self._removed))]
+            if self._added:
+                new = self._build(list(self._added.values()))
+                in_order = frame.empty or new['date'].min() >= frame['date'].iloc[-1]
+                frame = new if frame.empty else pd.concat([frame, new], ignore_index=True)
+                for col, dtype in self.schema.items():
+                    if dtype == 'category': frame[col] = frame[col].astype('category')
+                if not in_order: frame = frame.sort_values('date', kind='stable')
+            self._frame = frame.reset_index(drop=True)
+            self._added, self._removed = {}, set()
+        return self._frame
+
+    def between(self, start, end):
+        # Date-range slice of the sorted frame (inclusive); a positional view, not a filtered copy.
+        frame = self.frame()
+        dates = frame['date'].to_numpy()
+        lo = np.searchsorted(dates, np.datetime64(start, 'ns'), 'left')
+        hi = np.searchsorted(dates, np.datetime64(end + timedelta(days=1), 'ns'), 'left')
+        return frame.iloc[lo:hi]
+
+    def flush(self):
+        # Writes append to a log next to the Arrow file; the file itself is only rewritten when
+        # the log outgrows a tenth of the table.
+        if pa is None or not self.path: return
+        if self.compact_due or self.log_len + len(self._log) > max(TABLE_COMPACT_MIN, len(self.records) // 10): return self.compact()
+        if not self._log: return
+        with open(self.path + '.log', 'a') as f: f.write("".join(json.dumps(dict(e, gen=self.generation), default=str) + "\n" for e in self._log))
+        self.log_len += len(self._log); self._log = []
+
+    def compact(self):
+        self.generation = new_id()
+        table = pa.Table.from_pandas(self.frame(), preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'fingerprint': f"{len(self.records)}:{self.digest}".encode(),
+                                               b'generation': self.generation.encode()})
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".tmp-")
+        os.close(fd)
+        try:
+            with pa.OSFile(tmp, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer: writer.write_table(table)
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+        if os.path.exists(self.path + '.log'): os.remove(self.path + '.log')
+        self._log, self.log_len, self.compact_due = [], 0, False
+
+def load_columnar_table(schema, rows, path):
+    # Base Arrow file plus the log lines of the same generation; the last fingerprint must match
+    # the live records or the table is rebuilt from them.
+    if pa is not None and os.path.exists(path):
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            meta = table.schema.metadata or {}
+            stored, gen, ops = meta.get(b'fingerprint', b'').decode(), meta.get(b'generation', b'').decode(), []
+            if os.path.exists(path + '.log'):
+                with open(path + '.log', 'r') as f:
+                    for line in f:
+                        try: entry = json.loads(line)
+                        except ValueError: break  # torn final line
+                        if entry.get('gen') == gen: ops.append(entry); stored = entry['fp']
+            expected = table_fingerprint(rows, schema)
+            if table.column_names == list(schema) and stored == expected:
+                loaded = ColumnarTable(schema, rows, path, frame=table.to_pandas(), digest=int(expected.split(':')[1]))
+                loaded.generation, loaded.log_len = gen, len(ops)
+                for e in ops: loaded._apply(e['op'], e['row'])
+                return loaded
+        except Exception: pass
+    table = ColumnarTable(schema, rows, path)
+    table.flush()
+    return table
+
+def get_activity_table():
+    if 'activity_table' not in st.session_state:
+        st.session_state.activity_table = load_columnar_table(RUN_TABLE_SCHEMA, st.session_state.data['runs'], ACTIVITY_TABLE_FILE)
+    return st.session_state.activity_table
+
+def get_health_table():
+    if 'health_table' not in st.session_state:
+        st.session_state.health_table = load_columnar_table(HEALTH_TABLE_SCHEMA, st.session_state.data['health_logs'], HEALTH_TABLE_FILE)
+    return st.session_state.health_table
+
+# --- Readiness Baselines ---
+BASELINE_WINDOWS = (7, 28)
+BASELINE_METRICS = ('rhr', 'hrv', 'sleepHours')
+
+class RollingBaselines:
+    # Window sums anchored at one day; adding a log or sliding the anchor by a day is O(1).
+    def __init__(self, logs=(), anchor=None):
+        self.anchor = anchor or get_malaysia_time().date()
+        self.by_date, self.logs = {}, {}
+        self.sums = {(w, m): [0.0, 0] for w in BASELINE_WINDOWS for m in BASELINE_METRICS}
+        for h in logs: self.add(h)
+
+    def _acc(self, w, vals, sign):
+        for m, v in vals.items():
+            acc = self.sums[(w, m)]; acc[0] += sign * v; acc[1] += sign
+
+    def _shift(self, d, vals, sign):
+        for w in BASELINE_WINDOWS:
+            if self.anchor - timedelta(days=w - 1) <= d <= self.anchor: self._acc(w, vals, sign)
+
+    def _day(self, d):
+        return list(self.by_date.get(d, {}).values())
+
+    def add(self, log):
+        try: d = datetime.strptime(log['date'], '%Y-%m-%d').date()
+        except (KeyError, ValueError): return
+        if str(log.get('id')) in self.logs: self.remove(log)
+        vals = {m: float(log[m]) for m in BASELINE_METRICS if log.get(m)}
+        self.logs[str(log.get('id'))] = d
+        self.by_date.setdefault(d, {})[str(log.get('id'))] = vals
+        self._shift(d, vals, 1)
+
+    def remove(self, log):
+        d = self.logs.pop(str(log.get('id')), None)
+        if d is None: return
+        vals = self.by_date[d].pop(str(log.get('id')))
+        if not self.by_date[d]: del self.by_date[d]
+        self._shift(d, vals, -1)
+
+    def slide_to(self, anchor):
+        if abs((anchor - self.anchor).days) > max(BASELINE_WINDOWS):
+            self.anchor = anchor
+            self.sums = {k: [0.0, 0] for k in self.sums}
+            for i in range(max(BASELINE_WINDOWS)):
+                d = anchor - timedelta(days=i)
+                for vals in self._day(d): self._shift(d, vals, 1)
+            return
+        while self.anchor < anchor:
+            self.anchor += timedelta(days=1)
+            for w in BASELINE_WINDOWS:
+                for vals in self._day(self.anchor): self._acc(w, vals, 1)
+                for vals in self._day(self.anchor - timedelta(days=w)): self._acc(w, vals, -1)
+        while self.anchor > anchor:
+            for w in BASELINE_WINDOWS:
+                for vals in self._day(self.anchor): self._acc(w, vals, -1)
+                for vals in self._day(self.anchor - timedelta(days=w)): self._acc(w, vals, 1)
+            self.anchor -= timedelta(days=1)
+
+    def averages(self, anchor, window):
+        self.slide_to(anchor)
+        return {m: (self.sums[(window, m)][0] / self.sums[(window, m)][1] if self.sums[(window, m)][1] else None) for m in BASELINE_METRICS}
+
+def get_readiness_baselines():
+    if 'readiness_baselines' not in st.session_state:
+        st.session_state.readiness_baselines = RollingBaselines(st.session_state.data['health_logs'])
+    return st.session_state.readiness_baselines
+
+# --- Zone Distribution ---
+# Per-type daily z1..z5 minutes with lazily rebuilt prefix sums: any date-range total is
+# cum[hi] - cum[lo]. Arrays grow geometrically so out-of-range dates stay amortized O(1).
+ZONE_KEYS = ('z1', 'z2', 'z3', 'z4', 'z5')
+ZONE_COLORS = ['#1e40af', '#60a5fa', '#facc15', '#fb923c', '#f87171']
+POLARIZED_PI = 2.0
+
+def run_zone_minutes(run):
+    try: d = datetime.strptime(run['date'], '%Y-%m-%d').date()
+    except (KeyError, ValueError, TypeError): return None, None
+    zones = np.array([float(run.get(z, 0) or 0) for z in ZONE_KEYS])
+    return d, zones
+
+class ZoneIndex:
+    def __init__(self, runs):
+        self.origin, self.size = None, 0
+        self.daily, self._cum = {}, {}
+        for r in runs: self.add(r)
+
+    def _slot(self, d):
+        if self.origin is None: self.origin, self.size = d, 1
+        i = (d - self.origin).days
+        if i < 0:
+            pad = max(-i, self.size)
+            for t in self.daily: self.daily[t] = np.vstack([np.zeros((pad, 5)), self.daily[t]])
+            self.origin -= timedelta(days=pad); self.size += pad; i += pad
+            self._cum.clear()
+        elif i >= self.size:
+            pad = max(i - self.size + 1, self.size)
+            for t in self.daily: self.daily[t] = np.vstack([self.daily[t], np.zeros((pad, 5))])
+            self.size += pad
+            self._cum.clear()
+        return i
+
+    def _apply(self, run, sign):
+        d, zones = run_zone_minutes(run)
+        if d is None or not zones.any(): return
+        i, t = self._slot(d), run.get('type', 'Run')
+        if t not in self.daily: self.daily[t] = np.zeros((self.size, 5))
+        self.daily[t][i] += sign * zones
+        self._cum.pop(t, None)
+
+    def add(self, run): self._apply(run, 1)
+    def remove(self, run): self._apply(run, -1)
+
+    def types(self):
+        return sorted(t for t, arr in self.daily.items() if (np.abs(arr) > 1e-9).any())
+
+    def _cumulative(self, t):
+        if t not in self._cum: self._cum[t] = np.vstack([np.zeros((1, 5)), np.cumsum(self.daily[t], axis=0)])
+        return self._cum[t]
+
+    def _bounds(self, days):
+        return np.clip(np.asarray(days), 0, self.size)
+
+    def range(self, start, end, types=None):
+        if self.origin is None: return np.zeros(5)
+        lo, hi = self._bounds([(start - self.origin).days, (end - self.origin).days + 1])
+        return sum((self._cumulative(t)[hi] - self._cumulative(t)[lo] for t in (types or self.daily) if t in self.daily), np.zeros(5))
+
+    def weekly(self, first_monday, weeks, types=None, span=1):
+        # (weeks, 5) minutes for each week starting at first_monday; span > 1 sums that many weeks ending there.
+        if self.origin is None: return np.zeros((weeks, 5))
+        ends = (first_monday - self.origin).days + 7 * np.arange(1, weeks + 1)
+        hi, lo = self._bounds(ends), self._bounds(ends - 7 * span)
+        return sum((self._cumulative(t)[hi] - self._cumulative(t)[lo] for t in (types or self.daily) if t in self.daily), np.zeros((weeks, 5)))
+
+def three_zone_split(zones):
+    total = float(np.sum(zones))
+    if total <= 0: return 0.0, 0.0, 0.0
+    return (zones[0] + zones[1]) / total, zones[2] / total, (zones[3] + zones[4]) / total
+
+def polarization_index(zones):
+    # Treff et al. (2019): PI = log10(Z1 / Z2 * Z3 * 100) on 3-zone fractions; empty zones floored at 0.01.
+    low, mid, high = three_zone_split(zones)
+    if low <= 0: return None
+    return math.log10(low / max(mid, 0.01) * max(high, 0.01) * 100)
+
+def distribution_label(zones):
+    low, mid, high = three_zone_split(zones)
+    pi = polarization_index(zones)
+    if pi is None: return "High Intensity" if high >= mid else "Threshold"
+    if pi > POLARIZED_PI and low > high > mid: return "Polarized"
+    if low > mid > high: return "Pyramidal"
+    if mid >= low and mid >= high: return "Threshold"
+    if high > low: return "High Intensity"
+    return "Base"
+
+def get_zone_index():
+    if 'zone_index' not in st.session_state:
+        st.session_state.zone_index = ZoneIndex(st.session_state.data['runs'])
+    return st.session_state.zone_index
+
+# --- Derived Snapshot ---
+# Views read per-run load/focus through the snapshot's profile. A profile change builds a new
+# snapshot off the script thread and swaps it in whole, so views never see a half-recomputed history.
+class DerivedSnapshot:
+    def __init__(self, profile, loads=None):
+        self.profile = copy.deepcopy(profile)
+        self.loads = loads if loads is not None else {}
+        self.engine = PhysiologyEngine(self.profile, load_cache=self.loads)
+
+    def add(self, run):
+        self.loads.pop(str(run['id']), None)
+        self.engine.calculate_activity_load(run)
+
+    def remove(self, run):
+        self.loads.pop(str(run['id']), None)
+
+def get_derived():
+    if 'derived' not in st.session_state:
+        st.session_state.derived = DerivedSnapshot(st.session_state.data['user_profile'])
+    return st.session_state.derived
+
+def get_engine():
+    return get_derived().engine
+
+def recompute_derived(profile, runs, chunk_size=200, progress=None):
+    snapshot = DerivedSnapshot(profile)
+    engine = PhysiologyEngine(snapshot.profile)
+    updated = {}
+    for i in range(0, len(runs), chunk_size):
+        for r in runs[i:i + chunk_size]:
+            if r.get('hasStreams'):
+                streams = load_streams(r['id'])
+                if streams:
+                    r = apply_stream_metrics(dict(r), streams, engine)
+                    updated[str(r['id'])] = r
+            snapshot.add(r)
+        if progress: progress(min(1.0, (i + chunk_size) / max(len(runs), 1)) * 0.9)
+    merged = [updated.get(str(r['id']), r) for r in runs]
+    return {"snapshot": snapshot, "runs": updated, "records_index": BestEffortsIndex(snapshot.engine, merged)}
+
+def start_recompute():
+    job = BackgroundJob("Recomputing history", ["recompute"], pending=[])
+    job.submit("recompute", recompute_derived, copy.deepcopy(st.session_state.data['user_profile']), list(st.session_state.data['runs']))
+    st.session_state.recompute_job = job
+
+def apply_recompute():
+    job = st.session_state.get('recompute_job')
+    if job is None or not job.finished(): return False
+    del st.session_state['recompute_job']
+    if job.errors():
+        st.error(f"Recompute failed: {job.errors()['recompute']}")
+        return False
+    result = job.results()["recompute"]
+    touched = {str((new or old)['id']) for old, new in job.meta['pending']}
+    runs = st.session_state.data['runs']
+    replaced = []
+    for i, r in enumerate(runs):
+        rid = str(r['id'])
+        if rid in result["runs"] and rid not in touched:
+            runs[i] = result["runs"][rid]
+            if db: db.collection("runs").document(rid).set(runs[i])
+            mark_dirty("runs", r, runs[i])
+            replaced.append((r, runs[i]))
+    for key in RUN_INDEXES:
+        index = st.session_state.get(key)
+        if index is None or key in ("derived", "records_index") or not replaced: continue
+        for old, new in replaced: index.remove(old); index.add(new)
+        if hasattr(index, 'flush'): index.flush()
+    for old, new in job.meta['pending']:
+        for index in (result["snapshot"], result["records_index"]):
+            if old: index.remove(old)
+            if new: index.add(new)
+    st.session_state.derived = result["snapshot"]
+    st.session_state.records_index = result["records_index"]
+    persist()
+    return True
+
+def render_recompute_job():
+    job = st.session_state.get('recompute_job')
+    if job is None: return
+    polling = not job.finished()
+    @st.fragment(run_every=1.0 if polling else None)
+    def job_panel():
+        if not job.finished():
+            st.progress(job.progress(), text=f"{job.label}: {int(job.progress() * 100)}%")
+            st.caption("Views show the previous profile until this finishes.")
+            return
+        if apply_recompute(): st.rerun()
+    job_panel()
+
+# --- Record IDs ---
+# ULID-style ids: 48-bit millisecond timestamp + 80 random bits in Crockford base32. They sort by
+# creation time and don't collide across sessions; ids minted in the same millisecond stay monotonic.
+ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+IDEMPOTENCY_WINDOW_S = 30
+
+@st.cache_resource
+def _id_clock():
+    return {"lock": threading.Lock(), "ms": 0, "rand": 0}
+
+def new_id():
+    clock = _id_clock()
+    with clock["lock"]:
+        ms = int(time.time() * 1000)
+        if ms <= clock["ms"]:
+            ms, rand = clock["ms"], clock["rand"] + 1
+            if rand >> 80: ms, rand = ms + 1, 0
+        else: rand = int.from_bytes(os.urandom(10), 'big')
+        clock["ms"], clock["rand"] = ms, rand
+    value = (ms << 80) | rand
+    return ''.join(ULID_ALPHABET[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+def form_token(form):
+    tokens = st.session_state.setdefault('form_tokens', {})
+    if form not in tokens: tokens[form] = new_id()
+    return tokens[form]
+
+def rotate_form_token(form):
+    st.session_state.setdefault('form_tokens', {})[form] = new_id()
+
+def submit_once(form, payload):
+    # Doc id for a new record: the form's idempotency key, which only rotates after a successful save,
+    # or the id already given to an identical submit within the window (double clicks, retries).
+    recent = st.session_state.setdefault('recent_submits', {})
+    now = time.time()
+    for key in [k for k, (_, ts) in recent.items() if now - ts > IDEMPOTENCY_WINDOW_S]: del recent[key]
+    key = (form, json.dumps(payload, sort_keys=True, default=str))
+    if key not in recent: recent[key] = (form_token(form), now)
+    return recent[key][0]
+
+# --- Gear ---
+# Each gear record carries its own distance / duration / count totals. Run writes apply the
+# difference between old and new versions (so moving a run between shoes is two deltas), and
+# Firestore applies them with Increment so concurrent sessions don't overwrite each other.
+GEAR_RETIRE_KM = 700
+GEAR_WARN_FRACTION = 0.9
+
+def gear_deltas(old, new):
+    deltas = {}
+    for run, sign in ((old, -1), (new, 1)):
+        if not run: continue
+        d = deltas.setdefault(str(run.get('shoe_id') or ''), [0.0, 0.0, 0])
+        d[0] += sign * float(run.get('distance', 0) or 0)
+        d[1] += sign * float(run.get('duration', 0) or 0)
+        d[2] += sign
+    return {gid: d for gid, d in deltas.items() if any(d)}
+
+def update_gear_counters(old, new):
+    gear = {str(g['id']): g for g in st.session_state.data['gear']}
+    for gid, (dist, dur, count) in gear_deltas(old, new).items():
+        g = gear.get(gid)
+        if g is None: continue
+        g['distance'] = float(g.get('distance', 0)) + dist
+        g['duration'] = float(g.get('duration', 0)) + dur
+        g['count'] = int(g.get('count', 0)) + count
+        if not db: continue
+        try: db.collection("gear").document(gid).update({"distance": firestore.Increment(dist), "duration": firestore.Increment(dur), "count": firestore.Increment(count)})
+        except NotFound:
+            # Deleted by another session: drop it here too instead of failing the run save halfway.
+            st.session_state.data['gear'] = [x for x in st.session_state.data['gear'] if str(x['id']) != gid]
+
+def gear_total_km(g):
+    return float(g.get('startKm', 0) or 0) + float(g.get('distance', 0) or 0)
+
+def gear_alerts(gear):
+    alerts = []
+    for g in gear:
+        if g.get('retired'): continue
+        limit = float(g.get('retireKm') or GEAR_RETIRE_KM)
+        total = gear_total_km(g)
+        if total >= limit: alerts.append((g, total, limit, "retire"))
+        elif total >= GEAR_WARN_FRACTION * limit: alerts.append((g, total, limit, "warn"))
+    return alerts
+
+def save_gear(item):
+    gear = st.session_state.data['gear']
+    idx = next((i for i, g in enumerate(gear) if str(g['id']) == str(item['id'])), -1)
+    if idx != -1: item = dict(gear[idx], **item); gear[idx] = item
+    else: gear.append(item)
+    if db: db.collection("gear").document(str(item['id'])).set(item, merge=True)
+    persist()
+
+def delete_gear(gear_id):
+    if db: db.collection("gear").document(str(gear_id)).delete()
+    st.session_state.data['gear'] = [g for g in st.session_state.data['gear'] if str(g['id']) != str(gear_id)]
+    persist()
+
+def recount_gear():
+    # Explicit full rescan, for when runs were edited outside the app.
+    totals = {str(g['id']): [0.0, 0.0, 0] for g in st.session_state.data['gear']}
+    for r in st.session_state.data['runs']:
+        t = totals.get(str(r.get('shoe_id') or ''))
+        if t is None: continue
+        t[0] += float(r.get('distance', 0) or 0); t[1] += float(r.get('duration', 0) or 0); t[2] += 1
+    for g in st.session_state.data['gear']:
+        g['distance'], g['duration'], g['count'] = totals[str(g['id'])]
+        if db: db.collection("gear").document(str(g['id'])).set({"distance": g['distance'], "duration": g['duration'], "count": g['count']}, merge=True)
+    persist()
+
+# --- Write Path ---
+# Session-level indexes kept in sync with every run write; each exposes add(run) / remove(run)
+# and optionally flush() to persist itself.
+RUN_INDEXES = ("derived", "records_index", "search_index", "activity_table", "zone_index", "compliance_index")
+
+def _update_run_indexes(old, new):
+    mark_dirty("runs", old, new)
+    job = st.session_state.get('recompute_job')
+    if job is not None: job.meta['pending'].append((old, new))
+    for key in RUN_INDEXES:
+        index = st.session_state.get(key)
+        if index is None: continue
+        if old: index.remove(old)
+        if new: index.add(new)
+        if hasattr(index, 'flush'): index.flush()
+    update_gear_counters(old, new)
+
+def save_run(run_obj, streams=None):
+    runs = st.session_state.data['runs']
+    idx = next((i for i, r in enumerate(runs) if str(r['id']) == str(run_obj['id'])), -1)
+    if streams:
+        store_streams(run_obj['id'], streams)
+        apply_stream_metrics(run_obj, streams, PhysiologyEngine(st.session_state.data['user_profile']))
+    if db: db.collection("runs").document(str(run_obj['id'])).set(run_obj)
+    old = runs[idx] if idx != -1 else None
+    if idx != -1: runs[idx] = run_obj
+    else: runs.insert(0, run_obj)
+    _update_run_indexes(old, run_obj)
+    refit_performance_model()
+    persist()
+
+HEALTH_INDEXES = ("readiness_baselines", "health_table")
+
+def _update_health_indexes(old, new, flush=True):
+    mark_dirty("health_logs", old, new)
+    for key in HEALTH_INDEXES:
+        index = st.session_state.get(key)
+        if index is None: continue
+        if old: index.remove(old)
+        if new: index.add(new)
+        if flush and hasattr(index, 'flush'): index.flush()
+
+def save_health_log(new_h):
+    logs = st.session_state.data['health_logs']
+    idx = next((i for i, h in enumerate(logs) if str(h['id']) == str(new_h['id'])), -1)
+    if db: db.collection("health_logs").document(str(new_h['id'])).set(new_h)
+    old = logs[idx] if idx != -1 else None
+    if idx != -1: logs[idx] = new_h
+    else: logs.insert(0, new_h)
+    _update_health_indexes(old, new_h)
+    persist()
+
+def save_health_logs(new_logs):
+    # Bulk upsert for imports: Firestore batches of 500, one index flush and one persist.
+    logs = st.session_state.data['health_logs']
+    pos = {str(h['id']): i for i, h in enumerate(logs)}
+    if db:
+        for i in range(0, len(new_logs), 500):
+            batch = db.batch()
+            for h in new_logs[i:i + 500]: batch.set(db.collection("health_logs").document(str(h['id'])), h)
+            batch.commit()
+    for h in new_logs:
+        i = pos.get(str(h['id']))
+        old = logs[i] if i is not None else None
+        if i is not None: logs[i] = h
+        else: pos[str(h['id'])] = len(logs); logs.append(h)
+        _update_health_indexes(old, h, flush=False)
+    logs.sort(key=lambda x: x.get('date', ''), reverse=True)
+    for key in HEALTH_INDEXES:
+        index = st.session_state.get(key)
+        if index is not None and hasattr(index, 'flush'): index.flush()
+    persist()
+
+def delete_health_log(log_id):
+    old = next((h for h in st.session_state.data['health_logs'] if str(h['id']) == str(log_id)), None)
+    if db: db.collection("health_logs").document(str(log_id)).delete()
+    st.session_state.data['health_logs'] = [h for h in st.session_state.data['health_logs'] if str(h['id']) != str(log_id)]
+    _update_health_indexes(old, None)
+    persist()
+
+def delete_run(run_id):
+    old = next((r for r in st.session_state.data['runs'] if str(r['id']) == str(run_id)), None)
+    if db: db.collection("runs").document(str(run_id)).delete()
+    if old and old.get('hasStreams'): delete_streams(run_id)
+    st.session_state.data['runs'] = [r for r in st.session_state.data['runs'] if str(r['id']) != str(run_id)]
+    _update_run_indexes(old, None)
+    refit_performance_model()
+    persist()
+
+def apply_restore(snapshot_id):
+    # Firestore only receives the documents that differ from the live data; derived indexes are rebuilt.
+    state = snapshot_state(snapshot_id)
+    restored, current = restore_snapshot(snapshot_id, state), st.session_state.data
+    if db:
+        ops = []
+        for coll in SNAPSHOT_LIST_KEYS + ("gear",):
+            live, keep = {str(r['id']): r for r in current.get(coll, [])}, {str(r['id']): r for r in restored.get(coll, [])}
+            ops += [(coll, i, r) for i, r in keep.items() if live.get(i) != r] + [(coll, i, None) for i in live if i not in keep]
+        for i in range(0, len(ops), 500):
+            batch = db.batch()
+            for coll, doc_id, r in ops[i:i + 500]:
+                ref = db.collection(coll).document(doc_id)
+                if r is None: batch.delete(ref)
+                else: batch.set(ref, r)
+            batch.commit()
+        settings = db.collection("settings")
+        settings.document("profile").set(restored['user_profile'])
+        settings.document("plan").set({'cycles': restored['cycles'], 'weekly_plan': restored['weekly_plan']})
+        settings.document("model").set(restored['performance_model'])
+    st.session_state.data = restored
+    for key in RUN_INDEXES + HEALTH_INDEXES + LIFT_INDEXES + ("load_rolling", "export_file"): st.session_state.pop(key, None)
+    st.session_state.search_index = load_search_index(restored['runs'], rebuild=True)
+    persist()
+    # The restored state becomes a checkpoint on top of HEAD, so later deltas and undoing the restore both work.
+    with _snapshot_lock():
+        write_manifest({"id": new_id(), "parent": snapshot_head(), "created": get_malaysia_time().strftime('%Y-%m-%d %H:%M:%S'),
+                        "label": f"Restored {snapshot_id}", "kind": "full", "depth": 0, "changes": 0, "records": state})
+        clear_pending()
+
+# --- Strength Log ---
+# Lift sessions: {id, date, name, duration, rpe, exercises: [{name, sets: [{reps, weight}]}]}.
+# LiftIndex keeps each exercise's entries sorted by (date, session id) for bisect lookups, plus
+# weekly volume buckets per exercise and overall.
+E1RM_MAX_REPS = 12
+
+def lift_key(name):
+    return " ".join(str(name).lower().split())
+
+def estimate_1rm(weight, reps):
+    # Epley; sets above E1RM_MAX_REPS are too far from a max to extrapolate.
+    if weight <= 0 or reps <= 0 or reps > E1RM_MAX_REPS: return 0.0
+    return weight if reps == 1 else weight * (1 + reps / 30)
+
+def exercise_summary(exercise):
+    sets = [(int(s.get('reps', 0) or 0), float(s.get('weight', 0) or 0)) for s in exercise.get('sets', [])]
+    sets = [(r, w) for r, w in sets if r > 0]
+    if not sets: return None
+    top_reps, top_weight = max(sets, key=lambda s: (s[1], s[0]))
+    return {"sets": len(sets), "reps": sum(r for r, _ in sets), "weight": top_weight, "top_reps": top_reps,
+            "volume": sum(r * w for r, w in sets), "e1rm": max(estimate_1rm(w, r) for r, w in sets)}
+
+class LiftIndex:
+    def __init__(self, sessions):
+        self.keys, self.entries, self.names = {}, {}, {}
+        self.week_volume, self.week_sessions, self.sessions = {}, {}, {}
+        for s in sessions: self.add(s)
+
+    def _entries(self, session):
+        try: d = datetime.strptime(session['date'], '%Y-%m-%d').date()
+        except (KeyError, ValueError, TypeError): return None, []
+        out = []
+        for ex in session.get('exercises', []):
+            summary, key = exercise_summary(ex), lift_key(ex.get('name', ''))
+            if summary and key: out.append((key, " ".join(ex['name'].split()), (session['date'], str(session['id'])), dict(summary, date=d)))
+        return d, out
+
+    def _bump(self, key, monday, volume):
+        self.week_volume[(key, monday)] = self.week_volume.get((key, monday), 0.0) + volume
+
+    def add(self, session):
+        d, entries = self._entries(session)
+        if d is None: return
+        self.sessions[str(session['id'])] = session
+        self.week_sessions.setdefault(week_start(d), set()).add(str(session['id']))
+        for key, name, sort_key, entry in entries:
+            keys = self.keys.setdefault(key, [])
+            i = bisect.bisect_right(keys, sort_key)
+            keys.insert(i, sort_key); self.entries.setdefault(key, []).insert(i, entry)
+            self.names.setdefault(key, name)
+            self._bump(key, week_start(d), entry['volume']); self._bump(None, week_start(d), entry['volume'])
+
+    def remove(self, session):
+        d, entries = self._entries(session)
+        if d is None: return
+        self.sessions.pop(str(session['id']), None)
+        self.week_sessions.get(week_start(d), set()).discard(str(session['id']))
+        for key, _, sort_key, entry in entries:
+            keys = self.keys.get(key, [])
+            i = bisect.bisect_left(keys, sort_key)
+            if i == len(keys) or keys[i] != sort_key: continue
+            del keys[i]; del self.entries[key][i]
+            self._bump(key, week_start(d), -entry['volume']); self._bump(None, week_start(d), -entry['volume'])
+            if not keys: del self.keys[key], self.entries[key], self.names[key]
+
+    def exercises(self):
+        return sorted(self.names.values(), key=str.lower)
+
+    def last(self, name, before=None):
+        key = lift_key(name); keys = self.keys.get(key)
+        if not keys: return None
+        i = len(keys) if before is None else bisect.bisect_left(keys, (str(before), ''))
+        return self.entries[key][i - 1] if i > 0 else None
+
+    def history(self, name, start=None, end=None):
+        key = lift_key(name); keys = self.keys.get(key, [])
+        lo = 0 if start is None else bisect.bisect_left(keys, (str(start), ''))
+        hi = len(keys) if end is None else bisect.bisect_right(keys, (str(end), '\uffff'))
+        return self.entries.get(key, [])[lo:hi]
+
+    def volume(self, name, monday):
+        return self.week_volume.get((lift_key(name) if name else None, monday), 0.0)
+
+    def week(self, monday):
+        return [self.sessions[sid] for sid in self.week_sessions.get(monday, ())]
+
+def get_lift_index():
+    if 'lift_index' not in st.session_state:
+        st.session_state.lift_index = LiftIndex(st.session_state.data['lifts'])
+    return st.session_state.lift_index
+
+LIFT_INDEXES = ("lift_index", "compliance_index")
+
+def _update_lift_indexes(old, new):
+    mark_dirty("lifts", old, new)
+    for key in LIFT_INDEXES:
+        index = st.session_state.get(key)
+        if index is None: continue
+        if old: index.remove(old)
+        if new: index.add(new)
+
+def save_lift_session(session):
+    lifts = st.session_state.data['lifts']
+    idx = next((i for i, l in enumerate(lifts) if str(l['id']) == str(session['id'])), -1)
+    if db: db.collection("lifts").document(str(session['id'])).set(session)
+    old = lifts[idx] if idx != -1 else None
+    if idx != -1: lifts[idx] = session
+    else: lifts.insert(0, session)
+    _update_lift_indexes(old, session)
+    refit_performance_model()
+    persist()
+
+def delete_lift_session(session_id):
+    old = next((l for l in st.session_state.data['lifts'] if str(l['id']) == str(session_id)), None)
+    if db: db.collection("lifts").document(str(session_id)).delete()
+    st.session_state.data['lifts'] = [l for l in st.session_state.data['lifts'] if str(l['id']) != str(session_id)]
+    _update_lift_indexes(old, None)
+    refit_performance_model()
+    persist()
+
+# --- Training Plan ---
+PLAN_INTENSITY_PATTERNS = [
+    ('rest', r"\b(rest|off|none)\b"),
+    ('strength', r"\b(gym|strength|lift|lifting|weights)\b"),
+    ('anaerobic', r"\b(intervals?|vo2|repeats?|reps|hills?|track|speed|sprints?|fartlek|z5)\b"),
+    ('high', r"\b(tempo|threshold|steady|progression|race|mp|z3|z4)\b"),
+    ('anaerobic', r"\d+\s*x\s*\d+"),
+]
+PLAN_PACE_FACTORS = {'low': 1.0, 'high': 0.88, 'anaerobic': 0.85, 'strength': 1.0}
+
+def parse_plan_session(text, easy_pace=6.0):
+    t = str(text or '').strip().lower()
+    if not t: return None
+    intensity = next((k for k, pat in PLAN_INTENSITY_PATTERNS if re.search(pat, t)), 'low')
+    if intensity == 'rest': return None
+    act_type = 'Walk' if 'walk' in t else 'Ultimate' if ('ultimate' in t or 'frisbee' in t) else 'Strength' if intensity == 'strength' else 'Run'
+    distance = duration = 0.0
+    reps = re.search(r"(\d+)\s*x\s*(\d+(?:\.\d+)?)\s*(mins|min|km|k|m|')?", t)
+    if reps:
+        n, size, unit = int(reps.group(1)), float(reps.group(2)), reps.group(3) or 'm'
+        if unit in ('min', 'mins', "'"): duration = n * size * 2 + 20  # work + equal recovery + warm-up/cool-down
+        else: distance = n * size / (1 if unit in ('km', 'k') else 1000) + 4
+    km = re.search(r"(?<![x\d.])(\d+(?:\.\d+)?)\s*(?:km|k)\b", t)
+    if km and not reps: distance = float(km.group(1))
+    hrs = re.search(r"(\d+(?:\.\d+)?)\s*(?:h|hr|hrs|hours?)\b", t)
+    mins = re.search(r"(?<![x\d])(\d+)\s*(?:min|mins|minutes|')", t)
+    if not duration and (hrs or mins) and not reps: duration = (float(hrs.group(1)) * 60 if hrs else 0) + (float(mins.group(1)) if mins else 0)
+    if not duration and distance: duration = distance * easy_pace * PLAN_PACE_FACTORS[intensity]
+    if not duration: duration = 90.0 if 'long' in t else 45.0
+    return {'text': str(text), 'type': act_type, 'intensity': intensity, 'duration': duration, 'distance': distance}
+
+def recent_easy_pace(runs, days=90, default=6.0):
+    cutoff = str(get_malaysia_time().date() - timedelta(days=days))
+    paces = [r['duration'] / r['distance'] for r in runs if r.get('type') == 'Run' and r.get('date', '') >= cutoff and r.get('distance', 0) > 0 and r.get('duration', 0) > 0]
+    return float(np.median(paces)) if paces else default
+
+def save_plan():
+    # The plan also gets a version effective from this week, so past weeks keep the plan they were trained on.
+    data = st.session_state.data
+    monday = week_start(get_malaysia_time().date())
+    entry = {"id": str(monday), "date": str(monday), "cycles": copy.deepcopy(data['cycles']), "weekly_plan": copy.deepcopy(data['weekly_plan'])}
+    old = next((h for h in data['plan_history'] if h['id'] == entry['id']), None)
+    if db:
+        db.collection("settings").document("plan").set({'cycles': data['cycles'], 'weekly_plan': data['weekly_plan']})
+        db.collection("plan_history").document(entry['id']).set(entry)
+    data['plan_history'] = sorted([h for h in data['plan_history'] if h['id'] != entry['id']] + [entry], key=lambda h: h['date'], reverse=True)
+    mark_dirty("plan_history", old, entry)
+    index = st.session_state.get('compliance_index')
+    if index is not None: index.replan(plan_versions(data), monday)
+    persist()
+
+def build_plan_scenarios(week_loads, start_weekday, weeks, multipliers, taper_weeks, taper_factor):
+    n_days = weeks * 7
+    base = np.roll(np.asarray(week_loads, dtype=float), -start_weekday)[np.arange(n_days) % 7]
+    mult, taper = np.meshgrid(np.asarray(multipliers, dtype=float), np.asarray(taper_weeks, dtype=int), indexing='ij')
+    mult, taper = mult.ravel(), taper.ravel()
+    in_taper = np.arange(n_days)[None, :] >= (n_days - taper[:, None] * 7)
+    loads = base[None, :] * mult[:, None] * np.where(in_taper, taper_factor, 1.0)
+    return loads, mult, taper
+
+# --- Plan Compliance ---
+# Planned sessions (parsed from the plan version in force that week) are matched per day against
+# logged runs and lift sessions. Day results are computed lazily and cached; a write only drops
+# the cache for its own day and week, and a plan save only for weeks from its effective date.
+COMPLIANCE_LEVELS = {'low': 0, 'high': 1, 'anaerobic': 2}
+COMPLIANCE_WEIGHTS = (0.5, 0.3, 0.2)  # completion, volume, intensity
+COMPLIANCE_TARGET = 80
+
+def plan_versions(data):
+    # Oldest first; without any saved versions the current plan stands in for every week.
+    versions = sorted(data.get('plan_history', []), key=lambda h: h['date'])
+    return versions or [{"id": "", "date": "", "cycles": data['cycles'], "weekly_plan": data['weekly_plan']}]
+
+def actual_intensity(run):
+    zones = np.array([float(run.get(z, 0) or 0) for z in ZONE_KEYS])
+    if zones.sum() > 0:
+        _, mid, high = three_zone_split(zones)
+        return 'anaerobic' if high >= 0.2 else 'high' if mid + high >= 0.35 else 'low'
+    rpe = float(run.get('rpe', 0) or 0)
+    return 'anaerobic' if rpe >= 8 else 'high' if rpe >= 6 else 'low'
+
+def actual_session(record):
+    if 'exercises' in record:
+        return {"key": ("lift", str(record['id'])), "type": "Strength", "intensity": "strength", "duration": float(record.get('duration', 0) or 0), "distance": 0.0}
+    return {"key": ("run", str(record['id'])), "type": record.get('type', 'Run'), "intensity": actual_intensity(record),
+            "duration": float(record.get('duration', 0) or 0), "distance": float(record.get('distance', 0) or 0)}
+
+def match_day(planned, actual):
+    # Longest planned sessions pick first; each takes the same-type activity closest in duration.
+    free, pairs = list(actual), []
+    for p in sorted(planned, key=lambda p: -p['duration']):
+        same = [a for a in free if a['type'] == p['type']]
+        a = min(same, key=lambda a: abs(a['duration'] - p['duration'])) if same else None
+        if a: free.remove(a)
+        pairs.append((p, a))
+    return pairs, free
+
+def session_deviation(planned, actual):
+    if planned['distance'] and actual['distance']: volume = actual['distance'] / planned['distance'] - 1
+    else: volume = actual['duration'] / planned['duration'] - 1 if planned['duration'] else 0.0
+    if planned['intensity'] not in COMPLIANCE_LEVELS: return volume, None
+    return volume, COMPLIANCE_LEVELS[actual['intensity']] - COMPLIANCE_LEVELS[planned['intensity']]
+
+def compliance_score(totals):
+    if not totals['planned']: return None
+    completion = totals['done'] / totals['planned']
+    volume = 1 - min(abs(totals['actual_min'] / totals['planned_min'] - 1), 1) if totals['planned_min'] else completion
+    intensity = totals['intensity_hits'] / totals['intensity_n'] if totals['intensity_n'] else completion
+    return 100 * (COMPLIANCE_WEIGHTS[0] * completion + COMPLIANCE_WEIGHTS[1] * volume + COMPLIANCE_WEIGHTS[2] * intensity)
+
+def adherence_streaks(scores, target=COMPLIANCE_TARGET):
+    # Unplanned periods (score None) neither extend nor break a streak.
+    current = longest = 0
+    for s in scores:
+        if s is None: continue
+        current = current + 1 if s >= target else 0
+        longest = max(longest, current)
+    return current, longest
+
+class ComplianceIndex:
+    def __init__(self, runs, lifts, versions, easy_pace=6.0):
+        self.actual, self.days, self.weeks, self.parsed = {}, {}, {}, {}
+        self.easy_pace = easy_pace
+        self.replan(versions)
+        for r in runs: self.add(r)
+        for l in lifts: self.add(l)
+
+    def replan(self, versions, from_monday=None):
+        self.versions, self.mondays, self.parsed = versions, [v['date'] for v in versions], {}
+        if from_monday is None or str(from_monday) <= self.mondays[0]: self.days, self.weeks = {}, {}; return
+        self.days = {d: r for d, r in self.days.items() if week_start(d) < from_monday}
+        self.weeks = {m: w for m, w in self.weeks.items() if m < from_monday}
+
+    def _touch(self, record, sign):
+        try: d = datetime.strptime(record['date'], '%Y-%m-%d').date()
+        except (KeyError, ValueError, TypeError): return
+        a = actual_session(record)
+        bucket = self.actual.setdefault(d, {})
+        if sign > 0: bucket[a['key']] = a
+        else: bucket.pop(a['key'], None)
+        self.days.pop(d, None); self.weeks.pop(week_start(d), None)
+
+    def add(self, record): self._touch(record, 1)
+    def remove(self, record): self._touch(record, -1)
+
+    def version(self, monday):
+        return self.versions[max(bisect.bisect_right(self.mondays, str(monday)) - 1, 0)]
+
+    def planned(self, d):
+        v = self.version(week_start(d))
+        key = (v['id'], d.weekday())
+        if key not in self.parsed:
+            slots = v['weekly_plan'].get(WEEKDAYS[d.weekday()], {})
+            self.parsed[key] = [p for p in (parse_plan_session(slots.get(slot, ''), self.easy_pace) for slot in ('am', 'pm')) if p]
+        return self.parsed[key]
+
+    def day(self, d):
+        if d not in self.days:
+            planned = self.planned(d)
+            pairs, extra = match_day(planned, list(self.actual.get(d, {}).values()))
+            res = {"date": d, "planned": len(planned), "done": 0, "planned_min": sum(p['duration'] for p in planned),
+                   "actual_min": sum(a['duration'] for a in self.actual.get(d, {}).values()), "intensity_hits": 0, "intensity_n": 0,
+                   "sessions": [], "extra": extra}
+            for p, a in pairs:
+                volume, level = session_deviation(p, a) if a else (None, None)
+                res['done'] += a is not None
+                if level is not None: res['intensity_n'] += 1; res['intensity_hits'] += level == 0
+                res['sessions'].append({"plan": p, "actual": a, "volume": volume, "level": level})
+            self.days[d] = res
+        return self.days[d]
+
+    def settled(self, d, today):
+        # Today's sessions only count once done; unfinished ones aren't missed yet.
+        res = self.day(d)
+        if d != today: return res
+        done = [s for s in res['sessions'] if s['actual']]
+        return dict(res, planned=len(done), planned_min=sum(s['plan']['duration'] for s in done))
+
+    def week(self, monday, today):
+        # Days after today don't count; finished weeks are cached.
+        if monday in self.weeks: return self.weeks[monday]
+        days = [self.settled(monday + timedelta(days=i), today) for i in range(7) if monday + timedelta(days=i) <= today]
+        totals = {k: sum(d[k] for d in days) for k in ("planned", "done", "planned_min", "actual_min", "intensity_hits", "intensity_n")}
+        res = dict(totals, monday=monday, score=compliance_score(totals), cycles=self.version(monday)['cycles'], extra=sum(len(d['extra']) for d in days))
+        if monday + timedelta(days=6) < today: self.weeks[monday] = res
+        return res
+
+    def season(self, start, end, today):
+        first, last = week_start(start), week_start(min(end, today))
+        return [self.week(first + timedelta(weeks=i), today) for i in range((last - first).days // 7 + 1)] if first <= last else []
+
+    def day_streaks(self, start, end):
+        # A planned day counts when every planned session was done; rest days are skipped.
+        days = [self.day(start + timedelta(days=i)) for i in range((end - start).days + 1)]
+        return adherence_streaks([100 * d['done'] / d['planned'] if d['planned'] else None for d in days], target=100)
+
+def get_compliance_index():
+    if 'compliance_index' not in st.session_state:
+        data = st.session_state.data
+        st.session_state.compliance_index = ComplianceIndex(data['runs'], data['lifts'], plan_versions(data), recent_easy_pace(data['runs']))
+    return st.session_state.compliance_index
+
+# --- Rolling Load Analytics ---
+MONOTONY_ALERT = 2.0
+WOW_ALERT_PCT = 30.0
+
+def calculate_load_rolling(daily_loads, end_date=None):
+    end_date = end_date or get_malaysia_time().date()
+    if not daily_loads: return pd.DataFrame(columns=['date', 'load', 'weekly_load', 'monotony', 'strain', 'wow_change'])
+    idx = pd.date_range(min(daily_loads), max(max(daily_loads), end_date), freq='D')
+    load = pd.Series({pd.Timestamp(d): v for d, v in daily_loads.items()}).reindex(idx, fill_value=0.0)
+    roll = load.rolling(7, min_periods=7)
+    weekly, std = roll.sum(), roll.std()
+    monotony = (roll.mean() / std.where(std > 0)).fillna(0.0)
+    prev_week = weekly.shift(7)
+    wow = ((weekly - prev_week) / prev_week.where(prev_week > 0) * 100).fillna(0.0)
+    return pd.DataFrame({'date': idx.date, 'load': load.to_numpy(), 'weekly_load': weekly.fillna(0.0).to_numpy(), 'monotony': monotony.to_numpy(),
+                         'strain': (weekly.fillna(0.0) * monotony).to_numpy(), 'wow_change': wow.to_numpy()})
+
+def strain_alert_threshold(frame):
+    strain = frame['strain'][frame['strain'] > 0]
+    return float(strain.mean() + 1.5 * strain.std()) if len(strain) > 1 else 0.0
+
+def rolling_at(frame, d):
+    if frame.empty: return None
+    pos = int(np.searchsorted(frame['date'].to_numpy(), d, side='right')) - 1
+    return frame.iloc[pos] if pos >= 0 else None
+
+def get_load_rolling():
+    key = (st.session_state.get('data_version', 0), id(get_derived()), get_malaysia_time().date())
+    cached = st.session_state.get('load_rolling')
+    if cached and cached[0] == key: return cached[1]
+    frame = calculate_load_rolling(get_engine().daily_loads(st.session_state.data['runs'], lifts=st.session_state.data['lifts']))
+    st.session_state.load_rolling = (key, frame)
+    return frame
+
+# --- Performance Model ---
+# Banister fitness-fatigue model: perf(t) = p0 + k1 * fitness(t) - k2 * fatigue(t), where each
+# component is the daily load convolved with exp(-days / tau). Taus come from a grid search,
+# gains from least squares; the best pair is refit with statsmodels for fit statistics.
+MODEL_TAU_FITNESS = np.arange(20, 61, 2)
+MODEL_TAU_FATIGUE = np.arange(3, 21)
+MODEL_MIN_MARKERS = 8
+
+def performance_markers(runs):
+    # Efficiency factor: speed (m/min) per beat of average HR on steady runs.
+    by_day = {}
+    for r in runs:
+        try:
+            if r.get('type') != 'Run' or not r.get('avgHr') or float(r['distance']) <= 0 or float(r['duration']) < 15: continue
+            d = datetime.strptime(r['date'], '%Y-%m-%d').date()
+            by_day.setdefault(d, []).append(float(r['distance']) * 1000 / float(r['duration']) / float(r['avgHr']))
+        except (KeyError, ValueError, TypeError): continue
+    days = sorted(by_day)
+    return days, np.array([np.mean(by_day[d]) for d in days])
+
+def impulse_responses(day_loads, taus):
+    decay = np.exp(-1.0 / np.asarray(taus, dtype=float))
+    out = np.zeros((len(decay), len(day_loads)))
+    acc = np.zeros(len(decay))
+    for t, load in enumerate(day_loads):
+        acc = acc * decay
+        out[:, t] = acc
+        acc = acc + load
+    return out
+
+def fit_banister(day_loads, marker_idx, markers, tau_fit=MODEL_TAU_FITNESS, tau_fat=MODEL_TAU_FATIGUE):
+    scale = max(float(np.max(day_loads)), 1.0)
+    G = impulse_responses(day_loads / scale, tau_fit)[:, marker_idx]
+    H = impulse_responses(day_loads / scale, tau_fat)[:, marker_idx]
+    n = len(markers)
+    X = np.stack(np.broadcast_arrays(np.ones((len(tau_fit), len(tau_fat), n)), G[:, None, :], -H[None, :, :]), axis=-1)
+    XtX = np.einsum('abni,abnj->abij', X, X) + 1e-9 * np.eye(3)
+    Xty = np.einsum('abni,n->abi', X, markers)
+    params = np.linalg.solve(XtX, Xty[..., None])[..., 0]
+    sse = ((markers - np.einsum('abni,abi->abn', X, params)) ** 2).sum(-1)
+    ordered = tau_fit[:, None] > tau_fat[None, :]
+    valid = ordered & (params[..., 1] > 0) & (params[..., 2] > 0)
+    sse = np.where(valid if valid.any() else ordered, sse, np.inf)
+    a, b = np.unravel_index(np.argmin(sse), sse.shape)
+    ols = sm.OLS(markers, np.column_stack([np.ones(n), G[a], -H[b]])).fit()
+    p0, k1, k2 = ols.params
+    return {"tau_fitness": int(tau_fit[a]), "tau_fatigue": int(tau_fat[b]), "p0": float(p0), "k1": float(k1 / scale), "k2": float(k2 / scale),
+            "r2": float(ols.rsquared), "n": int(n), "pvalues": [float(v) for v in ols.pvalues]}
+
+def model_inputs(runs, engine, lifts=()):
+    daily = engine.daily_loads(runs, lifts=lifts)
+    marker_days, markers = performance_markers(runs)
+    if not daily or len(markers) < MODEL_MIN_MARKERS: return None
+    start = min(min(daily), marker_days[0]); end = max(max(daily), marker_days[-1])
+    day_loads = np.zeros((end - start).days + 1)
+    for d, load in daily.items(): day_loads[(d - start).days] += load
+    marker_idx = np.array([(d - start).days for d in marker_days])
+    return start, day_loads, marker_idx, markers
+
+def refit_performance_model(force=False):
+    data = st.session_state.data
+    cached = data.get('performance_model') or {}
+    inputs = model_inputs(data['runs'], get_engine(), data['lifts'])
+    if inputs is None: return cached
+    start, day_loads, marker_idx, markers = inputs
+    signature = f"{len(markers)}|{start + timedelta(days=int(marker_idx[-1]))}|{round(float(day_loads.sum()))}"
+    if not force and cached.get('signature') == signature: return cached
+    tau_fit, tau_fat = MODEL_TAU_FITNESS, MODEL_TAU_FATIGUE
+    if not force and cached.get('tau_fitness') and len(markers) < 1.25 * cached.get('full_fit_n', 0):
+        # Incremental refit: search only around the cached time constants.
+        tau_fit = tau_fit[np.abs(tau_fit - cached['tau_fitness']) <= 6]
+        tau_fat = tau_fat[np.abs(tau_fat - cached['tau_fatigue']) <= 3]
+        full_n = cached['full_fit_n']
+    else: full_n = len(markers)
+    model = fit_banister(day_loads, marker_idx, markers, tau_fit, tau_fat)
+    model.update({"signature": signature, "full_fit_n": full_n, "fitted_at": get_malaysia_time().strftime('%Y-%m-%d %H:%M')})
+    data['performance_model'] = model
+    if db: db.collection("settings").document("model").set(model)
+    return model
 
 # --- Helper Functions ---
 def get_malaysia_time():
@@ -168,11 +1978,13 @@ def scroll_to_top():
     components.html(js, height=0)
 
 def get_last_lift_stats(ex_name):
-    return None
+    return get_lift_index().last(ex_name)
 
 # --- Physiology Engine ---
+EWMA_WINDOW_DAYS = 84
 class PhysiologyEngine:
-    def __init__(self, user_profile):
+    def __init__(self, user_profile, load_cache=None):
+        self.load_cache = load_cache
         self.hr_max = float(user_profile.get('hrMax', 190))
         self.hr_rest = float(user_profile.get('hrRest', 60))
         self.vo2_max = float(user_profile.get('vo2Max', 45))
@@ -225,23 +2037,98 @@ class PhysiologyEngine:
 
         return load, focus_scores
 
+    def zone_edges(self):
+        return np.array([float(self.zones.get(k, d)) for k, d in (('z1_u', 130), ('z2_u', 145), ('z3_u', 160), ('z4_u', 175))])
+
+    def time_in_zones(self, hr_stream):
+        hr = np.asarray(hr_stream, dtype=float)
+        hr = hr[hr > 0]
+        idx = np.searchsorted(self.zone_edges(), hr, side='left')
+        return np.bincount(idx, minlength=5)[:5] / 60.0
+
+    def calculate_stream_trimp(self, hr_stream):
+        hr = np.asarray(hr_stream, dtype=float)
+        hr = hr[hr > 0]
+        if hr.size == 0: return 0.0, {'low': 0.0, 'high': 0.0, 'anaerobic': 0.0}
+        exponent = 1.92 if self.gender == 'male' else 1.67
+        hr_reserve = np.clip((hr - self.hr_rest) / (self.hr_max - self.hr_rest), 0.0, 1.0)
+        per_sec = hr_reserve * 0.64 * np.exp(exponent * hr_reserve) / 60.0
+        zone_load = np.bincount(np.searchsorted(self.zone_edges(), hr, side='left'), weights=per_sec, minlength=5)[:5]
+        focus_scores = {'low': float(zone_load[:2].sum()), 'high': float(zone_load[2:4].sum()), 'anaerobic': float(zone_load[4])}
+        return float(per_sec.sum()), focus_scores
+
+    def calculate_activity_load(self, activity):
+        if self.load_cache is None: return self._activity_load(activity)
+        rid = str(activity.get('id'))
+        if rid not in self.load_cache: self.load_cache[rid] = self._activity_load(activity)
+        load, focus = self.load_cache[rid]
+        return load, dict(focus)
+
+    def _activity_load(self, activity):
+        stream_load, stream_focus = activity.get('streamLoad'), activity.get('streamFocus')
+        if isinstance(stream_load, (int, float)) and not math.isnan(stream_load) and isinstance(stream_focus, dict):
+            return float(stream_load), dict(stream_focus)
+        zones = [float(activity.get(f'z{i}', 0) or 0) for i in range(1,6)]
+        hr = int(activity.get('avgHr', 0)) if activity.get('avgHr') else 0
+        rpe = int(activity.get('rpe', 0)) if activity.get('rpe') else 0
+        return self.calculate_trimp(float(activity.get('duration', 0) or 0), hr, zones, rpe)
+
+    def planned_session_load(self, session):
+        if not session: return 0.0
+        if session['intensity'] == 'strength': return self.calculate_trimp(session['duration'], rpe=6)[0]
+        z = self.zones
+        avg_hr = {'low': (float(z.get('z2_l', 131)) + float(z.get('z2_u', 145))) / 2,
+                  'high': (float(z.get('z3_l', 146)) + float(z.get('z4_u', 175))) / 2,
+                  'anaerobic': (float(z.get('z4_l', 161)) + float(z.get('z4_u', 175))) / 2}[session['intensity']]
+        return self.calculate_trimp(session['duration'], avg_hr)[0]
+
+    def planned_week_loads(self, weekly_plan, easy_pace=6.0):
+        return np.array([sum(self.planned_session_load(parse_plan_session(weekly_plan.get(day, {}).get(slot, ''), easy_pace)) for slot in ('am', 'pm')) for day in WEEKDAYS])
+
+    def forecast_scenarios(self, atl0, ctl0, recent_loads, scenario_loads):
+        # scenario_loads: (scenarios, days). EWMA is applied as one lower-triangular matrix product per constant.
+        loads = np.atleast_2d(np.asarray(scenario_loads, dtype=float))
+        n_days = loads.shape[1]
+        t = np.arange(n_days)
+        lag = t[:, None] - t[None, :]
+        def ewma(x0, k):
+            kernel = np.where(lag >= 0, k * (1 - k) ** np.clip(lag, 0, None), 0.0)
+            return loads @ kernel.T + x0 * (1 - k) ** (t + 1)
+        atl, ctl = ewma(atl0, 2/(7+1)), ewma(ctl0, 2/(42+1))
+        recent = np.zeros(27)
+        tail = np.asarray(recent_loads, dtype=float)[-27:]
+        if len(tail): recent[-len(tail):] = tail
+        full = np.concatenate([np.broadcast_to(recent, (loads.shape[0], 27)), loads], axis=1)
+        cs = np.concatenate([np.zeros((loads.shape[0], 1)), np.cumsum(full, axis=1)], axis=1)
+        end = t + 28
+        acute = cs[:, end] - cs[:, end - 7]
+        chronic = (cs[:, end] - cs[:, end - 28]) / 4.0
+        acwr = np.divide(acute, chronic, out=np.zeros_like(acute), where=chronic > 0)
+        return {'load': loads, 'atl': atl, 'ctl': ctl, 'tsb': ctl - atl, 'acwr': acwr}
+
     def get_daily_target(self, current_rhr, current_hrv=None, current_sleep=0):
+        if not current_rhr:
+            return {"readiness": "Unknown", "recommendation": "No RHR logged", "target_load": "-", "message": "Log a resting HR to get a readiness target.", "color": "#64748b", "bg": "#f1f5f9", "rhr_stat": "No data", "hrv_stat": "Normal" if current_hrv else "No data", "sleep_stat": "Normal"}
         diff = current_rhr - self.hr_rest
         if diff < -2:
-            return {"readiness": "High", "recommendation": "Go Hard / Interval Day", "target_load": "Heavy (e.g., Threshold)", "message": "Green light. System primed.", "color": "#65a30d", "bg": "#dcfce7", "rhr_stat": "Good", "hrv_stat": "Normal", "sleep_stat": "Normal"}
+            target = {"readiness": "High", "recommendation": "Go Hard / Interval Day", "target_load": "Heavy (e.g., Threshold)", "message": "Green light. System primed.", "color": "#65a30d", "bg": "#dcfce7", "rhr_stat": "Good", "hrv_stat": "Normal", "sleep_stat": "Normal"}
         elif diff > 5:
-            return {"readiness": "Low", "recommendation": "Active Recovery", "target_load": "Recovery (e.g., 30m easy)", "message": "Red light. Focus on sleep.", "color": "#be123c", "bg": "#fee2e2", "rhr_stat": "High", "hrv_stat": "Low", "sleep_stat": "Poor"}
+            target = {"readiness": "Low", "recommendation": "Active Recovery", "target_load": "Recovery (e.g., 30m easy)", "message": "Red light. Focus on sleep.", "color": "#be123c", "bg": "#fee2e2", "rhr_stat": "High", "hrv_stat": "Low", "sleep_stat": "Poor"}
         else:
-            return {"readiness": "Moderate", "recommendation": "Steady State", "target_load": "Maintenance (e.g., Z2)", "message": "Train, but keep controlled.", "color": "#ea580c", "bg": "#ffedd5", "rhr_stat": "Normal", "hrv_stat": "Normal", "sleep_stat": "Normal"}
+            target = {"readiness": "Moderate", "recommendation": "Steady State", "target_load": "Maintenance (e.g., Z2)", "message": "Train, but keep controlled.", "color": "#ea580c", "bg": "#ffedd5", "rhr_stat": "Normal", "hrv_stat": "Normal", "sleep_stat": "Normal"}
+        if not current_hrv: target["hrv_stat"] = "No data"
+        return target
     
-    def get_dynamic_daily_target(self, current_rhr, current_hrv, avg_7d_rhr, avg_7d_hrv):
-        if not avg_7d_rhr or not avg_7d_hrv: return self.get_daily_target(current_rhr, current_hrv)
+    def get_dynamic_daily_target(self, current_rhr, current_hrv, avg_7d_rhr, avg_7d_hrv, current_sleep=0, avg_7d_sleep=None):
+        if not current_rhr or not avg_7d_rhr or not avg_7d_hrv or not current_hrv: return self.get_daily_target(current_rhr, current_hrv, current_sleep)
         rhr_z = current_rhr - avg_7d_rhr; hrv_z = current_hrv - avg_7d_hrv
+        sleep_short = bool(avg_7d_sleep and current_sleep and current_sleep < avg_7d_sleep - 1.0)
+        stats = {"rhr_stat": "High" if rhr_z > 3 else "Good" if rhr_z < -2 else "Normal", "hrv_stat": "Low" if hrv_z < -10 else "Good" if hrv_z > 5 else "Normal", "sleep_stat": "Poor" if sleep_short else "Normal"}
         is_fatigued = (rhr_z > 3) or (hrv_z < -10)
-        is_prime = (rhr_z < -2) and (hrv_z > -5)
-        if is_fatigued: return {"readiness": "Low", "recommendation": "Recovery / Rest", "target_load": "Light (<40)", "message": f"Fatigue detected vs 7-day trend (RHR +{rhr_z:.1f})", "color": "#be123c", "bg": "#fee2e2"}
-        elif is_prime: return {"readiness": "High", "recommendation": "Intervals / Tempo", "target_load": "Heavy (>120)", "message": "Primed. Stats better than recent avg.", "color": "#65a30d", "bg": "#dcfce7"}
-        else: return {"readiness": "Moderate", "recommendation": "Base / Aerobic", "target_load": "Normal (60-100)", "message": "Stable. Maintain volume.", "color": "#ea580c", "bg": "#ffedd5"}
+        is_prime = (rhr_z < -2) and (hrv_z > -5) and not sleep_short
+        if is_fatigued: return {"readiness": "Low", "recommendation": "Recovery / Rest", "target_load": "Light (<40)", "message": f"Fatigue detected vs 7-day trend (RHR {rhr_z:+.1f}, HRV {hrv_z:+.1f})", "color": "#be123c", "bg": "#fee2e2", **stats}
+        elif is_prime: return {"readiness": "High", "recommendation": "Intervals / Tempo", "target_load": "Heavy (>120)", "message": "Primed. Stats better than recent avg.", "color": "#65a30d", "bg": "#dcfce7", **stats}
+        else: return {"readiness": "Moderate", "recommendation": "Base / Aerobic", "target_load": "Normal (60-100)", "message": "Stable. Maintain volume." if not sleep_short else "Short sleep vs 7-day avg. Keep it aerobic.", "color": "#ea580c", "bg": "#ffedd5", **stats}
 
     def get_training_effect(self, trimp_score):
         scaling = self.vo2_max * 1.5
@@ -304,48 +2191,69 @@ class PhysiologyEngine:
             "feedback": feedback, "history": history_series, "total_4w": total_chronic
         }
 
-    def calculate_ewma_status(self, runs, reference_date=None):
-        today = reference_date if reference_date else get_malaysia_time().date()
+    def strength_session_load(self, session):
+        # Session-RPE (duration x RPE), the same fallback used for activities without heart rate.
+        return self.calculate_trimp(float(session.get('duration', 0) or 0), rpe=int(session.get('rpe', 0) or 0))[0]
+
+    def strength_history(self, lifts):
+        # Lift sessions as calculate_training_status entries: they count toward ACWR but have no aerobic focus.
+        return [{'date': l['date'], 'load': self.strength_session_load(l), 'focus': {}} for l in lifts if l.get('date')]
+
+    def daily_loads(self, runs, reference_date=None, lifts=()):
         daily_loads = {}
         for r in runs:
             try:
                 d = datetime.strptime(r['date'], '%Y-%m-%d').date()
-                if d > today: continue
-                zones = [float(r.get(f'z{i}', 0)) for i in range(1,6)]
-                hr = int(r.get('avgHr', 0)) if r.get('avgHr') else 0
-                rpe = int(r.get('rpe', 0)) if r.get('rpe') else 0
-                trimp, _ = self.calculate_trimp(float(r['duration']), hr, zones, rpe)
+                if reference_date and d > reference_date: continue
+                trimp, _ = self.calculate_activity_load(r)
                 daily_loads[d] = daily_loads.get(d, 0) + trimp
             except: continue
+        for l in lifts:
+            try:
+                d = datetime.strptime(l['date'], '%Y-%m-%d').date()
+                if reference_date and d > reference_date: continue
+                daily_loads[d] = daily_loads.get(d, 0) + self.strength_session_load(l)
+            except: continue
+        return daily_loads
 
-        date_range = [today - timedelta(days=x) for x in range(84)]
-        date_range.sort()
-        ewma_data = []
-        atl, ctl = 0, 0
+    def iter_ewma(self, daily_loads, start, end, atl=None, ctl=None):
         k_atl, k_ctl = 2/(7+1), 2/(42+1)
-        
-        for d in date_range:
+        d = start
+        while d <= end:
             load = daily_loads.get(d, 0)
-            if d == date_range[0]: atl = load; ctl = load
+            if atl is None or ctl is None: atl = load; ctl = load
             else:
                 atl = (load * k_atl) + (atl * (1 - k_atl))
                 ctl = (load * k_ctl) + (ctl * (1 - k_ctl))
-            ewma_data.append({'date': d, 'load': load, 'atl': atl, 'ctl': ctl, 'tsb': ctl - atl})
+            yield d, load, atl, ctl
+            d += timedelta(days=1)
+
+    def calculate_ewma_status(self, runs, reference_date=None, lifts=()):
+        today = reference_date if reference_date else get_malaysia_time().date()
+        daily_loads = self.daily_loads(runs, today, lifts)
+        ewma_data = [{'date': d, 'load': load, 'atl': atl, 'ctl': ctl, 'tsb': ctl - atl} for d, load, atl, ctl in self.iter_ewma(daily_loads, today - timedelta(days=EWMA_WINDOW_DAYS - 1), today)]
         return pd.DataFrame(ewma_data)
 
+    def ewma_on(self, daily_loads, d):
+        # ATL/CTL as calculate_ewma_status reports them with d as the reference date.
+        for _, _, atl, ctl in self.iter_ewma(daily_loads, d - timedelta(days=EWMA_WINDOW_DAYS - 1), d): pass
+        return atl, ctl
+
 # --- Report Generation ---
-def generate_report(start_date, end_date, options):
+def generate_report(start_date, end_date, options, data=None, progress=None):
+    if data is None: data = dict(st.session_state.data, load_rolling=get_load_rolling())
+    progress = progress or (lambda frac: None)
     report = [f"Training & Physio Report"]
     report.append(f"{start_date.strftime('%b %d')} - {end_date.strftime('%b %d')}\n")
-    engine = PhysiologyEngine(st.session_state.data['user_profile'])
+    engine = PhysiologyEngine(data['user_profile'])
     field_types = []
     if options.get('run'): field_types.append('Run')
     if options.get('walk'): field_types.append('Walk')
     if options.get('ultimate'): field_types.append('Ultimate')
     
     # 1. Summary Header
-    runs = st.session_state.data['runs']
-    stats = st.session_state.data['health_logs']
+    runs = data['runs']
+    stats = data['health_logs']
     
     period_runs = [r for r in runs if start_date <= datetime.strptime(r['date'], '%Y-%m-%d').date() <= end_date and r['type'] in field_types]
     period_stats = [s for s in stats if start_date <= datetime.strptime(s['date'], '%Y-%m-%d').date() <= end_date]
@@ -353,8 +2261,9 @@ def generate_report(start_date, end_date, options):
     total_dist = sum(r['distance'] for r in period_runs) if period_runs else 0
     total_time = sum(r['duration'] for r in period_runs) if period_runs else 0
     total_elev = sum(r.get('elevation', 0) for r in period_runs) if period_runs else 0
-    avg_rhr = sum(s.get('rhr', 0) for s in period_stats) / len(period_stats) if period_stats else 0
-    avg_hrv = sum(s.get('hrv', 0) for s in period_stats) / len(period_stats) if period_stats else 0
+    rhr_vals, hrv_vals = [s['rhr'] for s in period_stats if s.get('rhr')], [s['hrv'] for s in period_stats if s.get('hrv')]
+    avg_rhr = sum(rhr_vals) / len(rhr_vals) if rhr_vals else 0
+    avg_hrv = sum(hrv_vals) / len(hrv_vals) if hrv_vals else 0
     avg_sleep = sum(s.get('sleepHours', 0) for s in period_stats) / len(period_stats) if period_stats else 0
     
     report.append("-" * 40)
@@ -366,13 +2275,13 @@ def generate_report(start_date, end_date, options):
     if avg_sleep: report.append(f"Avg Sleep: {format_sleep(avg_sleep)}")
     report.append("-" * 40)
     report.append("")
+    progress(0.2)
     
     if field_types and period_runs:
         report.append(f"ACTIVITIES ({len(period_runs)})")
         period_runs.sort(key=lambda x: x['date'])
         for r in period_runs:
-            zones = [float(r.get(f'z{i}', 0)) for i in range(1,6)]
-            trimp, focus = engine.calculate_trimp(float(r['duration']), int(r.get('avgHr', 0)), zones)
+            trimp, focus = engine.calculate_activity_load(r)
             te, te_label = engine.get_training_effect(trimp)
             line = f"- {r['date'][5:]}: {r['type']} {r['distance']}km @ {format_duration(r['duration'])}"
             metrics = []
@@ -405,6 +2314,7 @@ def generate_report(start_date, end_date, options):
             if details:
                 for d in details: report.append(f"   {d}")
         report.append("")
+    progress(0.5)
 
     if options.get('health') and period_stats:
         report.append(f"HEALTH LOG")
@@ -412,16 +2322,17 @@ def generate_report(start_date, end_date, options):
         for s in period_stats:
             date_str = s['date'][5:]
             sleep_str = format_sleep(s.get('sleepHours', 0))
-            daily_target = engine.get_daily_target(s.get('rhr', 0), s.get('hrv'), s.get('sleepHours', 0))
-            report.append(f"- {date_str}: Sleep: {sleep_str} | RHR {s.get('rhr')} | HRV {s.get('hrv', '-')} | {daily_target['readiness']}")
+            daily_target = engine.get_daily_target(s.get('rhr'), s.get('hrv'), s.get('sleepHours', 0))
+            report.append(f"- {date_str}: Sleep: {sleep_str} | RHR {s.get('rhr') or '-'} | HRV {s.get('hrv') or '-'} | {daily_target['readiness']}")
     
+    progress(0.6)
     if options.get('status'):
-        all_runs = st.session_state.data['runs']
+        all_runs = data['runs']
         h_data = []
         for r in all_runs:
-            zones = [float(r.get(f'z{i}', 0)) for i in range(1,6)]
-            trimp, focus = engine.calculate_trimp(float(r['duration']), int(r.get('avgHr', 0)), zones)
+            trimp, focus = engine.calculate_activity_load(r)
             h_data.append({'date': r['date'], 'load': trimp, 'focus': focus})
+        h_data += engine.strength_history(data.get('lifts', []))
         status = engine.calculate_training_status(h_data, reference_date=end_date)
         report.append("")
         report.append(f"STATUS (As of {end_date})")
@@ -430,12 +2341,16 @@ def generate_report(start_date, end_date, options):
         buckets = status['buckets']
         report.append(f"Focus: Low: {int(buckets['low'])} | High: {int(buckets['high'])} | Anaerobic: {int(buckets['anaerobic'])}")
     
+    progress(0.8)
     if options.get('adv_status'):
-        all_runs = st.session_state.data['runs']
-        df_ewma = engine.calculate_ewma_status(all_runs, reference_date=end_date)
+        all_runs = data['runs']
+        df_ewma = engine.calculate_ewma_status(all_runs, reference_date=end_date, lifts=data.get('lifts', []))
         if not df_ewma.empty:
             current = df_ewma.iloc[-1]
-            monotony = df_ewma['load'].tail(7).mean() / df_ewma['load'].tail(7).std() if df_ewma['load'].tail(7).std() > 0 else 0
+            rolling = data.get('load_rolling')
+            if rolling is None: rolling = calculate_load_rolling(engine.daily_loads(all_runs, lifts=data.get('lifts', [])), end_date)
+            row = rolling_at(rolling, end_date)
+            monotony = row['monotony'] if row is not None else 0
             
             # Helper for diff string
             def get_diff_str(curr_val, metric_key):
@@ -451,9 +2366,66 @@ def generate_report(start_date, end_date, options):
             report.append(f"Fatigue (ATL): {int(current['atl'])}{get_diff_str(current['atl'], 'atl')}")
             report.append(f"Form (TSB): {int(current['tsb'])}{get_diff_str(current['tsb'], 'tsb')}")
             report.append(f"Monotony (7d): {monotony:.2f}")
+            if row is not None:
+                report.append(f"Strain (7d): {int(row['strain'])}")
+                report.append(f"Weekly Load: {int(row['weekly_load'])} ({row['wow_change']:+.0f}% vs prior week)")
 
+    progress(1.0)
     return "\n".join(report)
 
+# --- Export ---
+EXPORT_CHUNK_ROWS = 500
+EXPORT_SCHEMAS = {
+    "runs": {"id": "str", "date": "str", "type": "str", "distance": "num", "duration": "num", "avgHr": "num", "rpe": "num", "feel": "str",
+             "cadence": "num", "power": "num", "elevation": "num", "shoe_id": "str", "z1": "num", "z2": "num", "z3": "num", "z4": "num", "z5": "num", "notes": "str"},
+    "health_logs": {"id": "str", "date": "str", "rhr": "num", "hrv": "num", "sleepHours": "num", "vo2Max": "num"},
+}
+EXPORT_DERIVED = {"load": "num", "focus": "str", "te": "num", "te_label": "str", "atl": "num", "ctl": "num", "tsb": "num"}
+
+def export_schema(dataset, derived=False):
+    return dict(EXPORT_SCHEMAS[dataset], **(EXPORT_DERIVED if derived and dataset == "runs" else {}))
+
+def iter_export_chunks(data, dataset, start_date, end_date, types=None, derived=False, chunk_rows=EXPORT_CHUNK_ROWS):
+    start_s, end_s = str(start_date)[:10], str(end_date)[:10]
+    records = sorted((r for r in data.get(dataset, []) if start_s <= r.get('date', '') <= end_s and (types is None or r.get('type') in types)), key=lambda r: r['date'])
+    schema = export_schema(dataset, derived)
+    derived = derived and dataset == "runs"
+    if derived:
+        engine = PhysiologyEngine(data['user_profile'])
+        daily_loads = engine.daily_loads(data['runs'], datetime.strptime(end_s, '%Y-%m-%d').date(), data.get('lifts', []))
+        ewma = {}
+    for i in range(0, len(records), chunk_rows):
+        rows = []
+        for r in records[i:i + chunk_rows]:
+            row = {c: r.get(c) for c in EXPORT_SCHEMAS[dataset]}
+            if derived:
+                load, focus = engine.calculate_activity_load(r)
+                te, te_label = engine.get_training_effect(load)
+                d = datetime.strptime(r['date'], '%Y-%m-%d').date()
+                if d not in ewma: ewma[d] = engine.ewma_on(daily_loads, d)
+                atl, ctl = ewma[d]
+                row.update({"load": round(load, 1), "focus": max(focus, key=focus.get) if any(focus.values()) else "", "te": te, "te_label": te_label, "atl": round(atl, 1), "ctl": round(ctl, 1), "tsb": round(ctl - atl, 1)})
+            rows.append(row)
+        chunk = pd.DataFrame(rows, columns=list(schema))
+        for c, kind in schema.items():
+            chunk[c] = pd.to_numeric(chunk[c], errors='coerce') if kind == "num" else chunk[c].map(lambda v: None if pd.isna(v) else str(v))
+        yield chunk, schema
+
+def build_export(data, dataset, fmt, start_date, end_date, types=None, derived=False):
+    # Chunks are encoded straight into one buffer, so the full row set is never materialised as a frame.
+    # Nothing touches disk, so there is no temp file to clean up. The schema/header is written even for an empty range.
+    schema = export_schema(dataset, derived)
+    out = io.BytesIO()
+    if fmt == "Parquet":
+        with pq.ParquetWriter(out, pa.schema([(c, pa.float64() if kind == "num" else pa.string()) for c, kind in schema.items()]), compression="snappy") as writer:
+            for chunk, _ in iter_export_chunks(data, dataset, start_date, end_date, types, derived):
+                writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+    else:
+        out.write((",".join(schema) + "\n").encode('utf-8'))
+        for chunk, _ in iter_export_chunks(data, dataset, start_date, end_date, types, derived):
+            out.write(chunk.to_csv(index=False, header=False).encode('utf-8'))
+    return out.getvalue()
+
 # --- Sidebar Navigation ---
 def render_sidebar():
     with st.sidebar:
@@ -462,7 +2434,7 @@ def render_sidebar():
         st.caption(f"🇲🇾 {malaysia_time.strftime('%d %b %Y, %H:%M')}")
         if db: st.caption("🟢 Connected to Firestore")
         else: st.caption("🟠 Local Storage (Offline)")
-        selected_tab = st.radio("Navigate", ["Training Status", "Cardio Training", "Activity Calendar", "Export"], label_visibility="collapsed")
+        selected_tab = st.radio("Navigate", ["Training Status", "Cardio Training", "Strength Training", "Activity Calendar", "Records", "Intensity", "Gear", "Forecast", "Compliance", "Export"], label_visibility="collapsed")
         st.divider()
         with st.expander("👤 Athlete Profile"):
             prof = st.session_state.data['user_profile']
@@ -474,9 +2446,12 @@ def render_sidebar():
             hr_max = c3.number_input("Max HR", value=int(prof.get('hrMax', 190)))
             vo2 = c5.number_input("VO2 Max", value=float(prof.get('vo2Max', 45)))
             st.markdown("**Monthly Averages**")
+            month_avg = get_readiness_baselines().averages(get_malaysia_time().date(), 28)
+            if month_avg['rhr'] or month_avg['hrv']: st.caption("Auto-filled from the last 28 days of morning logs.")
             cm1, cm2 = st.columns(2)
-            m_rhr = cm1.number_input("Avg RHR", value=int(prof.get('monthAvgRHR', 60)))
-            m_hrv = cm2.number_input("Avg HRV", value=int(prof.get('monthAvgHRV', 40)))
+            auto_rhr = int(round(month_avg['rhr'])) if month_avg['rhr'] else int(prof.get('monthAvgRHR', 60))
+            m_rhr = cm1.number_input("Avg RHR", value=auto_rhr)
+            m_hrv = cm2.number_input("Avg HRV", value=int(round(month_avg['hrv'])) if month_avg['hrv'] else int(prof.get('monthAvgHRV', 40)))
             st.markdown("**Heart Rate Zones**")
             cz = prof.get('zones', {})
             z1_u = st.number_input("Z1 Upper", value=int(cz.get('z1_u', 130)))
@@ -494,14 +2469,20 @@ def render_sidebar():
             if st.button("Save Profile"):
                 new_prof = {
                     'weight': new_weight, 'height': new_height, 'gender': gender,
-                    'hrMax': hr_max, 'hrRest': m_rhr, 'vo2Max': vo2, 
+                    # The auto-filled average only becomes hrRest (a load input) when the user edits it.
+                    'hrMax': hr_max, 'hrRest': m_rhr if m_rhr != auto_rhr else prof.get('hrRest', m_rhr), 'vo2Max': vo2, 
                     'monthAvgRHR': m_rhr, 'monthAvgHRV': m_hrv,
                     'zones': {"z1_u": z1_u, "z2_l": z2_l, "z2_u": z2_u, "z3_l": z3_l, "z3_u": z3_u, "z4_l": z4_l, "z4_u": z4_u, "z5_l": z5_l}
                 }
+                load_keys = ('hrMax', 'hrRest', 'gender', 'zones', 'vo2Max')
+                load_changed = any(prof.get(k) != new_prof[k] for k in load_keys)
                 st.session_state.data['user_profile'].update(new_prof)
                 if db: db.collection("settings").document("profile").set(new_prof)
-                else: save_data(st.session_state.data)
+                persist()
+                if load_changed: start_recompute()
+                else: st.session_state.derived = DerivedSnapshot(st.session_state.data['user_profile'], get_derived().loads)
                 st.success("Saved!")
+        render_recompute_job()
         return selected_tab
 
 # --- TAB RENDERERS ---
@@ -509,6 +2490,9 @@ def render_sidebar():
 def render_training_status():
     st.header(":material/monitor_heart: Training Status")
     setup_page()
+    if st.session_state.get('overnight_import_msg'):
+        st.toast(st.session_state.overnight_import_msg)
+        st.session_state.overnight_import_msg = None
     
     with st.container(border=True):
         c_header, c_date = st.columns([3, 2])
@@ -519,31 +2503,32 @@ def render_training_status():
         if 'edit_morning_date' not in st.session_state: st.session_state.edit_morning_date = None
         is_editing = (st.session_state.edit_morning_date == str(h_date))
         
-        # Calculate deltas for display
+        # Calculate deltas for display (28-day rolling baseline, profile values as fallback)
         prof = st.session_state.data['user_profile']
-        base_rhr = prof.get('monthAvgRHR', 60)
-        base_hrv = prof.get('monthAvgHRV', 40)
+        baselines = get_readiness_baselines()
+        month_avg = baselines.averages(h_date - timedelta(days=1), 28)
+        base_rhr = round(month_avg['rhr']) if month_avg['rhr'] else prof.get('monthAvgRHR', 60)
+        base_hrv = round(month_avg['hrv']) if month_avg['hrv'] else prof.get('monthAvgHRV', 40)
         
         if existing_log and not is_editing:
-            rhr_diff = existing_log['rhr'] - base_rhr
-            hrv_diff = existing_log.get('hrv', 40) - base_hrv
+            rhr_diff = f"{existing_log['rhr'] - base_rhr} bpm" if existing_log.get('rhr') else None
+            hrv_diff = f"{existing_log['hrv'] - base_hrv} ms" if existing_log.get('hrv') else None
             
             v1, v2, v3, v4 = st.columns(4)
-            v1.metric("Sleep", format_sleep(existing_log['sleepHours']))
-            v2.metric("RHR", f"{existing_log['rhr']}", f"{rhr_diff} bpm", delta_color="inverse")
-            v3.metric("HRV", f"{existing_log.get('hrv', '-')}", f"{hrv_diff} ms")
+            v1.metric("Sleep", format_sleep(existing_log.get('sleepHours', 0)))
+            v2.metric("RHR", f"{existing_log.get('rhr') or '-'}", rhr_diff, delta_color="inverse")
+            v3.metric("HRV", f"{existing_log.get('hrv') or '-'}", hrv_diff)
             with v4:
                 st.write("")
                 col_e, col_d = st.columns(2)
                 if col_e.button(":material/edit:", key=f"edit_m_{existing_log['id']}"): st.session_state.edit_morning_date = str(h_date); st.rerun()
                 if col_d.button(":material/delete:", key=f"del_m_{existing_log['id']}"):
-                    if db: db.collection("health_logs").document(str(existing_log['id'])).delete()
-                    st.session_state.data['health_logs'] = [h for h in st.session_state.data['health_logs'] if h['id'] != existing_log['id']]
+                    delete_health_log(existing_log['id'])
                     st.rerun()
         else:
-            def_rhr = existing_log['rhr'] if existing_log else base_rhr
-            def_hrv = existing_log['hrv'] if existing_log else base_hrv
-            def_sleep_str = float_to_hhmm(existing_log['sleepHours']) if existing_log else "07:30"
+            def_rhr = (existing_log.get('rhr') if existing_log else None) or base_rhr
+            def_hrv = (existing_log.get('hrv') if existing_log else None) or base_hrv
+            def_sleep_str = float_to_hhmm(existing_log['sleepHours']) if existing_log and existing_log.get('sleepHours') else "07:30"
             with st.form("daily_health", clear_on_submit=False):
                 c_sleep, c_rhr, c_hrv, c_btn = st.columns(4)
                 sleep_str = c_sleep.text_input("Sleep (hh:mm)", value=def_sleep_str, placeholder="07:30")
@@ -553,24 +2538,47 @@ def render_training_status():
                 c_btn.write(""); c_btn.write("")
                 if c_btn.form_submit_button(btn_label, use_container_width=True):
                     sleep_dec = parse_time_input(sleep_str)
-                    doc_id = str(existing_log['id']) if existing_log else str(int(time.time()))
-                    new_h = {"id": doc_id, "date": str(h_date), "rhr": rhr, "hrv": hrv, "sleepHours": sleep_dec, "vo2Max": 0}
-                    if db: db.collection("health_logs").document(doc_id).set(new_h)
-                    if existing_log:
-                        idx = next((i for i, h in enumerate(st.session_state.data['health_logs']) if str(h['id']) == doc_id), -1)
-                        if idx != -1: st.session_state.data['health_logs'][idx] = new_h
-                        st.session_state.edit_morning_date = None; st.success("Updated!")
-                    else:
-                        st.session_state.data['health_logs'].insert(0, new_h); st.success("Logged!")
-                    if not db: save_data(st.session_state.data)
+                    fields = {"date": str(h_date), "rhr": rhr, "hrv": hrv, "sleepHours": sleep_dec, "vo2Max": 0}
+                    doc_id = str(existing_log['id']) if existing_log else submit_once("daily_health", fields)
+                    new_h = {"id": doc_id, **fields}
+                    save_health_log(new_h)
+                    if not existing_log: rotate_form_token("daily_health")
+                    if existing_log: st.session_state.edit_morning_date = None; st.success("Updated!")
+                    else: st.success("Logged!")
                     st.rerun()
             if is_editing:
                 if st.button("Cancel Edit"): st.session_state.edit_morning_date = None; st.rerun()
+
+        with st.expander("⌚ Import Overnight Data"):
+            st.caption("CSV with a timestamp column plus hr and rmssd (optional sleep stage). Nightly RHR, HRV and sleep are written to the daily log.")
+            overnight_file = st.file_uploader("Overnight CSV", type=["csv"], label_visibility="collapsed", key="overnight_file")
+            if overnight_file is not None and st.button("Import Nights"):
+                t0 = time.time()
+                try: count = import_overnight(overnight_file)
+                except Exception as e: st.error(f"Could not import overnight data: {e}")
+                else:
+                    if count: st.session_state.overnight_import_msg = f"✅ Imported {count} nights in {time.time() - t0:.1f}s."; st.rerun()
+                    else: st.warning("No complete nights found in this file.")
+            nights = sorted((h['date'] for h in st.session_state.data['health_logs'] if h.get('source') == 'overnight'), reverse=True)
+            if nights:
+                c_night, c_show = st.columns([3, 1])
+                night = c_night.selectbox("Night", nights, label_visibility="collapsed", key="overnight_night")
+                if c_show.button("Show Night"):
+                    series = load_overnight(night)
+                    if series:
+                        times = pd.to_datetime(series['t'], unit='s')
+                        fig = make_subplots(specs=[[{"secondary_y": True}]])
+                        fig.add_trace(go.Scatter(x=times, y=np.where(series['hr'] > 0, series['hr'], np.nan), name="HR", line=dict(color='#be123c')), secondary_y=False)
+                        fig.add_trace(go.Scatter(x=times, y=np.where(series['rmssd'] > 0, series['rmssd'], np.nan), name="RMSSD", line=dict(color='#65a30d')), secondary_y=True)
+                        fig.update_layout(height=260, margin=dict(l=20, r=20, t=20, b=20), legend=dict(orientation="h"))
+                        st.plotly_chart(fig, use_container_width=True)
+                    else: st.info("No raw series stored for this night.")
     
         display_log = existing_log if existing_log else (st.session_state.data['health_logs'][0] if st.session_state.data['health_logs'] else None)
         if display_log:
-            engine = PhysiologyEngine(st.session_state.data['user_profile'])
-            target_data = engine.get_daily_target(display_log['rhr'], display_log.get('hrv', 40), display_log.get('sleepHours', 0))
+            engine = get_engine()
+            week_avg = baselines.averages(datetime.strptime(display_log['date'], '%Y-%m-%d').date() - timedelta(days=1), 7)
+            target_data = engine.get_dynamic_daily_target(display_log.get('rhr'), display_log.get('hrv'), week_avg['rhr'], week_avg['hrv'], display_log.get('sleepHours', 0), week_avg['sleepHours'])
             
             st.markdown(f"""
 <div class="daily-target" style="border-left: 6px solid {target_data['color']}; background-color: {target_data.get('bg', '#ffffff')};">
@@ -581,9 +2589,9 @@ def render_training_status():
     <div class="target-load">Target: {target_data['target_load']}</div>
     <div style="font-size: 0.9rem; color:#475569; font-style:italic; margin-bottom:10px;">"{target_data['message']}"</div>
     <div class="bio-row">
-        <div class="bio-item"><b>RHR:</b> {display_log['rhr']} <span style="font-size:0.75em">({target_data['rhr_stat']})</span></div>
-        <div class="bio-item"><b>HRV:</b> {display_log.get('hrv', '-')} <span style="font-size:0.75em">({target_data['hrv_stat']})</span></div>
-        <div class="bio-item"><b>Sleep:</b> {format_sleep(display_log['sleepHours'])} <span style="font-size:0.75em">({target_data['sleep_stat']})</span></div>
+        <div class="bio-item"><b>RHR:</b> {display_log.get('rhr') or '-'} <span style="font-size:0.75em">({target_data['rhr_stat']})</span></div>
+        <div class="bio-item"><b>HRV:</b> {display_log.get('hrv') or '-'} <span style="font-size:0.75em">({target_data['hrv_stat']})</span></div>
+        <div class="bio-item"><b>Sleep:</b> {format_sleep(display_log.get('sleepHours', 0))} <span style="font-size:0.75em">({target_data['sleep_stat']})</span></div>
     </div>
 </div>
 """, unsafe_allow_html=True)
@@ -594,10 +2602,10 @@ def render_training_status():
     st.subheader("Performance Management (EWMA)")
     
     runs = st.session_state.data['runs']
-    engine = PhysiologyEngine(st.session_state.data['user_profile'])
+    engine = get_engine()
     
     if runs:
-        df_ewma = engine.calculate_ewma_status(runs)
+        df_ewma = engine.calculate_ewma_status(runs, lifts=st.session_state.data['lifts'])
         if not df_ewma.empty:
             current = df_ewma.iloc[-1]
             past_7d = df_ewma.iloc[-8] if len(df_ewma) > 7 else df_ewma.iloc[0]
@@ -610,7 +2618,8 @@ def render_training_status():
             c1.metric("Fitness (CTL)", f"{int(current['ctl'])}", f"{d_ctl}", help="Chronic Training Load. Measures long-term fitness.")
             c2.metric("Fatigue (ATL)", f"{int(current['atl'])}", f"{d_atl}", delta_color="inverse", help="Acute Training Load. Measures recent tiredness.")
             c3.metric("Form (TSB)", f"{int(current['tsb'])}", f"{d_tsb}", help="Training Stress Balance. Positive = Fresh, Negative = Training.")
-            monotony = df_ewma['load'].tail(7).mean() / df_ewma['load'].tail(7).std() if df_ewma['load'].tail(7).std() > 0 else 0
+            rolling = get_load_rolling()
+            monotony = rolling['monotony'].iloc[-1] if not rolling.empty else 0
             c4.metric("Monotony", f"{monotony:.1f}", help=">2.0 indicates high injury risk (lack of variation).")
             
             # Insight Cards
@@ -651,11 +2660,57 @@ def render_training_status():
                 )
             )
             st.plotly_chart(fig, use_container_width=True)
+
+            # Monotony & Strain (full history)
+            if not rolling.empty:
+                strain_limit = strain_alert_threshold(rolling)
+                latest = rolling.iloc[-1]
+                if latest['monotony'] > MONOTONY_ALERT: st.warning(f"**Monotony {latest['monotony']:.1f}** - training days are too similar. Vary easy and hard days.")
+                if strain_limit and latest['strain'] > strain_limit: st.warning(f"**Strain {int(latest['strain'])}** - above your usual range ({int(strain_limit)}).")
+                if latest['wow_change'] > WOW_ALERT_PCT: st.warning(f"**Weekly load +{latest['wow_change']:.0f}%** vs the previous week.")
+                fig_ms = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.04, subplot_titles=("Monotony", "Strain", "Week-over-Week Load %"))
+                fig_ms.add_trace(go.Scatter(x=rolling['date'], y=rolling['monotony'], name='Monotony', line=dict(color='#8b5cf6')), row=1, col=1)
+                fig_ms.add_hline(y=MONOTONY_ALERT, line=dict(color='#be123c', dash='dash'), row=1, col=1)
+                fig_ms.add_trace(go.Scatter(x=rolling['date'], y=rolling['strain'], name='Strain', line=dict(color='#f97316')), row=2, col=1)
+                if strain_limit: fig_ms.add_hline(y=strain_limit, line=dict(color='#be123c', dash='dash'), row=2, col=1)
+                fig_ms.add_trace(go.Bar(x=rolling['date'], y=rolling['wow_change'], name='WoW %', marker_color=np.where(rolling['wow_change'] > WOW_ALERT_PCT, '#be123c', '#a8a29e')), row=3, col=1)
+                fig_ms.add_hline(y=WOW_ALERT_PCT, line=dict(color='#be123c', dash='dash'), row=3, col=1)
+                fig_ms.update_layout(height=520, margin=dict(l=20, r=20, t=40, b=20), showlegend=False, hovermode="x unified",
+                                     xaxis3=dict(rangeselector=dict(buttons=[dict(count=3, label="3m", step="month", stepmode="backward"), dict(count=1, label="1y", step="year", stepmode="backward"), dict(step="all")]), type="date"))
+                st.plotly_chart(fig_ms, use_container_width=True)
     else:
         st.info("Log runs to see EWMA status.")
 
     st.divider()
 
+    # --- Fitted Performance Model ---
+    st.subheader("Performance Model (Banister)")
+    model = st.session_state.data.get('performance_model') or {}
+    if not model.get('tau_fitness'): model = refit_performance_model()
+    inputs = model_inputs(runs, engine, st.session_state.data['lifts']) if model.get('tau_fitness') else None
+    if inputs is None:
+        st.info(f"Log at least {MODEL_MIN_MARKERS} runs with HR to fit your personal fitness-fatigue model.")
+    else:
+        start, day_loads, marker_idx, markers = inputs
+        fitness = impulse_responses(day_loads, [model['tau_fitness']])[0] * model['k1']
+        fatigue = impulse_responses(day_loads, [model['tau_fatigue']])[0] * model['k2']
+        predicted = model['p0'] + fitness - fatigue
+        dates = [start + timedelta(days=i) for i in range(len(day_loads))]
+        p1, p2, p3, p4 = st.columns(4)
+        p1.metric("Fitness τ", f"{model['tau_fitness']} d", help="Decay time of fitness gains (EWMA assumes 42).")
+        p2.metric("Fatigue τ", f"{model['tau_fatigue']} d", help="Decay time of fatigue (EWMA assumes 7).")
+        p3.metric("Gain Ratio", f"{model['k2'] / model['k1']:.1f}" if model['k1'] else "-", help="Fatigue gain / fitness gain.")
+        p4.metric("Fit R²", f"{model['r2']:.2f}", help=f"{model['n']} runs. Performance marker: speed per heartbeat.")
+        fig_model = go.Figure()
+        fig_model.add_trace(go.Scatter(x=dates, y=predicted, name='Predicted', line=dict(color='#c2410c')))
+        fig_model.add_trace(go.Scatter(x=[dates[i] for i in marker_idx], y=markers, mode='markers', name='Observed', marker=dict(color='#44403c', size=5)))
+        fig_model.update_layout(title="Efficiency (m/min per bpm): model vs runs", height=300, margin=dict(l=20, r=20, t=40, b=20), hovermode="x unified")
+        st.plotly_chart(fig_model, use_container_width=True)
+        if st.button("Refit from scratch", help=f"Last fitted {model.get('fitted_at', '-')}"):
+            refit_performance_model(force=True); persist(); st.rerun()
+
+    st.divider()
+
     # --- ACWR & Load Focus ---
     st.subheader("Workload Ratio (ACWR)")
     
@@ -663,13 +2718,10 @@ def render_training_status():
     processed_runs = []
     for r in runs:
         try:
-            zones = [float(r.get(f'z{i}', 0)) for i in range(1,6)]
-            hr = int(r.get('avgHr', 0)) if r.get('avgHr') else 0
-            rpe = int(r.get('rpe', 0)) if r.get('rpe') else 0
-            duration = float(r.get('duration', 0))
-            trimp, focus = engine.calculate_trimp(duration, hr, zones, rpe)
+            trimp, focus = engine.calculate_activity_load(r)
             processed_runs.append({'date': r['date'], 'load': trimp, 'focus': focus})
         except: continue
+    processed_runs += engine.strength_history(st.session_state.data['lifts'])
 
     status_data = engine.calculate_training_status(processed_runs)
     history_df = pd.DataFrame(status_data['history'])
@@ -716,19 +2768,17 @@ def render_training_status():
     st.markdown(draw_focus_bar("Low Aerobic (Blue)", buckets['low'], targets['low']['min'], targets['low']['max'], "#3b82f6"), unsafe_allow_html=True)
     st.divider()
     st.subheader("Recovery Trends (7 Days)")
-    health_logs = st.session_state.data['health_logs']
-    df_health = pd.DataFrame(health_logs)
+    df_health = get_health_table().frame()
     if not df_health.empty:
-        df_health['date_obj'] = pd.to_datetime(df_health['date'])
-        df_7d = df_health.sort_values('date_obj').tail(7)
+        df_7d = df_health.tail(7)
         col_rhr, col_hrv = st.columns(2)
         with col_rhr:
-            fig_rhr = px.line(df_7d, x='date_obj', y='rhr', title="Resting HR", markers=True)
+            fig_rhr = px.line(df_7d, x='date', y='rhr', title="Resting HR", markers=True)
             fig_rhr.update_traces(line_color='#be123c') 
             fig_rhr.update_layout(height=200, margin=dict(l=20, r=20, t=30, b=20), xaxis_title=None, yaxis_title=None)
             st.plotly_chart(fig_rhr, use_container_width=True)
         with col_hrv:
-            fig_hrv = px.line(df_7d, x='date_obj', y='hrv', title="HRV", markers=True)
+            fig_hrv = px.line(df_7d, x='date', y='hrv', title="HRV", markers=True)
             fig_hrv.update_traces(line_color='#65a30d') 
             fig_hrv.update_layout(height=200, margin=dict(l=20, r=20, t=30, b=20), xaxis_title=None, yaxis_title=None)
             st.plotly_chart(fig_hrv, use_container_width=True)
@@ -748,11 +2798,15 @@ def render_training_status():
 def render_cardio():
     st.header(":material/directions_run: Cardio Training")
     setup_page()
-    runs_df = pd.DataFrame(st.session_state.data['runs'])
-    engine = PhysiologyEngine(st.session_state.data['user_profile'])
+    table = get_activity_table()
+    engine = get_engine()
     if 'run_log_success' in st.session_state and st.session_state.run_log_success:
         st.toast("✅ Activity Logged Successfully!")
         st.session_state.run_log_success = False
+    for g, total, limit, level in gear_alerts(st.session_state.data['gear']):
+        msg = f"👟 {g['name']} is at {total:.0f} km of {limit:.0f} km"
+        if level == "retire": st.warning(msg + " - time to retire it.")
+        else: st.info(msg + ".")
     edit_run_id = st.session_state.get('edit_run_id', None)
     if 'form_act_type' not in st.session_state: st.session_state.form_act_type = "Run"
     def_type = st.session_state.form_act_type
@@ -760,7 +2814,10 @@ def render_cardio():
     def_dist, def_dur, def_hr, def_cad, def_pwr, def_elev = 0.0, 0.0, 0, 0, 0, 0
     def_notes, def_feel, def_rpe = "", "Normal", 5
     def_z1, def_z2, def_z3, def_z4, def_z5 = "", "", "", "", ""
-    def_shoe = "Default Shoe"
+    gear = st.session_state.data['gear']
+    active_gear = [str(g['id']) for g in gear if not g.get('retired')]
+    gear_names = {str(g['id']): g['name'] for g in gear}
+    def_shoe = active_gear[0] if active_gear else "default"
     
     if edit_run_id:
         run_data = next((r for r in st.session_state.data['runs'] if str(r['id']) == str(edit_run_id)), None)
@@ -773,7 +2830,7 @@ def render_cardio():
             def_cad = run_data.get('cadence', 0)
             def_pwr = run_data.get('power', 0)
             def_elev = run_data.get('elevation', 0)
-            def_shoe = run_data.get('shoe_id', 'Default Shoe')
+            def_shoe = str(run_data.get('shoe_id', 'default'))
             def_notes = run_data.get('notes', '')
             def_feel = run_data.get('feel', 'Normal')
             def_rpe = run_data.get('rpe', 5)
@@ -824,7 +2881,9 @@ def render_cardio():
                 st.caption("Elevation (m)")
                 elev = st.number_input("Elevation", min_value=0, value=int(def_elev), label_visibility="collapsed", key=f"elev_{key_suffix}")
             with c_g2:
-                st.write("") # Spacer since shoes are removed
+                st.caption("Shoe")
+                shoe_opts = ["default"] + active_gear + ([def_shoe] if def_shoe in gear_names and def_shoe not in active_gear else [])
+                shoe_id = st.selectbox("Shoe", shoe_opts, index=shoe_opts.index(def_shoe) if def_shoe in shoe_opts else 0, format_func=lambda x: gear_names.get(x, "No shoe"), label_visibility="collapsed", key=f"shoe_{key_suffix}")
 
             st.caption("Heart Rate Zones (Time in mm:ss)")
             rc1, rc2, rc3, rc4, rc5 = st.columns(5)
@@ -838,27 +2897,35 @@ def render_cardio():
             feel = st.radio("Feel", ["Good", "Normal", "Tired", "Pain"], index=feel_idx, horizontal=True, label_visibility="collapsed", key=f"feel_{key_suffix}")
             st.caption("Notes")
             notes = st.text_area("Notes", value=def_notes, placeholder="Easy run, felt strong...", height=3, label_visibility="collapsed", key=f"notes_{key_suffix}")
+            st.caption("Per-second Streams (optional CSV: hr, pace or speed, cadence, time)")
+            stream_file = st.file_uploader("Streams", type=["csv"], label_visibility="collapsed", key=f"streams_{key_suffix}")
             if st.form_submit_button("Update Activity" if edit_run_id else "Save Activity"):
-                new_id = str(int(time.time()))
-                doc_id = str(edit_run_id) if edit_run_id else new_id
                 dist_save = dist if dist is not None else 0.0
                 
-                run_obj = {
-                    "id": doc_id, "date": str(act_date), "type": act_type, "distance": dist_save, 
+                fields = {
+                    "date": str(act_date), "type": act_type, "distance": dist_save, 
                     "duration": parse_time_input(dur_str), "avgHr": hr, "rpe": rpe, "feel": feel, 
-                    "cadence": cadence, "power": power, "elevation": elev, "shoe_id": "default",
+                    "cadence": cadence, "power": power, "elevation": elev, "shoe_id": shoe_id,
                     "z1": parse_time_input(z1), "z2": parse_time_input(z2), "z3": parse_time_input(z3), 
                     "z4": parse_time_input(z4), "z5": parse_time_input(z5), "notes": notes
                 }
-                if db: db.collection("runs").document(doc_id).set(run_obj)
-                if edit_run_id:
-                    idx = next((i for i, r in enumerate(st.session_state.data['runs']) if str(r['id']) == str(edit_run_id)), -1)
-                    if idx != -1: st.session_state.data['runs'][idx] = run_obj
-                    st.session_state.edit_run_id = None; st.session_state.run_log_success = True
+                doc_id = str(edit_run_id) if edit_run_id else submit_once("run_form", fields)
+                run_obj = {"id": doc_id, **fields}
+                streams, stream_error = None, None
+                if stream_file is not None:
+                    try: streams = parse_stream_file(stream_file)
+                    except Exception as e: stream_error = e
+                elif edit_run_id and run_data and run_data.get('hasStreams'):
+                    run_obj.update({k: run_data[k] for k in ('hasStreams', 'streamLoad', 'streamFocus', 'splits', 'bestEfforts') if k in run_data})
+                if stream_error is not None:
+                    # Saving without streams would drop the stream metrics of an edited run and orphan its stored streams.
+                    st.error(f"Could not read streams: {stream_error}. Nothing was saved; fix or remove the file and try again.")
                 else:
-                    st.session_state.data['runs'].insert(0, run_obj); st.session_state.run_log_success = True
-                if not db: save_data(st.session_state.data)
-                persist(); st.rerun()
+                    save_run(run_obj, streams)
+                    if edit_run_id: st.session_state.edit_run_id = None
+                    else: rotate_form_token("run_form")
+                    st.session_state.run_log_success = True
+                    st.rerun()
         if edit_run_id:
             if st.button("Cancel Edit"): st.session_state.edit_run_id = None; st.rerun()
 
@@ -903,19 +2970,17 @@ def render_cardio():
             c_lbl.markdown(f"<div style='text-align: center; padding-top: 5px; font-weight: 600; color: #334155;'>{d_label}</div>", unsafe_allow_html=True)
             if c_next.button("▶", use_container_width=True, disabled=(st.session_state.dash_offset <= 0)): st.session_state.dash_offset -= 1; st.rerun()
 
-    period_runs_df = pd.DataFrame(columns=runs_df.columns)
-    if not runs_df.empty:
-        runs_df['dt_obj'] = pd.to_datetime(runs_df['date']).dt.date
-        period_runs_df = runs_df[ (runs_df['dt_obj'] >= start_d) & (runs_df['dt_obj'] <= end_d) ]
+    search_q = st.text_input("Search", placeholder="Search notes, feel, type or date (e.g. tempo, tired, march)", label_visibility="collapsed", key="history_search")
+    period_runs_df = table.between(start_d, end_d)
+    match_ids = get_search_index().search(search_q) if search_q else None
+    if match_ids is not None: period_runs_df = period_runs_df[period_runs_df['id'].isin(list(match_ids))]
 
     tabs = st.tabs(["All Activities", "Run", "Walk", "Ultimate"])
     categories = ["All", "Run", "Walk", "Ultimate"]
     for i, tab in enumerate(tabs):
         with tab:
             filter_cat = categories[i]
-            if not period_runs_df.empty:
-                filtered_df = period_runs_df[period_runs_df['type'] == filter_cat] if filter_cat != "All" else period_runs_df
-            else: filtered_df = pd.DataFrame(columns=['distance', 'duration', 'avgHr'])
+            filtered_df = period_runs_df[period_runs_df['type'] == filter_cat] if filter_cat != "All" else period_runs_df
             
             total_dist = filtered_df['distance'].sum() if not filtered_df.empty else 0
             total_mins = filtered_df['duration'].sum() if not filtered_df.empty else 0
@@ -936,10 +3001,9 @@ def render_cardio():
             st.divider()
 
             if not filtered_df.empty:
-                filtered_df = filtered_df.sort_values(by='dt_obj', ascending=False)
-                for idx, row in filtered_df.iterrows():
-                    zones = [float(row.get(f'z{i}', 0)) for i in range(1,6)]
-                    trimp, focus = engine.calculate_trimp(float(row['duration']), int(row.get('avgHr', 0)), zones)
+                for idx, rid in filtered_df['id'].iloc[::-1].items():
+                    row = table.record(rid)
+                    trimp, focus = engine.calculate_activity_load(row)
                     te, te_label = engine.get_training_effect(trimp)
                     
                     elev = row.get('elevation', 0)
@@ -960,6 +3024,8 @@ def render_cardio():
                         if row.get('cadence', 0) > 0: extras.append(f"Cad: {row['cadence']}")
                         if row.get('power', 0) > 0: extras.append(f"Pwr: {row['power']}")
                         if elev > 0: extras.append(f"Elev: {elev}m") # Elevation
+                        if row.get('hasStreams') == True: extras.append("Streams")
+                        if str(row.get('shoe_id')) in gear_names: extras.append(f"👟 {gear_names[str(row['shoe_id'])]}")
                         if extras: metrics_list.append(f"<span class='history-sub'>{' | '.join(extras)}</span>")
                         
                         # Feel
@@ -973,8 +3039,7 @@ def render_cardio():
                         with c_act:
                             if st.button(":material/edit:", key=f"ed_{row['id']}_{idx}_{filter_cat}"): st.session_state.edit_run_id = row['id']; st.rerun()
                             if st.button(":material/delete:", key=f"del_{row['id']}_{idx}_{filter_cat}"): 
-                                if db: db.collection("runs").document(str(row['id'])).delete()
-                                st.session_state.data['runs'] = [r for r in st.session_state.data['runs'] if r['id'] != row['id']]; persist(); st.rerun()
+                                delete_run(row['id']); st.rerun()
                         z_vals = [row.get(f'z{i}', 0) for i in range(1, 6)]
                         total_z_time = sum(z_vals)
                         if total_z_time > 0:
@@ -984,8 +3049,97 @@ def render_cardio():
                             bar_html = f"""<div style="display: flex; width: 100%; height: 18px; border-radius: 4px; overflow: hidden; margin-top: 12px; background-color: #f1f5f9;"><div style="width: {pcts[0]}%; background-color: #1e40af; color: white; font-size: 10px; display: flex; align-items: center; justify-content: center; overflow: hidden;">{get_lbl(pcts[0], t_strs[0])}</div><div style="width: {pcts[1]}%; background-color: #60a5fa; color: white; font-size: 10px; display: flex; align-items: center; justify-content: center; overflow: hidden;">{get_lbl(pcts[1], t_strs[1])}</div><div style="width: {pcts[2]}%; background-color: #facc15; color: black; font-size: 10px; display: flex; align-items: center; justify-content: center; overflow: hidden;">{get_lbl(pcts[2], t_strs[2])}</div><div style="width: {pcts[3]}%; background-color: #fb923c; color: white; font-size: 10px; display: flex; align-items: center; justify-content: center; overflow: hidden;">{get_lbl(pcts[3], t_strs[3])}</div><div style="width: {pcts[4]}%; background-color: #f87171; color: white; font-size: 10px; display: flex; align-items: center; justify-content: center; overflow: hidden;">{get_lbl(pcts[4], t_strs[4])}</div></div>"""
                             st.markdown(bar_html, unsafe_allow_html=True)
                         if row.get('notes'): st.markdown(f"<div style='margin-top:5px; font-size:0.85rem; color:#475569;'>📝 {row['notes']}</div>", unsafe_allow_html=True)
+                        splits = row.get('splits')
+                        if isinstance(splits, dict) and splits:
+                            summary = summarize_splits(splits)
+                            with st.expander(f"⏱️ Splits{': ' + summary if summary else ''}"):
+                                if splits.get('intervals'):
+                                    st.dataframe(pd.DataFrame([{"Kind": "Work" if iv['k'] == 'W' else "Rest", "Start": format_duration(iv['s'] / 60), "Time": format_duration(iv['d'] / 60), "Dist (m)": iv['m'], "Pace": format_pace((iv['d'] / 60) / (iv['m'] / 1000)) if iv['m'] > 0 else "-", "HR": iv['hr'] or "-"} for iv in splits['intervals']]), hide_index=True, use_container_width=True)
+                                if splits.get('laps'):
+                                    st.dataframe(pd.DataFrame([{"Lap": i + 1, "Dist (m)": lap['m'], "Time": format_duration(lap['d'] / 60), "Pace": format_pace((lap['d'] / 60) / (lap['m'] / 1000)) if lap['m'] > 0 else "-", "HR": lap['hr'] or "-"} for i, lap in enumerate(splits['laps'])]), hide_index=True, use_container_width=True)
             else: st.info("No activities found for this category.")
 
+def render_strength():
+    st.header(":material/fitness_center: Strength Training")
+    setup_page()
+    index = get_lift_index()
+    engine = get_engine()
+    today = get_malaysia_time().date()
+    this_week = week_start(today)
+    if st.session_state.get('lift_log_success'):
+        st.toast("✅ Session Logged!")
+        st.session_state.lift_log_success = False
+
+    with st.expander(":material/add_circle: Log Session"):
+        with st.form("lift_form", clear_on_submit=True):
+            c1, c2, c3, c4 = st.columns([1, 2, 1, 1])
+            l_date = c1.date_input("Date", today)
+            l_name = c2.text_input("Session", placeholder="Upper body, legs...")
+            l_dur = c3.number_input("Duration (min)", min_value=0, value=45)
+            l_rpe = c4.number_input("Session RPE", min_value=1, max_value=10, value=7)
+            st.caption("One row per set; rows for the same exercise are grouped in order.")
+            sets_df = st.data_editor(pd.DataFrame({"Exercise": pd.Series(dtype='str'), "Reps": pd.Series(dtype='int'), "Weight (kg)": pd.Series(dtype='float')}),
+                                     num_rows="dynamic", hide_index=True, use_container_width=True, key="lift_sets")
+            if st.form_submit_button("Save Session"):
+                exercises = {}
+                for rec in sets_df.to_dict('records'):
+                    name = str(rec.get('Exercise') or '').strip() if not pd.isna(rec.get('Exercise')) else ''
+                    if not name: continue
+                    reps = 0 if pd.isna(rec.get('Reps')) else int(rec['Reps'])
+                    weight = 0.0 if pd.isna(rec.get('Weight (kg)')) else float(rec['Weight (kg)'])
+                    exercises.setdefault(lift_key(name), {"name": name, "sets": []})['sets'].append({"reps": reps, "weight": weight})
+                if not exercises: st.error("Add at least one set.")
+                else:
+                    fields = {"date": str(l_date), "name": l_name or "Strength", "duration": float(l_dur), "rpe": int(l_rpe), "exercises": list(exercises.values())}
+                    save_lift_session({"id": submit_once("lift_form", fields), **fields})
+                    rotate_form_token("lift_form")
+                    st.session_state.lift_log_success = True
+                    st.rerun()
+
+    week_sessions = index.week(this_week)
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Sessions This Week", len(week_sessions))
+    m2.metric("Volume This Week", f"{index.volume(None, this_week):,.0f} kg")
+    m3.metric("Strength Load This Week", int(sum(engine.strength_session_load(s) for s in week_sessions)))
+
+    exercises = index.exercises()
+    if exercises:
+        st.subheader("Exercise Progress")
+        ex = st.selectbox("Exercise", exercises, key="lift_exercise")
+        last = get_last_lift_stats(ex)
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Last Session", last['date'].strftime('%b %d') if last else "-")
+        c2.metric("Top Set", f"{last['weight']:g} kg × {last['top_reps']}" if last else "-")
+        c3.metric("Est. 1RM", f"{last['e1rm']:.1f} kg" if last and last['e1rm'] else "-")
+        c4.metric("Volume This Week", f"{index.volume(ex, this_week):,.0f} kg")
+        hist = [e for e in index.history(ex, today - timedelta(days=365), today) if e['e1rm'] > 0]
+        g1, g2 = st.columns(2)
+        with g1:
+            if hist:
+                fig = px.line(pd.DataFrame({"Date": [e['date'] for e in hist], "e1RM (kg)": [e['e1rm'] for e in hist]}), x="Date", y="e1RM (kg)", title="Estimated 1RM", markers=True)
+                fig.update_layout(height=260, margin=dict(l=20, r=20, t=40, b=20), xaxis_title=None)
+                st.plotly_chart(fig, use_container_width=True)
+        with g2:
+            weeks = [this_week - timedelta(weeks=w) for w in range(11, -1, -1)]
+            fig = px.bar(pd.DataFrame({"Week": weeks, "Volume (kg)": [index.volume(ex, w) for w in weeks]}), x="Week", y="Volume (kg)", title="Weekly Volume")
+            fig.update_traces(marker_color='#64748b')
+            fig.update_layout(height=260, margin=dict(l=20, r=20, t=40, b=20), xaxis_title=None)
+            st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Recent Sessions")
+    sessions = sorted(st.session_state.data['lifts'], key=lambda l: l.get('date', ''), reverse=True)[:20]
+    if not sessions: st.info("No strength sessions logged yet.")
+    for l in sessions:
+        with st.container(border=True):
+            c_date, c_info, c_act = st.columns([1.5, 6, 1])
+            c_date.markdown(f"**{datetime.strptime(l['date'], '%Y-%m-%d').strftime('%A, %b %d')}**")
+            summary = []
+            for ex in l.get('exercises', []):
+                s = exercise_summary(ex)
+                if s: summary.append(f"{ex['name']} {s['sets']}×{round(s['reps'] / s['sets'])} @ {s['weight']:g}kg")
+            c_info.markdown(f"<div style='line-height: 1.5;'><span class='history-value'>{l.get('name', 'Strength')}</span> <span class='history-sub'>{format_duration(l.get('duration', 0))} | RPE {l.get('rpe', '-')} | Load {int(engine.strength_session_load(l))}</span><br><span class='history-sub'>{' · '.join(summary)}</span></div>", unsafe_allow_html=True)
+            if c_act.button(":material/delete:", key=f"del_lift_{l['id']}"): delete_lift_session(l['id']); st.rerun()
+
 def render_trends():
     st.header(":material/calendar_today: Activity Calendar")
     setup_page()
@@ -1012,13 +3166,11 @@ def render_trends():
     year = st.session_state.cal_date.year
     month = st.session_state.cal_date.month
     
-    runs = st.session_state.data['runs']
-    runs_df = pd.DataFrame(runs)
-    if not runs_df.empty:
-        runs_df['date_dt'] = pd.to_datetime(runs_df['date']).dt.date
-    
     # Calendar Generation (Full Weeks)
     cal = calendar.Calendar(firstweekday=0).monthdatescalendar(year, month)
+    table = get_activity_table()
+    month_df = table.between(cal[0][0], cal[-1][-1])
+    runs_by_day = {d.date(): g['id'] for d, g in month_df.groupby('date', sort=False)}
     
     # Headers
     cols = st.columns([1]*7 + [1.5]) # 7 Days + 1 Summary
@@ -1041,9 +3193,7 @@ def render_trends():
         for i, current_date in enumerate(week):
             with cols[i]:
                 # Check for runs
-                day_runs = []
-                if not runs_df.empty:
-                    day_runs = runs_df[runs_df['date_dt'] == current_date]
+                day_runs = runs_by_day.get(current_date)
                 
                 # Visual distinction
                 is_current_month = current_date.month == month
@@ -1060,8 +3210,8 @@ def render_trends():
                     # Spacer to ensure minimum height
                     st.markdown("""<div style="height:30px"></div>""", unsafe_allow_html=True)
                     
-                    if not day_runs.empty:
-                         for _, r in day_runs.iterrows():
+                    if day_runs is not None:
+                         for r in map(table.record, day_runs):
                             # Minimal display: Icon + Dist
                             icon = "directions_run" if r['type'] == "Run" else "directions_walk" if r['type'] == "Walk" else "sports_handball"
                             st.markdown(f"""
@@ -1088,9 +3238,277 @@ def render_trends():
             else:
                 st.write("")
 
+def render_records():
+    st.header(":material/emoji_events: Records")
+    setup_page()
+    index = get_records_index()
+    tabs = st.tabs(["All Activities", "Run", "Walk", "Ultimate"])
+    for tab, act_type in zip(tabs, ["All", "Run", "Walk", "Ultimate"]):
+        with tab:
+            def record_line(label, rec, fmt):
+                if not rec: return f"<div class='history-sub'>{label}</div><div class='history-value'>-</div>"
+                value, run = rec
+                return f"<div class='history-sub'>{label}</div><div class='history-value'>{fmt(value)}</div><div class='history-sub'>{run['date']} · {run['type']} {run['distance']}km</div>"
+            if act_type != "Ultimate":
+                st.markdown("**Fastest Pace**")
+                cols = st.columns(len(RECORD_DISTANCES))
+                for col, label in zip(cols, RECORD_DISTANCES):
+                    with col.container(border=True):
+                        st.markdown(record_line(label, index.best('pace', act_type, label), lambda v: format_pace(v / 60) + "/km"), unsafe_allow_html=True)
+            st.markdown("**Bests**")
+            c1, c2, c3, c4 = st.columns(4)
+            with c1.container(border=True): st.markdown(record_line("Longest Distance", index.best('distance', act_type), lambda v: f"{v:.2f} km"), unsafe_allow_html=True)
+            with c2.container(border=True): st.markdown(record_line("Longest Duration", index.best('duration', act_type), format_duration), unsafe_allow_html=True)
+            with c3.container(border=True): st.markdown(record_line("Highest Load", index.best('load', act_type), lambda v: f"{int(v)}"), unsafe_allow_html=True)
+            with c4.container(border=True):
+                week = index.best_week(act_type)
+                if week: st.markdown(f"<div class='history-sub'>Biggest Week</div><div class='history-value'>{week[0]:.1f} km</div><div class='history-sub'>Week of {week[1].strftime('%b %d, %Y')}</div>", unsafe_allow_html=True)
+                else: st.markdown("<div class='history-sub'>Biggest Week</div><div class='history-value'>-</div>", unsafe_allow_html=True)
+
+def render_zones():
+    st.header(":material/stacked_bar_chart: Intensity Distribution")
+    setup_page()
+    index = get_zone_index()
+    types = index.types()
+    if not types:
+        st.info("Log activities with heart rate zone times to see your intensity distribution."); return
+    today = get_malaysia_time().date()
+    c1, c2 = st.columns(2)
+    picked = c1.date_input("Range", (today - timedelta(weeks=12), today), key="zone_range")
+    sel_types = c2.multiselect("Activity Types", types, default=types, key="zone_types")
+    if not isinstance(picked, (tuple, list)) or len(picked) != 2 or not sel_types:
+        st.info("Pick a start and end date and at least one activity type."); return
+    start, end = picked
+    zones = index.range(start, end, sel_types)
+    if zones.sum() <= 0:
+        st.info("No zone time recorded in this range."); return
+
+    low, mid, high = three_zone_split(zones)
+    pi = polarization_index(zones)
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("Zone Time", format_duration(zones.sum()))
+    m2.metric("Low (Z1-2)", f"{low * 100:.0f}%")
+    m3.metric("Threshold (Z3)", f"{mid * 100:.0f}%")
+    m4.metric("High (Z4-5)", f"{high * 100:.0f}%")
+    m5.metric("Polarization Index", f"{pi:.2f}" if pi is not None else "-", distribution_label(zones), delta_color="off")
+
+    first = week_start(start); weeks = (week_start(end) - first).days // 7 + 1
+    week_dates = [first + timedelta(weeks=w) for w in range(weeks)]
+    st.subheader("Weekly Time in Zone")
+    stack = index.weekly(first, weeks, sel_types)
+    stack_df = pd.DataFrame(stack / 60, columns=[z.upper() for z in ZONE_KEYS]).assign(Week=week_dates).melt(id_vars='Week', var_name='Zone', value_name='Hours')
+    fig = px.bar(stack_df, x='Week', y='Hours', color='Zone', color_discrete_sequence=ZONE_COLORS)
+    fig.update_layout(height=320, margin=dict(l=20, r=20, t=20, b=20), xaxis_title=None, legend_title=None, bargap=0.15)
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Polarization Trend (4-week rolling)")
+    trend = []
+    for t in sel_types:
+        for wk, z in zip(week_dates, index.weekly(first, weeks, [t], span=4)):
+            p = polarization_index(z)
+            if p is not None: trend.append({"Week": wk, "Type": t, "PI": p})
+    if trend:
+        fig_pi = px.line(pd.DataFrame(trend), x='Week', y='PI', color='Type', markers=True)
+        fig_pi.add_hline(y=POLARIZED_PI, line_dash="dash", line_color="#94a3b8", annotation_text="Polarized", annotation_position="top left")
+        fig_pi.update_layout(height=280, margin=dict(l=20, r=20, t=20, b=20), xaxis_title=None, legend_title=None)
+        st.plotly_chart(fig_pi, use_container_width=True)
+
+    st.subheader("By Activity Type")
+    rows = []
+    for t in sel_types:
+        z = index.range(start, end, [t])
+        if z.sum() <= 0: continue
+        tl, tm, th = three_zone_split(z)
+        p = polarization_index(z)
+        rows.append({"Type": t, "Time": format_duration(z.sum()), "Low": f"{tl * 100:.0f}%", "Threshold": f"{tm * 100:.0f}%", "High": f"{th * 100:.0f}%",
+                     "PI": round(p, 2) if p is not None else None, "Profile": distribution_label(z)})
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+def render_gear():
+    st.header(":material/steps: Gear")
+    setup_page()
+    gear = st.session_state.data['gear']
+    with st.expander(":material/add_circle: Add Gear"):
+        with st.form("gear_form", clear_on_submit=True):
+            c1, c2, c3 = st.columns([2, 1, 1])
+            g_name = c1.text_input("Name", placeholder="Pegasus 41 (blue)")
+            g_limit = c2.number_input("Retire at (km)", min_value=50, value=GEAR_RETIRE_KM, step=50)
+            g_start = c3.number_input("Starting km", min_value=0.0, value=0.0, step=10.0)
+            if st.form_submit_button("Add"):
+                if not g_name.strip(): st.error("Give the gear a name.")
+                else:
+                    fields = {"name": g_name.strip(), "type": "Shoe", "retireKm": float(g_limit), "startKm": float(g_start), "retired": False,
+                              "added": str(get_malaysia_time().date()), "distance": 0.0, "duration": 0.0, "count": 0}
+                    save_gear({"id": submit_once("gear_form", fields), **fields})
+                    rotate_form_token("gear_form")
+                    st.rerun()
+
+    if not gear:
+        st.info("No gear yet. Add a pair of shoes to start tracking mileage."); return
+    show_retired = st.toggle("Show retired", value=False)
+    for g in sorted(gear, key=lambda g: (bool(g.get('retired')), -gear_total_km(g))):
+        if g.get('retired') and not show_retired: continue
+        total, limit = gear_total_km(g), float(g.get('retireKm') or GEAR_RETIRE_KM)
+        with st.container(border=True):
+            c_name, c_stats, c_act = st.columns([2, 4, 1.2])
+            c_name.markdown(f"**{g['name']}**" + (" <span class='status-badge status-gray'>Retired</span>" if g.get('retired') else ""), unsafe_allow_html=True)
+            c_name.caption(f"Added {g.get('added', '-')}")
+            c_stats.progress(min(total / limit, 1.0), text=f"{total:.0f} / {limit:.0f} km · {int(g.get('count', 0))} activities · {format_duration(g.get('duration', 0))}")
+            if total >= limit and not g.get('retired'): c_stats.warning("Past its retirement mileage.")
+            with c_act:
+                if st.button("Unretire" if g.get('retired') else "Retire", key=f"retire_{g['id']}"): save_gear({"id": g['id'], "retired": not g.get('retired')}); st.rerun()
+                if st.button(":material/delete:", key=f"del_gear_{g['id']}"): delete_gear(g['id']); st.rerun()
+    if st.button("Recount from history", help="Rebuild every total from the activity log."): recount_gear(); st.rerun()
+
+def render_forecast():
+    st.header(":material/insights: Load Forecast")
+    setup_page()
+    data = st.session_state.data
+    engine = get_engine()
+    easy_pace = recent_easy_pace(data['runs'])
+
+    with st.expander(":material/edit_calendar: Weekly Plan & Cycles", expanded=not any(v.get('am') or v.get('pm') for v in data['weekly_plan'].values())):
+        with st.form("plan_form"):
+            cc1, cc2, cc3 = st.columns(3)
+            macro = cc1.text_input("Macro Cycle", value=data['cycles'].get('macro', ''))
+            meso = cc2.text_input("Meso Cycle", value=data['cycles'].get('meso', ''))
+            micro = cc3.text_input("Micro Cycle", value=data['cycles'].get('micro', ''))
+            st.caption("Sessions, e.g. \"Easy 10k\", \"Intervals 6x800m\", \"Tempo 40min\", \"Long run 1.5h\", \"Gym\", \"Rest\"")
+            new_plan = {}
+            for day in WEEKDAYS:
+                c_day, c_am, c_pm = st.columns([1, 2, 2])
+                c_day.markdown(f"**{day[:3]}**")
+                am = c_am.text_input(f"{day} AM", value=data['weekly_plan'].get(day, {}).get('am', ''), label_visibility="collapsed", placeholder="AM")
+                pm = c_pm.text_input(f"{day} PM", value=data['weekly_plan'].get(day, {}).get('pm', ''), label_visibility="collapsed", placeholder="PM")
+                new_plan[day] = {"am": am, "pm": pm}
+            if st.form_submit_button("Save Plan"):
+                data['cycles'] = {"macro": macro, "meso": meso, "micro": micro}
+                data['weekly_plan'] = new_plan
+                save_plan(); st.success("Plan saved!"); st.rerun()
+
+    week_loads = engine.planned_week_loads(data['weekly_plan'], easy_pace)
+    if week_loads.sum() <= 0:
+        st.info("Add sessions to the weekly plan to forecast training load.")
+        return
+    st.caption("Planned weekly load: " + " · ".join(f"{d[:3]} {int(l)}" for d, l in zip(WEEKDAYS, week_loads)) + f" (total {int(week_loads.sum())})")
+
+    with st.container(border=True):
+        s1, s2, s3, s4 = st.columns(4)
+        weeks = s1.slider("Weeks Ahead", 1, 12, 6)
+        volume = s2.slider("Volume Multiplier", 0.5, 1.5, 1.0, 0.05)
+        taper = s3.slider("Taper (weeks)", 0, min(3, weeks), 0)
+        taper_factor = s4.slider("Taper Volume", 0.3, 1.0, 0.6, 0.05)
+
+    today = get_malaysia_time().date()
+    df_ewma = engine.calculate_ewma_status(data['runs'], lifts=data['lifts'])
+    atl0, ctl0 = (float(df_ewma['atl'].iloc[-1]), float(df_ewma['ctl'].iloc[-1])) if not df_ewma.empty else (0.0, 0.0)
+    recent = df_ewma['load'].to_numpy() if not df_ewma.empty else np.zeros(0)
+    multipliers = np.round(np.arange(0.5, 1.5001, 0.05), 2)
+    taper_weeks = np.arange(0, min(3, weeks) + 1)
+    loads, mult, tap = build_plan_scenarios(week_loads, (today.weekday() + 1) % 7, weeks, multipliers, taper_weeks, taper_factor)
+    fc = engine.forecast_scenarios(atl0, ctl0, recent, loads)
+    sel = int(np.argmin(np.abs(mult - volume) + 10 * (tap != taper)))
+    dates = [today + timedelta(days=i + 1) for i in range(loads.shape[1])]
+
+    end_ctl, end_atl, end_tsb = fc['ctl'][sel, -1], fc['atl'][sel, -1], fc['tsb'][sel, -1]
+    peak_acwr = fc['acwr'][sel].max()
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Fitness (CTL)", f"{int(end_ctl)}", f"{int(end_ctl - ctl0)}")
+    m2.metric("Fatigue (ATL)", f"{int(end_atl)}", f"{int(end_atl - atl0)}", delta_color="inverse")
+    m3.metric("Form (TSB)", f"{int(end_tsb)}", f"{int(end_tsb - (ctl0 - atl0))}")
+    m4.metric("Peak ACWR", f"{peak_acwr:.2f}", help="Green zone 0.8 - 1.3. Above 1.5 is a load spike.")
+    if peak_acwr > 1.5: st.error("This plan spikes ACWR above 1.5. Consider a lower volume multiplier.")
+    elif end_tsb < -30: st.warning("Form ends below -30. Fatigue outpaces fitness by the end of this block.")
+
+    same_taper = tap == taper
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=dates, y=fc['ctl'][same_taper].max(axis=0), mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'))
+    fig.add_trace(go.Scatter(x=dates, y=fc['ctl'][same_taper].min(axis=0), mode='lines', line=dict(width=0), fill='tonexty', fillcolor='rgba(34, 197, 94, 0.15)', name='CTL range (0.5x-1.5x)'))
+    fig.add_trace(go.Scatter(x=dates, y=fc['ctl'][sel], name='Fitness (CTL)', line=dict(color='rgba(34, 197, 94, 0.9)')))
+    fig.add_trace(go.Scatter(x=dates, y=fc['atl'][sel], name='Fatigue (ATL)', line=dict(color='#be123c')))
+    fig.add_trace(go.Scatter(x=dates, y=fc['tsb'][sel], name='Form (TSB)', line=dict(color='#3b82f6', dash='dot')))
+    fig.add_trace(go.Bar(x=dates, y=loads[sel], name='Planned Load', marker_color='rgba(120, 113, 108, 0.3)'))
+    fig.update_layout(title="Projected Performance Management", height=400, margin=dict(l=20, r=20, t=40, b=20), hovermode="x unified")
+    st.plotly_chart(fig, use_container_width=True)
+
+    grid = pd.DataFrame({'Volume': mult, 'Taper': tap, 'TSB': fc['tsb'][:, -1]}).pivot(index='Taper', columns='Volume', values='TSB')
+    fig_grid = px.imshow(grid, color_continuous_scale='RdYlGn', aspect='auto', labels=dict(color="End TSB"), title="End-of-Block Form by Scenario")
+    fig_grid.update_layout(height=260, margin=dict(l=20, r=20, t=40, b=20), yaxis_title="Taper (weeks)", xaxis_title="Volume multiplier")
+    st.plotly_chart(fig_grid, use_container_width=True)
+
+def render_compliance():
+    st.header(":material/fact_check: Plan Compliance")
+    setup_page()
+    data = st.session_state.data
+    if not any(v.get('am') or v.get('pm') for p in plan_versions(data) for v in p['weekly_plan'].values()):
+        st.info("Add sessions to the weekly plan (Forecast tab) to track how closely you follow it."); return
+    index = get_compliance_index()
+    today = get_malaysia_time().date()
+    c1, c2 = st.columns([2, 1])
+    picked = c1.date_input("Season", (today - timedelta(weeks=26), today), key="compliance_range")
+    level = c2.radio("Color by", ["Macro", "Meso", "Micro"], index=1, horizontal=True, key="compliance_cycle")
+    if not isinstance(picked, (tuple, list)) or len(picked) != 2:
+        st.info("Pick a start and end date."); return
+    start, end = picked
+    weeks = index.season(start, end, today)
+    if not weeks:
+        st.info("No weeks in this range."); return
+
+    current_monday = week_start(today)
+    finished = [w for w in weeks if w['monday'] < current_monday]
+    scored = [w['score'] for w in weeks if w['score'] is not None]
+    cur_streak, best_streak = adherence_streaks([w['score'] for w in finished])
+    this_day = index.day(today)
+    day_end = today if this_day['done'] >= this_day['planned'] else today - timedelta(days=1)
+    day_streak, best_day_streak = index.day_streaks(week_start(start), min(end, day_end)) if start <= day_end else (0, 0)
+    this_week = weeks[-1] if weeks[-1]['monday'] == current_monday else None
+    planned, done = sum(w['planned'] for w in weeks), sum(w['done'] for w in weeks)
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("This Week", f"{this_week['score']:.0f}" if this_week and this_week['score'] is not None else "-")
+    m2.metric("Season Avg", f"{np.mean(scored):.0f}" if scored else "-")
+    m3.metric("Sessions Done", f"{done}/{planned}", f"{done / planned * 100:.0f}%" if planned else None, delta_color="off")
+    m4.metric("Week Streak", f"{cur_streak}", f"best {best_streak}", delta_color="off", help=f"Consecutive finished weeks scoring {COMPLIANCE_TARGET}+.")
+    m5.metric("Day Streak", f"{day_streak}", f"best {best_day_streak}", delta_color="off", help="Consecutive planned days with every session done.")
+
+    st.subheader("Weekly Compliance")
+    df = pd.DataFrame([{"Week": w['monday'], "Score": w['score'], "Completion": w['done'] / w['planned'] * 100 if w['planned'] else None,
+                        "Volume": w['actual_min'] / w['planned_min'] * 100 if w['planned_min'] else None,
+                        "Cycle": w['cycles'].get(level.lower()) or "(unlabelled)"} for w in weeks])
+    fig = px.bar(df, x='Week', y='Score', color='Cycle', hover_data={'Completion': ':.0f', 'Volume': ':.0f'})
+    fig.add_trace(go.Scatter(x=df['Week'], y=df['Completion'], name='Completion %', mode='lines+markers', line=dict(color='#64748b', dash='dot')))
+    fig.add_hline(y=COMPLIANCE_TARGET, line_dash="dash", line_color="#22c55e", annotation_text="Target", annotation_position="top left")
+    fig.update_layout(height=340, margin=dict(l=20, r=20, t=20, b=20), xaxis_title=None, yaxis_range=[0, 105], legend_title=None, bargap=0.15)
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Volume vs Plan")
+    fig_v = go.Figure()
+    fig_v.add_trace(go.Bar(x=df['Week'], y=[w['planned_min'] / 60 for w in weeks], name='Planned (h)', marker_color='rgba(148, 163, 184, 0.5)'))
+    fig_v.add_trace(go.Bar(x=df['Week'], y=[w['actual_min'] / 60 for w in weeks], name='Actual (h)', marker_color='#3b82f6'))
+    fig_v.update_layout(height=260, margin=dict(l=20, r=20, t=20, b=20), barmode='group', hovermode="x unified")
+    st.plotly_chart(fig_v, use_container_width=True)
+
+    st.subheader("This Week")
+    rows = []
+    for i in range(7):
+        d = current_monday + timedelta(days=i)
+        res = index.day(d)
+        for sess in res['sessions']:
+            p, a = sess['plan'], sess['actual']
+            status = "✅ Done" if a else ("⏳ Upcoming" if d >= today else "❌ Missed")
+            rows.append({"Day": d.strftime('%a %d'), "Planned": p['text'], "Actual": f"{a['type']} {format_duration(a['duration'])}" if a else "-", "Status": status,
+                         "Volume": f"{sess['volume'] * 100:+.0f}%" if sess['volume'] is not None else "-",
+                         "Intensity": {None: "-", 0: "On target"}.get(sess['level'], "Harder" if (sess['level'] or 0) > 0 else "Easier")})
+        for a in res['extra']:
+            rows.append({"Day": d.strftime('%a %d'), "Planned": "-", "Actual": f"{a['type']} {format_duration(a['duration'])}", "Status": "➕ Unplanned", "Volume": "-", "Intensity": "-"})
+    if rows: st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    else: st.caption("Nothing planned or logged this week.")
+
 def render_share():
     st.header(":material/share: Export Data")
     setup_page()
+    if st.session_state.get('restore_msg'):
+        st.toast(st.session_state.restore_msg)
+        st.session_state.restore_msg = None
     
     with st.container(border=True):
         st.subheader("Configuration")
@@ -1122,41 +3540,116 @@ def render_share():
         
         st.divider()
         
-        # New: CSV Download Buttons
-        runs = st.session_state.data.get('runs', [])
-        health = st.session_state.data.get('health_logs', [])
-        
-        if runs:
-            df_runs = pd.DataFrame(runs)
-            csv_runs = df_runs.to_csv(index=False).encode('utf-8')
-            st.download_button("📥 Download Activities CSV", data=csv_runs, file_name="activities_export.csv", mime="text/csv")
-            
-        if health:
-            df_health = pd.DataFrame(health)
-            csv_health = df_health.to_csv(index=False).encode('utf-8')
-            st.download_button("📥 Download Health CSV", data=csv_health, file_name="health_export.csv", mime="text/csv")
+        # Data export: built on demand for the selected range and types
+        st.markdown("**Data Export**")
+        e1, e2, e3 = st.columns(3)
+        exp_dataset = e1.radio("Dataset", ["Activities", "Health Logs"], horizontal=True)
+        fmt_options = ["CSV", "Parquet"] if pq is not None else ["CSV"]
+        exp_fmt = e2.radio("Format", fmt_options, horizontal=True, help=None if pq is not None else "Install pyarrow to enable Parquet.")
+        exp_derived = e3.checkbox("Derived columns (Load, Focus, TE, ATL/CTL)", value=False, disabled=(exp_dataset != "Activities"))
+        exp_types = [t for t, on in (("Run", opt_run), ("Walk", opt_walk), ("Ultimate", opt_ult)) if on]
+        dataset_key = "runs" if exp_dataset == "Activities" else "health_logs"
+        exp_key = (dataset_key, exp_fmt, str(start_r), str(end_r), tuple(exp_types), exp_derived)
+        if st.button("📦 Prepare Export"):
+            with st.spinner("Building export..."):
+                payload = build_export(dict(st.session_state.data, user_profile=get_derived().profile), dataset_key, exp_fmt, start_r, end_r, exp_types if dataset_key == "runs" else None, exp_derived)
+            st.session_state.export_file = (exp_key, payload)
+        ready = st.session_state.get('export_file')
+        if ready and ready[0] == exp_key:
+            ext, mime = ("parquet", "application/octet-stream") if exp_fmt == "Parquet" else ("csv", "text/csv")
+            fname = f"{'activities' if dataset_key == 'runs' else 'health'}_{start_r}_{end_r}.{ext}"
+            st.download_button(f"📥 Download {exp_dataset} {exp_fmt}", data=ready[1], file_name=fname, mime=mime)
         
         st.divider()
         
-        if st.button("📄 Generate Text Report", type="primary"):
-            selected_cats = []
-            if opt_run: selected_cats.append("Run")
-            if opt_walk: selected_cats.append("Walk")
-            if opt_ult: selected_cats.append("Ultimate")
-            if opt_health: selected_cats.append("Stats")
-            
-            options = {
-                'run': opt_run, 'walk': opt_walk, 'ultimate': opt_ult,
-                'health': opt_health, 'status': opt_status, 'adv_status': opt_adv,
-                'det_physio': det_physio, 'det_adv': det_adv, 'det_zones': det_zones, 'det_notes': det_notes
-            }
-            report_text = generate_report(start_r, end_r, options)
-            st.text_area("Copy this text:", value=report_text, height=500)
+        options = {
+            'run': opt_run, 'walk': opt_walk, 'ultimate': opt_ult,
+            'health': opt_health, 'status': opt_status, 'adv_status': opt_adv,
+            'det_physio': det_physio, 'det_adv': det_adv, 'det_zones': det_zones, 'det_notes': det_notes
+        }
+        report_mode = st.radio("Report Mode", ["Single", "Weekly Batch", "Monthly Batch"], horizontal=True)
+        if st.button("📄 Generate Text Report" if report_mode == "Single" else "🗂️ Generate Report Batch", type="primary"):
+            ranges = [(start_r, end_r)] if report_mode == "Single" else report_ranges(start_r, end_r, "Weekly" if report_mode == "Weekly Batch" else "Monthly")
+            st.session_state.report_job = submit_report_job(ranges, options, batch=(report_mode != "Single"))
+        render_report_job()
+
+    with st.container(border=True):
+        st.subheader("Snapshots")
+        pending = len(pending_changes())
+        s1, s2 = st.columns([3, 1])
+        s1.caption(f"Incremental snapshots in `{SNAPSHOT_DIR}` · {pending} unsnapshotted change(s) · full checkpoint every {SNAPSHOT_CHECKPOINT_EVERY}")
+        if s2.button("📸 Snapshot Now", use_container_width=True):
+            m = maybe_snapshot(force=True, label="manual")
+            st.toast(f"Snapshot {m['id']} saved ({m['kind']}, {m['changes']} change(s))")
+        snaps = list_snapshots()
+        if not snaps: st.info("No snapshots yet. One is taken automatically after changes are saved.")
+        else:
+            st.dataframe(pd.DataFrame([{"Snapshot": m['id'], "Created": m['created'], "Kind": m['kind'], "Changes": m['changes'], "Label": m.get('label', '')} for m in snaps]),
+                         hide_index=True, use_container_width=True)
+            r1, r2 = st.columns([3, 1])
+            target = r1.selectbox("Restore to", [m['id'] for m in snaps], format_func=lambda i: next(f"{m['created']} · {m['kind']} · {i}" for m in snaps if m['id'] == i))
+            confirm = r1.checkbox("Replace the current data with this snapshot")
+            if r2.button("⏪ Restore", disabled=not confirm, use_container_width=True):
+                with st.spinner("Restoring..."): apply_restore(target)
+                st.session_state.restore_msg = f"✅ Restored snapshot {target}."; st.rerun()
+
+def report_ranges(start_date, end_date, period):
+    ranges, cur = [], start_date
+    while cur <= end_date:
+        if period == "Weekly": nxt = week_start(cur) + timedelta(days=7)
+        else: nxt = (cur.replace(day=28) + timedelta(days=4)).replace(day=1)
+        ranges.append((cur, min(nxt - timedelta(days=1), end_date)))
+        cur = nxt
+    return ranges
+
+def report_cache_key(start_date, end_date, options):
+    return (str(start_date), str(end_date), tuple(sorted(options.items())), st.session_state.get('data_version', 0))
+
+def submit_report_job(ranges, options, batch=False):
+    cache = st.session_state.setdefault('report_cache', {})
+    keys = [report_cache_key(a, b, options) for a, b in ranges]
+    job = BackgroundJob("Batch reports" if batch else "Report", keys, batch=batch)
+    snapshot = None
+    for key, (a, b) in zip(keys, ranges):
+        if key in cache: job.report(key, 1.0); continue
+        if snapshot is None:
+            snapshot = data_snapshot()
+            snapshot['user_profile'] = copy.deepcopy(get_derived().profile)
+            snapshot['load_rolling'] = get_load_rolling()
+        job.submit(key, generate_report, a, b, options, data=snapshot)
+    return job
+
+def render_report_job():
+    job = st.session_state.get('report_job')
+    if job is None: return
+    polling = not job.finished()
+    @st.fragment(run_every=1.0 if polling else None)
+    def job_panel():
+        if not job.finished():
+            st.progress(job.progress(), text=f"{job.label}: {int(job.progress() * 100)}%")
+            return
+        if polling: st.rerun()  # re-render once without the polling timer
+        cache = st.session_state.setdefault('report_cache', {})
+        cache.update(job.results())
+        while len(cache) > 64: cache.pop(next(iter(cache)))
+        for key, err in job.errors().items(): st.error(f"Report {key[0]} - {key[1]} failed: {err}")
+        texts = [(k, cache[k]) for k in job.keys if k in cache]
+        if not texts: return
+        if job.meta.get('batch'):
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for k, text in texts: zf.writestr(f"report_{k[0]}_{k[1]}.txt", text)
+            st.success(f"{len(texts)} reports ready.")
+            st.download_button("📥 Download Reports (zip)", data=buf.getvalue(), file_name=f"reports_{job.keys[0][0]}_{job.keys[-1][1]}.zip", mime="application/zip")
+        else:
+            st.text_area("Copy this text:", value=texts[0][1], height=500)
+    job_panel()
 
 # --- Main App Logic ---
 def main():
     if 'data' not in st.session_state:
         st.session_state.data = load_data()
+    apply_recompute()
 
     selected_tab = render_sidebar()
 
@@ -1164,8 +3657,20 @@ def main():
         render_training_status()
     elif selected_tab == "Cardio Training":
         render_cardio()
+    elif selected_tab == "Strength Training":
+        render_strength()
     elif selected_tab == "Activity Calendar":
         render_trends()
+    elif selected_tab == "Records":
+        render_records()
+    elif selected_tab == "Intensity":
+        render_zones()
+    elif selected_tab == "Gear":
+        render_gear()
+    elif selected_tab == "Forecast":
+        render_forecast()
+    elif selected_tab == "Compliance":
+        render_compliance()
     elif selected_tab == "Export":
         render_share()
 